@@ -0,0 +1,20 @@
+# Generated by Django 4.2 on 2026-10-18 18:57
+
+from django.db import migrations, models
+import myauth.models
+import mysite.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myauth', '0002_profile_avatar'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='avatar',
+            field=models.ImageField(null=True, storage=mysite.storage.ContentAddressedStorage(), upload_to=myauth.models.user_preview_directory_path),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
 from django.db import models
 
+from mysite.storage import content_storage
+
 
 def user_preview_directory_path(instance: 'User', filename: str) -> str:
     return 'users/user_{pk}/avatar/{filename}'.format(pk=instance.pk, filename=filename)
@@ -10,4 +12,4 @@ class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(max_length=500, blank=True)
     agreement_accepted = models.BooleanField(default=False)
-    avatar = models.ImageField(null=True, upload_to=user_preview_directory_path)
+    avatar = models.ImageField(null=True, upload_to=user_preview_directory_path, storage=content_storage)
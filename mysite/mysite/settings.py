@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 from django.urls import reverse_lazy
@@ -66,6 +68,9 @@ MIDDLEWARE = [
 
     # 'requestdataapp.middlewares.set_useragent_on_request_middleware',
     'requestdataapp.middlewares.CountRequestsMiddleware',
+    'requestdataapp.middlewares.SlowRequestMiddleware',
+    'requestdataapp.middlewares.SQLProfilerMiddleware',
+    'requestdataapp.middlewares.ProfilingMiddleware',
     'requestdataapp.middlewares.ThrottlingMiddleware',
     'django.middleware.locale.LocaleMiddleware',
 ]
@@ -151,6 +156,12 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'uploads'
 
+# shopapp.uploads: обработчики по умолчанию, которые заодно считают SHA-256 файла
+FILE_UPLOAD_HANDLERS = [
+    'shopapp.uploads.HashingMemoryFileUploadHandler',
+    'shopapp.uploads.HashingTemporaryFileUploadHandler',
+]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -174,3 +185,43 @@ SPECTACULAR_SETTINGS = {
     'VERSION': '1.0.0',
     'SERVE_INCLUDE_SCHEMA': False,
 }
+
+# requestdataapp.middlewares.ThrottlingMiddleware, см. requestdataapp/throttling.py
+THROTTLING = {
+    'BACKEND': 'local',
+    'CACHE_ALIAS': 'default',
+    'MAX_CLIENTS': 10000,
+    'GROUPS': [
+        {'name': 'export', 'pattern': r'^/[\w-]+/shop/(async/)?(products|orders)/export/', 'rate': 30, 'period': 60},
+        {'name': 'api', 'pattern': r'^/[\w-]+/shop/(api|async)/', 'rate': 300, 'period': 60},
+        {'name': 'default', 'pattern': '', 'rate': 500, 'period': 60},
+    ],
+}
+
+# requestdataapp.metrics: файлы счётчиков воркеров, общий каталог для всех процессов
+# сервиса. Очищайте его при деплое, иначе в сумму попадут счётчики старых процессов.
+METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'mysite-metrics')
+
+# requestdataapp.middlewares.SQLProfilerMiddleware, см. requestdataapp/sqlprofile.py
+SQL_PROFILER = {
+    'SAMPLE_RATE': 1.0 if DEBUG else 0.01,
+    'N_PLUS_ONE_THRESHOLD': 5,
+    'SERVER_TIMING': True,
+}
+
+# requestdataapp.middlewares.ProfilingMiddleware, см. requestdataapp/profiling.py
+PROFILING = {
+    'DIR': os.environ.get('PROFILING_DIR') or os.path.join(tempfile.gettempdir(), 'mysite-profiles'),
+    'MAX_FILES': 50,
+    'TOKEN_MAX_AGE': 3600,
+}
+
+# requestdataapp.middlewares.SlowRequestMiddleware и manage.py perf_report, см. requestdataapp/slowlog.py
+SLOW_REQUESTS = {
+    'DIR': os.environ.get('SLOW_REQUESTS_DIR') or os.path.join(tempfile.gettempdir(), 'mysite-perf'),
+    'THRESHOLD_MS': 500,
+    'RESERVOIR_SIZE': 1024,
+    'MAX_VIEWS': 500,
+    'FLUSH_INTERVAL': 10,
+    'LOG_MAX_BYTES': 10 * 1024 * 1024,
+}
@@ -0,0 +1,270 @@
+"""
+Хранилище загрузок по содержимому.
+
+Файл сохраняется под SHA-256 своего содержимого в дереве из двух уровней
+каталогов: ``cas/ab/cd/abcd...ef.png``. Одинаковые файлы хранятся один
+раз, а рядом с каждым лежит ``.refs`` со счётчиком ссылок: ``save()``
+увеличивает его, ``delete()`` уменьшает и удаляет файл на нуле. Путь
+из ``upload_to`` поля используется только ради расширения.
+
+Счётчик живёт вне базы, поэтому его надо держать в согласии с ней:
+ссылки удалённых строк и заменённых или очищенных файлов снимаются после
+коммита, а ``atomic_refs()`` снимает ссылки, взятые в откаченной транзакции.
+
+Файлы, загруженные до перехода (без префикса ``cas/``), удаляются
+как в обычном ``FileSystemStorage``.
+"""
+
+import hashlib
+import os
+import posixpath
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+from django.core.files import locks
+from django.core.files.storage import FileSystemStorage
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils.deconstruct import deconstructible
+
+CAS_PREFIX = 'cas'
+REFS_SUFFIX = '.refs'
+# длиннее расширения бывают только у мусорных имён
+MAX_EXTENSION_LENGTH = 10
+
+# ссылки, взятые внутри atomic_refs(): по списку на каждый вложенный блок
+_taken = threading.local()
+
+
+class _Refs:
+    def __init__(self, file):
+        self.file = file
+        file.seek(0)
+        self.count = int(file.read().strip() or 0)
+
+    def save(self, count: int) -> None:
+        self.count = count
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(str(count).encode())
+        self.file.flush()
+
+
+@deconstructible(path='mysite.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    def __init__(self, prefix: str = CAS_PREFIX, **kwargs):
+        super().__init__(**kwargs)
+        self.prefix = prefix
+
+    def blob_name(self, digest: str, extension: str) -> str:
+        return posixpath.join(self.prefix, digest[:2], digest[2:4], digest + extension)
+
+    def is_blob(self, name: str) -> bool:
+        return name.replace('\\', '/').startswith(self.prefix + '/')
+
+    def get_available_name(self, name, max_length=None):
+        # имя из upload_to не занимает места: настоящее выберет _save() по содержимому
+        return name
+
+    def _ensure_directory(self, directory: str) -> None:
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+    def _write_temporary(self, content) -> Tuple[str, str]:
+        """
+        Пишет содержимое во временный файл рядом с деревом и заодно
+        считает хэш: файл читается один раз.
+        """
+        directory = self.path(self.prefix)
+        self._ensure_directory(directory)
+        fd, path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        sha256 = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    sha256.update(chunk)
+                    file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(path, self.file_permissions_mode)
+        except BaseException:
+            os.unlink(path)
+            raise
+        return path, sha256.hexdigest()
+
+    @contextmanager
+    def _refs(self, name: str) -> Iterator[_Refs]:
+        """
+        Счётчик ссылок файла под эксклюзивной блокировкой.
+        """
+        path = self.path(name) + REFS_SUFFIX
+        self._ensure_directory(os.path.dirname(path))
+        while True:
+            file = open(path, 'a+b')
+            locks.lock(file, locks.LOCK_EX)
+            # пока ждали блокировку, счётчик могли удалить вместе с файлом
+            try:
+                same = os.path.samestat(os.fstat(file.fileno()), os.stat(path))
+            except FileNotFoundError:
+                same = False
+            if same:
+                break
+            locks.unlock(file)
+            file.close()
+        try:
+            yield _Refs(file)
+        finally:
+            locks.unlock(file)
+            file.close()
+
+    def _save(self, name, content):
+        extension = posixpath.splitext(name)[1].lower()
+        if len(extension) > MAX_EXTENSION_LENGTH:
+            extension = ''
+        # хэш из shopapp.uploads, посчитанный при приёме файла
+        digest = getattr(content, 'sha256', None)
+        temporary = None
+        if digest is None:
+            temporary, digest = self._write_temporary(content)
+        name = self.blob_name(digest, extension)
+        try:
+            with self._refs(name) as refs:
+                if not self.exists(name):
+                    if temporary is None:
+                        temporary, _ = self._write_temporary(content)
+                    os.replace(temporary, self.path(name))
+                    temporary = None
+                refs.save(refs.count + 1)
+        finally:
+            if temporary is not None:
+                os.unlink(temporary)
+        blocks = getattr(_taken, 'blocks', None)
+        if blocks:
+            blocks[-1].append((self, name))
+        return name
+
+    def delete(self, name):
+        if not name:
+            raise ValueError('The name must be given to delete().')
+        if not self.is_blob(name):
+            return super().delete(name)
+        with self._refs(name) as refs:
+            if refs.count > 1:
+                refs.save(refs.count - 1)
+                return
+            for path in (self.path(name), self.path(name) + REFS_SUFFIX):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def listdir(self, path):
+        directories, files = super().listdir(path)
+        return directories, [
+            file for file in files
+            if not file.endswith(REFS_SUFFIX) and not file.startswith('.upload-')
+        ]
+
+
+content_storage = ContentAddressedStorage()
+
+
+@contextmanager
+def atomic_refs(using=None) -> Iterator[None]:
+    """
+    ``transaction.atomic()``, после отката которого снимаются ссылки,
+    взятые ``ContentAddressedStorage.save()`` внутри блока.
+    """
+    blocks = _taken.__dict__.setdefault('blocks', [])
+    taken = []
+    blocks.append(taken)
+    try:
+        with transaction.atomic(using=using):
+            yield
+    except BaseException:
+        blocks.pop()
+        for storage, name in taken:
+            storage.delete(name)
+        raise
+    blocks.pop()
+    # откат внешнего блока отменит и этот
+    if blocks:
+        blocks[-1].extend(taken)
+
+
+def _content_fields(model) -> List[models.FileField]:
+    return [
+        field for field in model._meta.concrete_fields
+        if isinstance(field, models.FileField) and isinstance(field.storage, ContentAddressedStorage)
+    ]
+
+
+@receiver(post_delete, dispatch_uid='mysite_storage_release_files')
+def release_files(sender, instance, **kwargs):
+    """
+    Удалённая строка больше не ссылается на свои файлы.
+
+    Ссылка снимается после коммита: при откате строка и файл остаются.
+    """
+    for field in _content_fields(sender):
+        name = getattr(instance, field.name).name
+        if name:
+            transaction.on_commit(lambda storage=field.storage, name=name: storage.delete(name))
+
+
+def _file_changed(instance, field: models.FileField) -> bool:
+    # поле очищено или получило новый, ещё не записанный файл
+    file = getattr(instance, field.attname)
+    return not file or not file._committed
+
+
+@receiver(pre_save, dispatch_uid='mysite_storage_remember_replaced_files')
+def remember_replaced_files(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Запоминает прежние файлы полей, которые очищены или получили новый файл.
+
+    Остальные поля не проверяются, чтобы обычное сохранение обходилось
+    без лишнего запроса.
+    """
+    instance.__dict__.pop('_replaced_files', None)
+    if raw or instance._state.adding:
+        return
+    fields = [
+        field for field in _content_fields(sender)
+        if (update_fields is None or field.name in update_fields)
+        # отложенное поле не трогали
+        and field.attname in instance.__dict__
+        and _file_changed(instance, field)
+    ]
+    if not fields:
+        return
+    old = sender._base_manager.filter(pk=instance.pk).values(*[field.attname for field in fields]).first()
+    if old is None:
+        return
+    instance._replaced_files = [
+        (field.storage, old[field.attname])
+        for field in fields
+        if old[field.attname]
+    ]
+
+
+@receiver(post_save, dispatch_uid='mysite_storage_release_replaced_files')
+def release_replaced_files(sender, instance, **kwargs):
+    """
+    Снимает ссылки прежних файлов после коммита.
+
+    Если загрузили тот же файл, ``save()`` уже взял на него вторую ссылку,
+    так что и здесь снимать надо.
+    """
+    for storage, name in instance.__dict__.pop('_replaced_files', ()):
+        transaction.on_commit(lambda storage=storage, name=name: storage.delete(name))
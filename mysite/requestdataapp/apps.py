@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RequestdataappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'requestdataapp'
+
+    def ready(self):
+        from . import sqlprofile  # noqa: F401
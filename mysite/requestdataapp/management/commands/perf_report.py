@@ -0,0 +1,74 @@
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from django.core.management import BaseCommand
+
+from requestdataapp.slowlog import (
+    get_slow_requests_settings,
+    iter_slow_records,
+    load_latency_samples,
+    percentile_table,
+)
+
+
+class Command(BaseCommand):
+    """
+    Print latency percentiles per view and the worst requests from the slow-request log
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Defaults to SLOW_REQUESTS["DIR"]')
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument('--sort', choices=['p50', 'p95', 'p99', 'max', 'count'], default='p95')
+
+    def handle(self, *args, **options):
+        config = get_slow_requests_settings()
+        directory = options['dir'] or config['DIR']
+
+        rows = percentile_table(load_latency_samples(directory))
+        rows.sort(key=lambda row: row[options['sort']], reverse=True)
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Latency by view ({directory})'))
+        if not rows:
+            self.stdout.write('No latency samples yet')
+        else:
+            self.stdout.write(
+                f'{"view":40} {"count":>7} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"max ms":>9}'
+            )
+            for row in rows:
+                self.stdout.write(
+                    f'{row["view"][:40]:40} {row["count"]:7} '
+                    + ' '.join(f'{row[column] * 1000:9.1f}' for column in ('p50', 'p95', 'p99', 'max'))
+                )
+
+        records = list(iter_slow_records(directory))
+        self.stdout.write('')
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'Slow requests: {len(records)} logged over {config["THRESHOLD_MS"]} ms'
+        ))
+        if not records:
+            return
+
+        by_view = defaultdict(list)
+        for record in records:
+            by_view[record['view']].append(record)
+        self.stdout.write(f'{"view":40} {"count":>7} {"avg ms":>9} {"avg queries":>12} {"avg db ms":>10}')
+        for view, view_records in sorted(by_view.items(), key=lambda item: len(item[1]), reverse=True):
+            count = len(view_records)
+            self.stdout.write(
+                f'{view[:40]:40} {count:7} '
+                f'{sum(record["duration_ms"] for record in view_records) / count:9.1f} '
+                f'{sum(record["queries"] for record in view_records) / count:12.1f} '
+                f'{sum(record["db_ms"] for record in view_records) / count:10.1f}'
+            )
+
+        self.stdout.write('')
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Worst {options["top"]} requests'))
+        worst = sorted(records, key=lambda record: record['duration_ms'], reverse=True)[:options['top']]
+        for record in worst:
+            query = urlencode(record['params'], doseq=True)
+            url = f'{record["path"]}?{query}' if query else record['path']
+            self.stdout.write(
+                f'{record["duration_ms"]:9.1f} ms  {record["queries"]:4} queries  '
+                f'{record["db_ms"]:8.1f} db ms  {record["status"]}  {record["time"]}  '
+                f'{record["method"]} {url}'
+            )
@@ -0,0 +1,24 @@
+from django.core.management import BaseCommand
+
+from requestdataapp.profiling import PROFILE_HEADER, get_profiling_settings, make_token
+
+
+class Command(BaseCommand):
+    """
+    Print a signed token that makes ProfilingMiddleware profile matching requests
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path-prefix',
+            default='/',
+            help='Only requests whose path starts with this prefix are profiled',
+        )
+
+    def handle(self, *args, **options):
+        token = make_token(options['path_prefix'])
+        max_age = get_profiling_settings()['TOKEN_MAX_AGE']
+        self.stdout.write(f'{PROFILE_HEADER}: {token}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Valid for {max_age} seconds on paths starting with {options["path_prefix"]}'
+        ))
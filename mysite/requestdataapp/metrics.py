@@ -0,0 +1,252 @@
+"""
+Метрики запросов: счётчики и гистограммы задержек с фиксированными корзинами.
+
+Каждый процесс пишет в свой файл ``metrics-<pid>.bin`` в ``METRICS_DIR``
+через mmap: запись - это несколько ``pack_into`` под локом процесса, без
+системных вызовов. Страница метрик читает файлы всех воркеров и суммирует
+серии, так что в Prometheus попадают данные всего сервиса, а не одного
+процесса, на который пришёл запрос.
+
+Формат файла: 8 байт - число занятых слотов, затем слоты фиксированного
+размера: длина ключа (4 байта), ключ (UTF-8 JSON ``[метрика, метки]``)
+и ``VALUES_PER_SLOT`` чисел float64 - число наблюдений, их сумма
+и счётчики по корзинам (не накопительные). Ключ длиннее ``KEY_SIZE``
+не помещается в слот: самые длинные значения меток обрезаются
+и получают хэш полного значения.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+KEY_SIZE = 248
+LABEL_HASH_LENGTH = 8
+VALUES_PER_SLOT = 2 + len(LATENCY_BUCKETS) + 1
+HEADER = struct.Struct('<Q')
+KEY_HEADER = struct.Struct('<I')
+VALUES = struct.Struct(f'<{VALUES_PER_SLOT}d')
+SLOT_SIZE = KEY_HEADER.size + KEY_SIZE + VALUES.size
+INITIAL_SLOTS = 256
+
+REQUEST_DURATION = 'django_http_request_duration_seconds'
+EXCEPTIONS_TOTAL = 'django_http_exceptions_total'
+
+METRICS_HELP = {
+    REQUEST_DURATION: ('histogram', 'Request latency by resolved URL name and status class.'),
+    EXCEPTIONS_TOTAL: ('counter', 'Unhandled view exceptions by resolved URL name.'),
+}
+
+
+def get_metrics_dir() -> str:
+    return str(getattr(settings, 'METRICS_DIR', None) or os.path.join(tempfile.gettempdir(), 'mysite-metrics'))
+
+
+def _dump_key(name: str, labels: Tuple[Tuple[str, str], ...]) -> bytes:
+    return json.dumps([name, labels], separators=(',', ':')).encode()
+
+
+def _shorten(value: str, keep: int) -> str:
+    # хэш полного значения не даёт сериям с общим началом слиться
+    return f'{value[:keep]}~{hashlib.md5(value.encode()).hexdigest()[:LABEL_HASH_LENGTH]}'
+
+
+def _encode_key(name: str, labels: Tuple[Tuple[str, str], ...]) -> bytes:
+    key = _dump_key(name, labels)
+    keep = {label: len(value) for label, value in labels}
+    while len(key) > KEY_SIZE:
+        label = max(keep, key=keep.get, default=None)
+        if label is None or not keep[label]:
+            raise ValueError(f'Metric key is longer than {KEY_SIZE} bytes: {key!r}')
+        keep[label] = max(0, keep[label] - (len(key) - KEY_SIZE) - LABEL_HASH_LENGTH - 1)
+        key = _dump_key(name, tuple(
+            (label, _shorten(value, keep[label]) if keep[label] < len(value) else value)
+            for label, value in labels
+        ))
+    return key
+
+
+def _bucket_index(value: float) -> int:
+    for index, bound in enumerate(LATENCY_BUCKETS):
+        if value <= bound:
+            return index
+    return len(LATENCY_BUCKETS)
+
+
+class MetricsFile:
+    """
+    Файл метрик одного процесса. Пишет только процесс-владелец.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.slots: Dict[bytes, int] = {}
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        try:
+            size = os.fstat(fd).st_size
+            if size < HEADER.size + SLOT_SIZE * INITIAL_SLOTS:
+                size = HEADER.size + SLOT_SIZE * INITIAL_SLOTS
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        # процесс с тем же pid мог оставить файл: продолжаем его счётчики
+        for key, offset, _ in _iter_slots(self.map):
+            self.slots[key] = offset
+
+    def _allocate(self, key: bytes) -> int:
+        used = HEADER.unpack_from(self.map, 0)[0]
+        offset = HEADER.size + used * SLOT_SIZE
+        if offset + SLOT_SIZE > len(self.map):
+            self.map.resize(len(self.map) * 2)
+        KEY_HEADER.pack_into(self.map, offset, len(key))
+        self.map[offset + KEY_HEADER.size:offset + KEY_HEADER.size + len(key)] = key
+        VALUES.pack_into(self.map, offset + KEY_HEADER.size + KEY_SIZE, *([0.0] * VALUES_PER_SLOT))
+        # счётчик слотов - последним, чтобы читатель не увидел пустой ключ
+        HEADER.pack_into(self.map, 0, used + 1)
+        self.slots[key] = offset
+        return offset
+
+    def add(self, key: bytes, value: float, bucket: Optional[int]) -> None:
+        with self.lock:
+            offset = self.slots.get(key)
+            if offset is None:
+                offset = self._allocate(key)
+            values_offset = offset + KEY_HEADER.size + KEY_SIZE
+            values = list(VALUES.unpack_from(self.map, values_offset))
+            values[0] += 1
+            values[1] += value
+            if bucket is not None:
+                values[2 + bucket] += 1
+            VALUES.pack_into(self.map, values_offset, *values)
+
+
+def _iter_slots(buffer) -> Iterator[Tuple[bytes, int, Tuple[float, ...]]]:
+    if len(buffer) < HEADER.size:
+        return
+    used = HEADER.unpack_from(buffer, 0)[0]
+    for index in range(used):
+        offset = HEADER.size + index * SLOT_SIZE
+        if offset + SLOT_SIZE > len(buffer):
+            return
+        length = KEY_HEADER.unpack_from(buffer, offset)[0]
+        key = bytes(buffer[offset + KEY_HEADER.size:offset + KEY_HEADER.size + length])
+        yield key, offset, VALUES.unpack_from(buffer, offset + KEY_HEADER.size + KEY_SIZE)
+
+
+class Registry:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._file: Optional[MetricsFile] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def file(self) -> MetricsFile:
+        # после fork у воркера свой pid и свой файл
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self._file = MetricsFile(os.path.join(self.directory, f'metrics-{pid}.bin'))
+                    self._pid = pid
+        return self._file
+
+    def observe(self, name: str, labels: Dict[str, str], value: float) -> None:
+        key = _encode_key(name, tuple(sorted(labels.items())))
+        self.file.add(key, value, _bucket_index(value))
+
+    def inc(self, name: str, labels: Dict[str, str], amount: float = 1) -> None:
+        key = _encode_key(name, tuple(sorted(labels.items())))
+        self.file.add(key, amount, None)
+
+    def collect(self) -> Dict[bytes, List[float]]:
+        """
+        Серии всех процессов, сложенные по ключу.
+        """
+        totals: Dict[bytes, List[float]] = defaultdict(lambda: [0.0] * VALUES_PER_SLOT)
+        if not os.path.isdir(self.directory):
+            return totals
+        for filename in sorted(os.listdir(self.directory)):
+            if not (filename.startswith('metrics-') and filename.endswith('.bin')):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename), 'rb') as metrics_file:
+                    buffer = metrics_file.read()
+            except FileNotFoundError:
+                continue
+            for key, _, values in _iter_slots(buffer):
+                total = totals[key]
+                for index, value in enumerate(values):
+                    total[index] += value
+        return totals
+
+    def reset(self) -> None:
+        """
+        Удаляет файлы всех процессов (для тестов и ручного сброса).
+        """
+        with self._lock:
+            self._file = None
+            self._pid = None
+        if os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if filename.startswith('metrics-') and filename.endswith('.bin'):
+                    os.remove(os.path.join(self.directory, filename))
+
+
+_registries: Dict[str, Registry] = {}
+
+
+def get_registry() -> Registry:
+    directory = get_metrics_dir()
+    registry = _registries.get(directory)
+    if registry is None:
+        registry = _registries.setdefault(directory, Registry(directory))
+    return registry
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = []
+    for name, value in tuple(labels) + extra:
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render_prometheus(totals: Dict[bytes, List[float]]) -> str:
+    series = defaultdict(list)
+    for key, values in totals.items():
+        name, labels = json.loads(key)
+        series[name].append((tuple(tuple(pair) for pair in labels), values))
+
+    lines = []
+    for name in sorted(series):
+        metric_type, help_text = METRICS_HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for labels, values in sorted(series[name]):
+            if metric_type != 'histogram':
+                lines.append(f'{name}{_format_labels(labels)} {_format_number(values[1])}')
+                continue
+            cumulative = 0.0
+            for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), values[2:]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{_format_labels(labels, (("le", le),))} {_format_number(cumulative)}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {repr(values[1])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {_format_number(values[0])}')
+    return '\n'.join(lines) + '\n'
@@ -1,11 +1,38 @@
-from django.http import HttpRequest, HttpResponseForbidden
-import time
+import cProfile
+import json
+import logging
+from random import random
+from time import perf_counter
+from typing import Optional, Tuple
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import HttpRequest
+from django.utils.decorators import sync_and_async_middleware
 
+from .metrics import EXCEPTIONS_TOTAL, REQUEST_DURATION, get_registry
+from .profiling import PROFILE_FLAG, ProfileStore, get_profiling_settings, has_valid_token, profiler_lock
+from .slowlog import get_latency_windows, get_slow_log, get_slow_requests_settings, make_slow_record
+from .sqlprofile import QueryProfile, get_profiler_settings, profile_queries
+from .throttling import RateLimiter, too_many_requests
+
+sql_logger = logging.getLogger('requestdataapp.sql')
+
+
+@sync_and_async_middleware
 def set_useragent_on_request_middleware(get_response):
 
     print(f"Initial call")
 
+    if iscoroutinefunction(get_response):
+        async def middleware(request: HttpRequest):
+            print(f"before get response")
+            request.user_agent = request.META["HTTP_USER_AGENT"]
+            response = await get_response(request)
+            print(f"after get response")
+            return response
+
+        return middleware
+
     def middleware(request: HttpRequest):
         print(f"before get response")
         request.user_agent = request.META["HTTP_USER_AGENT"]
@@ -17,48 +44,299 @@ def set_useragent_on_request_middleware(get_response):
 
 
 class CountRequestsMiddleware:
+    """
+    Считает запросы и пишет задержку каждого в гистограмму ``metrics``
+    по имени маршрута и классу статуса (2xx, 4xx, ...).
+
+    Работает и в синхронной, и в асинхронной цепочке: под ASGI
+    запрос не уходит в отдельный поток ради этой middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
         self.requests_count = 0
         self.responses_count = 0
         self.exceptions_count = 0
 
     def __call__(self, request: HttpRequest):
-        self.requests_count += 1
-        print(f"count requests: ", self.requests_count)
+        if self.async_mode:
+            return self.__acall__(request)
+        start = self.count_request()
         response = self.get_response(request)
-        self.responses_count += 1
-        print(f"count responses: ", self.responses_count)
+        self.count_response(request, response, start)
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        start = self.count_request()
+        response = await self.get_response(request)
+        self.count_response(request, response, start)
         return response
 
+    def count_request(self) -> float:
+        self.requests_count += 1
+        return perf_counter()
+
+    def count_response(self, request: HttpRequest, response, start: float):
+        self.responses_count += 1
+        get_registry().observe(
+            REQUEST_DURATION,
+            {'view': get_view_name(request), 'status': f'{response.status_code // 100}xx'},
+            perf_counter() - start,
+        )
+
     def process_exception(self, request: HttpRequest, exception: Exception):
         self.exceptions_count += 1
-        print(f'got {self.exceptions_count} exceptions so far')
+        get_registry().inc(EXCEPTIONS_TOTAL, {'view': get_view_name(request)})
+
+
+def get_view_name(request: HttpRequest) -> str:
+    # метка по имени маршрута, а не по пути: иначе каждый pk - новая серия
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    # у маршрута без имени Django сам подставляет путь к функции представления
+    return match.view_name
+
+
+class SQLProfilerMiddleware:
+    """
+    Профилирует SQL у доли запросов (``SQL_PROFILER['SAMPLE_RATE']``,
+    см. ``sqlprofile``): добавляет ``Server-Timing`` и пишет строку JSON
+    в лог ``requestdataapp.sql``, с уровнем WARNING при подозрении на N+1.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response, sample_rate: float = None):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        config = get_profiler_settings()
+        self.sample_rate = config['SAMPLE_RATE'] if sample_rate is None else sample_rate
+        self.threshold = config['N_PLUS_ONE_THRESHOLD']
+        self.server_timing = config['SERVER_TIMING']
+
+    def __call__(self, request: HttpRequest):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random() >= self.sample_rate:
+            return self.get_response(request)
+        start = perf_counter()
+        with profile_queries() as profile:
+            response = self.get_response(request)
+        self.report(request, response, profile, perf_counter() - start)
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        if random() >= self.sample_rate:
+            return await self.get_response(request)
+        start = perf_counter()
+        with profile_queries() as profile:
+            response = await self.get_response(request)
+        self.report(request, response, profile, perf_counter() - start)
+        return response
+
+    def report(self, request: HttpRequest, response, profile: QueryProfile, elapsed: float):
+        repeated = profile.repeated(self.threshold)
+        if self.server_timing:
+            timing = (
+                f'db;dur={profile.duration * 1000:.1f};desc="{profile.count} queries", '
+                f'app;dur={elapsed * 1000:.1f}'
+            )
+            if response.has_header('Server-Timing'):
+                timing = f'{response["Server-Timing"]}, {timing}'
+            response['Server-Timing'] = timing
+        record = {
+            'event': 'sql_profile',
+            'method': request.method,
+            'path': request.path,
+            'view': get_view_name(request),
+            'status': response.status_code,
+            'queries': profile.count,
+            'db_ms': round(profile.duration * 1000, 2),
+            'total_ms': round(elapsed * 1000, 2),
+            'duplicates': profile.duplicates,
+            'n_plus_one': [
+                {'sql': shape[:500], 'count': count, 'db_ms': round(duration * 1000, 2)}
+                for shape, count, duration in repeated
+            ],
+        }
+        sql_logger.log(
+            logging.WARNING if repeated else logging.INFO,
+            json.dumps(record, ensure_ascii=False),
+            extra={'sql_profile': record},
+        )
+
+
+class SlowRequestMiddleware:
+    """
+    Скользящие перцентили задержек по представлениям и журнал запросов
+    дольше ``SLOW_REQUESTS['THRESHOLD_MS']`` (см. ``slowlog``).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response, config: dict = None):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        config = {**get_slow_requests_settings(), **(config or {})}
+        self.threshold = config['THRESHOLD_MS'] / 1000
+        self.windows = get_latency_windows(config)
+        self.log = get_slow_log(config)
+
+    def __call__(self, request: HttpRequest):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = perf_counter()
+        # только число запросов и время: разбор SQL - дело SQLProfilerMiddleware
+        with profile_queries(statements=False) as profile:
+            response = self.get_response(request)
+        self.record(request, response, profile, perf_counter() - start)
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        start = perf_counter()
+        with profile_queries(statements=False) as profile:
+            response = await self.get_response(request)
+        flush, record = self.measure(request, response, profile, perf_counter() - start)
+        if flush or record is not None:
+            # запись на диск не должна держать цикл событий
+            await sync_to_async(self.persist, thread_sensitive=False)(flush, record)
+        return response
+
+    def record(self, request: HttpRequest, response, profile: QueryProfile, duration: float):
+        self.persist(*self.measure(request, response, profile, duration))
+
+    def measure(self, request: HttpRequest, response, profile: QueryProfile, duration: float) -> Tuple[bool, Optional[dict]]:
+        """
+        Учитывает запрос в памяти; возвращает, пора ли сбросить резервуары,
+        и запись для журнала медленных запросов, если он медленный.
+        """
+        view = get_view_name(request)
+        flush = self.windows.add(view, duration, flush=False)
+        record = None
+        if duration >= self.threshold:
+            record = make_slow_record(request, response, view, duration, profile)
+        return flush, record
+
+    def persist(self, flush: bool, record: Optional[dict]) -> None:
+        if flush:
+            self.windows.flush()
+        if record is not None:
+            self.log.write(record)
+
+
+class ProfilingMiddleware:
+    """
+    Запускает запрос под cProfile по подписанному токену или флагу
+    ``?_profile=1`` от сотрудника (см. ``profiling``). Имя сохранённого
+    файла возвращается в заголовке ``X-Profile-Id``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response, store: ProfileStore = None):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.store = store or ProfileStore.from_settings()
+        self.token_max_age = get_profiling_settings()['TOKEN_MAX_AGE']
+
+    def is_requested_by_staff(self, request: HttpRequest) -> bool:
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+    def __call__(self, request: HttpRequest):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not (
+            has_valid_token(request, self.token_max_age)
+            or PROFILE_FLAG in request.GET and self.is_requested_by_staff(request)
+        ):
+            return self.get_response(request)
+        if not profiler_lock.acquire(blocking=False):
+            response = self.get_response(request)
+            response['X-Profile-Id'] = 'busy'
+            return response
+        try:
+            profiler = cProfile.Profile()
+            start = perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            response['X-Profile-Id'] = self.store.save(profiler, request, perf_counter() - start)
+        finally:
+            profiler_lock.release()
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        if not (
+            has_valid_token(request, self.token_max_age)
+            # request.user ленивый и читает сессию синхронно
+            or PROFILE_FLAG in request.GET and await sync_to_async(self.is_requested_by_staff)(request)
+        ):
+            return await self.get_response(request)
+        if not profiler_lock.acquire(blocking=False):
+            response = await self.get_response(request)
+            response['X-Profile-Id'] = 'busy'
+            return response
+        try:
+            profiler = cProfile.Profile()
+            start = perf_counter()
+            profiler.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+            response['X-Profile-Id'] = self.store.save(profiler, request, perf_counter() - start)
+        finally:
+            profiler_lock.release()
+        return response
 
 
 class ThrottlingMiddleware:
-    def __init__(self, get_response, duration=60, request_limit=500):
+    """
+    Ограничение частоты запросов по группам маршрутов (см. ``throttling``).
+
+    При превышении лимита отвечает 429 с заголовком ``Retry-After``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response, limiter: RateLimiter = None):
         self.get_response = get_response
-        self.duration = duration
-        self.request_limit = request_limit
-        self.requests = {}
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.limiter = limiter or RateLimiter.from_settings()
 
     def __call__(self, request):
-        ip = request.META.get('REMOTE_ADDR')
-        if ip in self.requests:
-            last_request_time, count = self.requests[ip]
-            if time.time() < last_request_time + self.duration:
-                if count >= self.request_limit:
-                    return HttpResponseForbidden('Too many requests')
-                self.requests[ip] = (last_request_time, count+1)
-            else:
-                self.requests[ip] = (time.time(), 1)
-        else:
-            self.requests[ip] = (time.time(), 1)
-
+        if self.async_mode:
+            return self.__acall__(request)
+        retry_after = self.limiter.check(request)
+        if retry_after is not None:
+            return too_many_requests(retry_after)
         response = self.get_response(request)
         return response
 
+    async def __acall__(self, request):
+        retry_after = await self.limiter.acheck(request)
+        if retry_after is not None:
+            return too_many_requests(retry_after)
+        response = await self.get_response(request)
+        return response
+
 
 # class ThrottlingMiddleware:
 #
@@ -0,0 +1,130 @@
+"""
+Профилирование отдельных запросов cProfile по требованию.
+
+Запрос профилируется, если в нём есть заголовок ``X-Profile-Token``
+с подписанным токеном (``python manage.py profile_token``) или если
+сотрудник (``is_staff``) добавил к адресу ``?_profile=1``. Результат -
+файл pstats (открывается ``python -m pstats``, snakeviz, flameprof,
+gprof2dot) в каталоге ``PROFILING['DIR']``; хранятся только последние
+``MAX_FILES`` файлов. Список и скачивание - ``/req/profiles/``.
+
+Одновременно профилируется один запрос: cProfile глобален для потока,
+а в асинхронной цепочке в профиль попадают и другие корутины цикла.
+Синхронный код, ушедший в ``sync_to_async``, cProfile не видит.
+
+Настройка ``PROFILING`` в settings::
+
+    PROFILING = {
+        'DIR': '/var/tmp/mysite-profiles',
+        'MAX_FILES': 50,
+        'TOKEN_MAX_AGE': 3600,
+    }
+"""
+
+import cProfile
+import os
+import re
+import tempfile
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+from django.conf import settings
+from django.core import signing
+from django.http import HttpRequest
+
+PROFILE_HEADER = 'X-Profile-Token'
+PROFILE_FLAG = '_profile'
+TOKEN_SALT = 'requestdataapp.profiling'
+
+DEFAULT_PROFILING = {
+    'DIR': os.path.join(tempfile.gettempdir(), 'mysite-profiles'),
+    'MAX_FILES': 50,
+    'TOKEN_MAX_AGE': 3600,
+}
+
+PROFILE_NAME_RE = re.compile(r'^\d{8}T\d{12}-[\w.-]+\.prof$')
+
+# cProfile нельзя запустить дважды одновременно
+profiler_lock = threading.Lock()
+
+
+def get_profiling_settings() -> dict:
+    return {**DEFAULT_PROFILING, **getattr(settings, 'PROFILING', {})}
+
+
+def make_token(path_prefix: str = '/') -> str:
+    """
+    Токен для заголовка ``X-Profile-Token``, действует на пути с ``path_prefix``.
+    """
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(path_prefix)
+
+
+def has_valid_token(request: HttpRequest, max_age: int) -> bool:
+    token = request.headers.get(PROFILE_HEADER)
+    if not token:
+        return False
+    try:
+        path_prefix = signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=max_age)
+    except signing.BadSignature:
+        return False
+    return request.path.startswith(path_prefix)
+
+
+class ProfileStore:
+    """
+    Каталог-кольцо с файлами pstats: после записи лишние старые файлы удаляются.
+    """
+    def __init__(self, directory: str, max_files: int):
+        self.directory = str(directory)
+        self.max_files = max_files
+
+    @classmethod
+    def from_settings(cls) -> 'ProfileStore':
+        config = get_profiling_settings()
+        return cls(config['DIR'], config['MAX_FILES'])
+
+    def save(self, profiler: cProfile.Profile, request: HttpRequest, elapsed: float) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = re.sub(r'[^\w.-]+', '-', request.path).strip('-')[:80] or 'root'
+        name = (
+            f'{datetime.now().strftime("%Y%m%dT%H%M%S%f")}-{request.method}-'
+            f'{path}-{round(elapsed * 1000)}ms.prof'
+        )
+        profiler.dump_stats(os.path.join(self.directory, name))
+        self.trim()
+        return name
+
+    def names(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        # имя начинается с времени, так что сортировка по имени - по времени
+        return sorted(name for name in os.listdir(self.directory) if PROFILE_NAME_RE.match(name))
+
+    def trim(self) -> None:
+        names = self.names()
+        for name in names[:max(0, len(names) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def list(self) -> List[dict]:
+        profiles = []
+        for name in reversed(self.names()):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            profiles.append({
+                'name': name,
+                'size': stat.st_size,
+                'created_at': datetime.fromtimestamp(stat.st_mtime),
+            })
+        return profiles
+
+    def path(self, name: str) -> Optional[str]:
+        if not PROFILE_NAME_RE.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
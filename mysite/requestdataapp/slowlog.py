@@ -0,0 +1,233 @@
+"""
+Журнал медленных запросов и скользящие перцентили задержек по представлениям.
+
+``SlowRequestMiddleware`` хранит для каждого представления последние
+``RESERVOIR_SIZE`` задержек в кольцевом ``array('d')`` и раз в
+``FLUSH_INTERVAL`` секунд сбрасывает их в ``latency-<pid>.json``.
+Запросы дольше ``THRESHOLD_MS`` дописываются строкой JSON в
+``slow-requests.jsonl``. Оба файла лежат в ``SLOW_REQUESTS['DIR']``,
+их читает ``python manage.py perf_report``.
+
+Настройка ``SLOW_REQUESTS`` в settings::
+
+    SLOW_REQUESTS = {
+        'DIR': '/var/tmp/mysite-perf',
+        'THRESHOLD_MS': 500,
+        'RESERVOIR_SIZE': 1024,
+        'MAX_VIEWS': 500,
+        'FLUSH_INTERVAL': 10,
+        'LOG_MAX_BYTES': 10 * 1024 * 1024,  # затем файл уходит в .1
+    }
+"""
+
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from django.conf import settings
+
+DEFAULT_SLOW_REQUESTS = {
+    'DIR': os.path.join(tempfile.gettempdir(), 'mysite-perf'),
+    'THRESHOLD_MS': 500,
+    'RESERVOIR_SIZE': 1024,
+    'MAX_VIEWS': 500,
+    'FLUSH_INTERVAL': 10,
+    'LOG_MAX_BYTES': 10 * 1024 * 1024,
+}
+
+SLOW_LOG_NAME = 'slow-requests.jsonl'
+MAX_PARAM_LENGTH = 200
+
+
+def get_slow_requests_settings() -> dict:
+    return {**DEFAULT_SLOW_REQUESTS, **getattr(settings, 'SLOW_REQUESTS', {})}
+
+
+def percentile(ordered: Sequence[float], q: float) -> float:
+    """
+    Перцентиль по уже отсортированной выборке (ближайший ранг).
+    """
+    if not ordered:
+        return 0.0
+    rank = math.ceil(q / 100 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+class Reservoir:
+    """
+    Последние ``size`` значений в кольцевом буфере из float64.
+    """
+    def __init__(self, size: int):
+        self.values = array('d', bytes(8 * size))
+        self.size = size
+        self.position = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self.values[self.position] = value
+        self.position = (self.position + 1) % self.size
+        self.count += 1
+
+    def samples(self) -> array:
+        if self.count < self.size:
+            return self.values[:self.count]
+        return self.values[self.position:] + self.values[:self.position]
+
+
+class LatencyWindows:
+    """
+    Резервуары по представлениям, не больше ``max_views`` штук:
+    после этого новые представления попадают в общую серию ``<other>``.
+    """
+    def __init__(self, directory: str, size: int, max_views: int, flush_interval: float):
+        self.directory = str(directory)
+        self.size = size
+        self.max_views = max_views
+        self.flush_interval = flush_interval
+        self.reservoirs: Dict[str, Reservoir] = {}
+        self.lock = threading.Lock()
+        self.flushed_at = time.monotonic()
+
+    def add(self, view: str, duration: float, flush: bool = True) -> bool:
+        """
+        Добавляет замер и возвращает, пора ли сбросить резервуары на диск.
+        С ``flush=False`` сброс остаётся вызывающему.
+        """
+        with self.lock:
+            reservoir = self.reservoirs.get(view)
+            if reservoir is None:
+                if len(self.reservoirs) >= self.max_views:
+                    view = '<other>'
+                reservoir = self.reservoirs.setdefault(view, Reservoir(self.size))
+            reservoir.add(duration)
+            due = time.monotonic() - self.flushed_at >= self.flush_interval
+            if due:
+                self.flushed_at = time.monotonic()
+        if due and flush:
+            self.flush()
+        return due
+
+    def snapshot(self) -> Dict[str, List[float]]:
+        with self.lock:
+            return {view: reservoir.samples().tolist() for view, reservoir in self.reservoirs.items()}
+
+    def flush(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'latency-{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w') as snapshot_file:
+            json.dump(self.snapshot(), snapshot_file, separators=(',', ':'))
+        os.replace(f'{path}.tmp', path)
+
+
+class SlowRequestLog:
+    def __init__(self, directory: str, max_bytes: int):
+        self.path = os.path.join(str(directory), SLOW_LOG_NAME)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def write(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            try:
+                if os.path.getsize(self.path) >= self.max_bytes:
+                    os.replace(self.path, f'{self.path}.1')
+            except FileNotFoundError:
+                pass
+            # одна строка одним write в режиме append: воркеры не перемешивают строки
+            with open(self.path, 'a', encoding='utf-8') as log_file:
+                log_file.write(line)
+
+
+def make_slow_record(request, response, view: str, duration: float, profile) -> dict:
+    return {
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'view': view,
+        'method': request.method,
+        'path': request.path,
+        'params': {
+            key: [value[:MAX_PARAM_LENGTH] for value in values]
+            for key, values in request.GET.lists()
+        },
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 2),
+        'queries': profile.count,
+        'db_ms': round(profile.duration * 1000, 2),
+    }
+
+
+def iter_slow_records(directory: str) -> Iterator[dict]:
+    for name in (f'{SLOW_LOG_NAME}.1', SLOW_LOG_NAME):
+        try:
+            log_file = open(os.path.join(str(directory), name), encoding='utf-8')
+        except FileNotFoundError:
+            continue
+        with log_file:
+            for line in log_file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # строка, оборванная при падении процесса
+                    continue
+
+
+def load_latency_samples(directory: str) -> Dict[str, List[float]]:
+    """
+    Резервуары всех воркеров, объединённые по представлению.
+    """
+    samples: Dict[str, List[float]] = {}
+    if not os.path.isdir(str(directory)):
+        return samples
+    for name in sorted(os.listdir(str(directory))):
+        if not (name.startswith('latency-') and name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(str(directory), name)) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (FileNotFoundError, ValueError):
+            continue
+        for view, values in snapshot.items():
+            samples.setdefault(view, []).extend(values)
+    return samples
+
+
+def percentile_table(samples: Dict[str, Iterable[float]], quantiles=(50, 95, 99)) -> List[dict]:
+    rows = []
+    for view, values in samples.items():
+        ordered = sorted(values)
+        if not ordered:
+            continue
+        row = {'view': view, 'count': len(ordered), 'max': ordered[-1]}
+        for q in quantiles:
+            row[f'p{q}'] = percentile(ordered, q)
+        rows.append(row)
+    return rows
+
+
+_windows: Dict[str, LatencyWindows] = {}
+_logs: Dict[str, SlowRequestLog] = {}
+_lock = threading.Lock()
+
+
+def get_latency_windows(config: Optional[dict] = None) -> LatencyWindows:
+    config = config or get_slow_requests_settings()
+    with _lock:
+        if config['DIR'] not in _windows:
+            _windows[config['DIR']] = LatencyWindows(
+                config['DIR'], config['RESERVOIR_SIZE'], config['MAX_VIEWS'], config['FLUSH_INTERVAL'],
+            )
+        return _windows[config['DIR']]
+
+
+def get_slow_log(config: Optional[dict] = None) -> SlowRequestLog:
+    config = config or get_slow_requests_settings()
+    with _lock:
+        if config['DIR'] not in _logs:
+            _logs[config['DIR']] = SlowRequestLog(config['DIR'], config['LOG_MAX_BYTES'])
+        return _logs[config['DIR']]
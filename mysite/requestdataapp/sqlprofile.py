@@ -0,0 +1,156 @@
+"""
+Профилирование SQL в рамках запроса.
+
+На каждое соединение с базой один раз ставится ``execute_wrapper``,
+который ничего не делает, пока в контексте нет активного ``QueryProfile``.
+``SQLProfilerMiddleware`` включает профиль для выбранных запросов,
+а ``SlowRequestMiddleware`` - для всех, но без текста SQL, только число
+запросов и время. Профиль лежит в ``ContextVar``, поэтому запросы из ``sync_to_async``
+(асинхронный ORM, синхронные представления под ASGI) тоже учитываются.
+
+Настройка ``SQL_PROFILER`` в settings::
+
+    SQL_PROFILER = {
+        'SAMPLE_RATE': 0.01,         # доля профилируемых запросов
+        'N_PLUS_ONE_THRESHOLD': 5,   # одинаковый SQL чаще - подозрение на N+1
+        'SERVER_TIMING': True,       # заголовок Server-Timing в ответе
+    }
+
+Запросы, выполненные при чтении ``StreamingHttpResponse``, уже после
+возврата из middleware, в профиль не попадают.
+"""
+
+import re
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+DEFAULT_SQL_PROFILER = {
+    'SAMPLE_RATE': 0.01,
+    'N_PLUS_ONE_THRESHOLD': 5,
+    'SERVER_TIMING': True,
+}
+
+_active_profile: ContextVar[Optional['QueryProfile']] = ContextVar('sql_profile', default=None)
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?\b')
+IN_LIST_RE = re.compile(r'\bIN \((?:\?, )*\?\)', re.IGNORECASE)
+SPACES_RE = re.compile(r'\s+')
+
+
+def get_profiler_settings() -> dict:
+    return {**DEFAULT_SQL_PROFILER, **getattr(settings, 'SQL_PROFILER', {})}
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Форма запроса без значений: ``WHERE id = 1`` и ``WHERE id = 2`` совпадают,
+    как и ``IN`` с любым числом элементов.
+    """
+    sql = STRING_RE.sub('?', sql.replace('%s', '?'))
+    sql = NUMBER_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return SPACES_RE.sub(' ', sql).strip()
+
+
+class QueryProfile:
+    """
+    Счётчики SQL одного блока. Вложенный профиль учитывает запросы
+    и во внешнем (``parent``), например ``profile_queries()`` в тесте
+    вокруг запроса, который профилирует ещё и middleware.
+
+    Запросы считаются по исходному тексту SQL, нормализация - только
+    при разборе, так что на сам запрос приходится одно обновление словаря.
+    С ``statements=False`` считаются только число запросов и время в базе:
+    так дёшево замерять каждый запрос, а не выборку.
+    """
+    def __init__(self, parent: Optional['QueryProfile'] = None, statements: bool = True):
+        self.parent = parent
+        self.track_statements = statements
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter = Counter()
+        self.statement_durations: Dict[str, float] = defaultdict(float)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, perf_counter() - start)
+
+    def record(self, sql: str, elapsed: float) -> None:
+        profile = self
+        while profile is not None:
+            profile.count += 1
+            profile.duration += elapsed
+            if profile.track_statements:
+                profile.statements[sql] += 1
+                profile.statement_durations[sql] += elapsed
+            profile = profile.parent
+
+    def get_shapes(self) -> Tuple[Counter, Dict[str, float]]:
+        shapes: Counter = Counter()
+        durations: Dict[str, float] = defaultdict(float)
+        for sql, count in self.statements.items():
+            shape = normalize_sql(sql)
+            shapes[shape] += count
+            durations[shape] += self.statement_durations[sql]
+        return shapes, durations
+
+    @property
+    def duplicates(self) -> int:
+        """
+        Сколько запросов повторили уже выполненную форму.
+        """
+        shapes, _ = self.get_shapes()
+        return sum(count - 1 for count in shapes.values())
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int, float]]:
+        """
+        Формы, выполненные больше ``threshold`` раз, - вероятные N+1.
+        """
+        shapes, durations = self.get_shapes()
+        return [
+            (shape, count, durations[shape])
+            for shape, count in shapes.most_common()
+            if count > threshold
+        ]
+
+
+def profiling_wrapper(execute, sql, params, many, context):
+    profile = _active_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+@receiver(connection_created, dispatch_uid='requestdataapp_sql_profiler')
+def install_profiling_wrapper(sender, connection, **kwargs):
+    # соединение переоткрывается, а список обёрток остаётся
+    if profiling_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profiling_wrapper)
+
+
+@contextmanager
+def profile_queries(statements: bool = True) -> Iterator[QueryProfile]:
+    """
+    Профилирует SQL внутри блока::
+
+        with profile_queries() as profile:
+            ...
+        profile.count, profile.repeated(5)
+    """
+    profile = QueryProfile(parent=_active_profile.get(), statements=statements)
+    token = _active_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _active_profile.reset(token)
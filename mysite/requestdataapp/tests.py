@@ -1,3 +1,424 @@
-from django.test import TestCase
+import json
+import os
+import pstats
+import tempfile
+import threading
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import translation
+
+from shopapp.models import Order, Product
+
+from requestdataapp.middlewares import (
+    CountRequestsMiddleware,
+    ProfilingMiddleware,
+    SlowRequestMiddleware,
+    SQLProfilerMiddleware,
+    ThrottlingMiddleware,
+    set_useragent_on_request_middleware,
+)
+from requestdataapp.metrics import KEY_SIZE, REQUEST_DURATION, MetricsFile, get_registry, render_prometheus
+from requestdataapp.profiling import PROFILE_HEADER, ProfileStore, make_token
+from requestdataapp.slowlog import Reservoir, iter_slow_records, load_latency_samples, percentile
+from requestdataapp.sqlprofile import normalize_sql, profile_queries
+from requestdataapp.throttling import CacheStore, LocalStore, RateLimiter, RouteGroup
+
+
+def sync_view(request):
+    return HttpResponse('ok')
+
+
+async def async_view(request):
+    return HttpResponse('ok')
+
+
+class DualModeMiddlewareTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.request = RequestFactory().get('/', HTTP_USER_AGENT='tests')
+
+    def test_sync_chain_stays_sync(self):
+        for factory in (CountRequestsMiddleware, ThrottlingMiddleware, set_useragent_on_request_middleware):
+            middleware = factory(sync_view)
+            self.assertFalse(iscoroutinefunction(middleware))
+            self.assertEqual(middleware(self.request).content, b'ok')
+
+    async def test_async_chain_stays_async(self):
+        for factory in (CountRequestsMiddleware, ThrottlingMiddleware, set_useragent_on_request_middleware):
+            middleware = factory(async_view)
+            self.assertTrue(iscoroutinefunction(middleware))
+            response = await middleware(self.request)
+            self.assertEqual(response.content, b'ok')
+
+    async def test_async_throttling(self):
+        limiter = RateLimiter([RouteGroup('all', rate=2)], LocalStore())
+        middleware = ThrottlingMiddleware(async_view, limiter=limiter)
+        statuses = [(await middleware(self.request)).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    async def test_async_counting(self):
+        middleware = CountRequestsMiddleware(async_view)
+        await middleware(self.request)
+        self.assertEqual((middleware.requests_count, middleware.responses_count), (1, 1))
+
+
+class AsyncMiddlewareChainTestCase(TestCase):
+    @override_settings(DEBUG=True)
+    async def test_no_adapted_middleware(self):
+        # при DEBUG Django пишет в django.request, когда при сборке цепочки
+        # оборачивает middleware в другой режим
+        with translation.override('en'), self.assertNoLogs('django.request', 'DEBUG'):
+            response = await AsyncClient().get(reverse('shopapp:async-product-list'))
+        self.assertEqual(response.status_code, 200)
+
+
+class FakeClock:
+    def __init__(self, now: float = 6000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class RateLimiterTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.factory = RequestFactory()
+        self.clock = FakeClock()
+
+    def request(self, path: str = '/en/shop/api/products/', ip: str = '10.0.0.1'):
+        return self.factory.get(path, REMOTE_ADDR=ip)
+
+    def test_429_with_retry_after(self):
+        limiter = RateLimiter([RouteGroup('api', rate=3, period=60)], LocalStore(), clock=self.clock)
+        middleware = ThrottlingMiddleware(sync_view, limiter=limiter)
+        responses = [middleware(self.request()) for _ in range(4)]
+        self.assertEqual([response.status_code for response in responses], [200, 200, 200, 429])
+        # окно началось только что, учтено 4 запроса: ждать до следующего окна
+        # и ещё половину его, пока вес прошлого окна не опустится до 2
+        self.assertEqual(responses[-1]['Retry-After'], '90')
+
+    def test_sliding_window(self):
+        limiter = RateLimiter([RouteGroup('api', rate=4, period=60)], LocalStore(), clock=self.clock)
+        for _ in range(4):
+            self.assertIsNone(limiter.check(self.request()))
+        # середина следующего окна: от прошлых 4 запросов "весит" половина
+        self.clock.now += 90
+        self.assertIsNone(limiter.check(self.request()))
+        self.assertIsNone(limiter.check(self.request()))
+        self.assertIsNotNone(limiter.check(self.request()))
+
+    def test_route_groups(self):
+        limiter = RateLimiter(
+            [
+                RouteGroup('static', pattern=r'^/static/'),
+                RouteGroup('api', pattern=r'^/[\w-]+/shop/api/', rate=1),
+                RouteGroup('default', rate=100),
+            ],
+            LocalStore(),
+            clock=self.clock,
+        )
+        self.assertIsNone(limiter.check(self.request()))
+        self.assertIsNotNone(limiter.check(self.request()))
+        # другие группы и другие клиенты считаются отдельно
+        self.assertIsNone(limiter.check(self.request('/en/shop/products/')))
+        self.assertIsNone(limiter.check(self.request(ip='10.0.0.2')))
+        for _ in range(10):
+            self.assertIsNone(limiter.check(self.request('/static/app.css')))
+
+    def test_local_store_is_bounded(self):
+        store = LocalStore(max_clients=100)
+        limiter = RateLimiter([RouteGroup('all', rate=10)], store, clock=self.clock)
+        limiter.check(self.request(ip='10.0.0.1'))
+        for index in range(1000):
+            limiter.check(self.request(ip=f'192.168.{index // 256}.{index % 256}'))
+        self.assertEqual(len(store.windows), 100)
+        self.assertNotIn('throttle:all:10.0.0.1', store.windows)
+
+    def test_cache_store_is_shared_between_workers(self):
+        cache.clear()
+        workers = [
+            RateLimiter([RouteGroup('api', rate=3)], CacheStore('default'), clock=self.clock)
+            for _ in range(2)
+        ]
+        results = [workers[index % 2].check(self.request()) for index in range(4)]
+        self.assertEqual([result is None for result in results], [True, True, True, False])
+
+    async def test_cache_store_async(self):
+        await cache.aclear()
+        limiter = RateLimiter([RouteGroup('api', rate=1)], CacheStore('default'), clock=self.clock)
+        self.assertIsNone(await limiter.acheck(self.request()))
+        self.assertIsNotNone(await limiter.acheck(self.request()))
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(METRICS_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        translation.activate('en')
+
+    def test_histogram_buckets(self):
+        registry = get_registry()
+        for value in (0.003, 0.02, 0.02, 30):
+            registry.observe(REQUEST_DURATION, {'view': 'v', 'status': '2xx'}, value)
+        text = render_prometheus(registry.collect())
+        self.assertIn('# TYPE django_http_request_duration_seconds histogram', text)
+        self.assertIn('django_http_request_duration_seconds_bucket{status="2xx",view="v",le="0.005"} 1', text)
+        self.assertIn('django_http_request_duration_seconds_bucket{status="2xx",view="v",le="0.025"} 3', text)
+        self.assertIn('django_http_request_duration_seconds_bucket{status="2xx",view="v",le="10.0"} 3', text)
+        self.assertIn('django_http_request_duration_seconds_bucket{status="2xx",view="v",le="+Inf"} 4', text)
+        self.assertIn('django_http_request_duration_seconds_count{status="2xx",view="v"} 4', text)
+
+    def test_aggregates_worker_files(self):
+        get_registry().observe(REQUEST_DURATION, {'view': 'v', 'status': '2xx'}, 0.1)
+        # файл другого воркера
+        other = MetricsFile(os.path.join(self.directory, 'metrics-1.bin'))
+        key = next(iter(get_registry().file.slots))
+        other.add(key, 0.2, 4)
+        other.add(key, 0.3, 5)
+        totals = get_registry().collect()
+        self.assertEqual(totals[key][0], 3)
+        self.assertAlmostEqual(totals[key][1], 0.6)
+
+    def test_file_grows(self):
+        registry = get_registry()
+        for index in range(600):
+            registry.inc('test_total', {'n': str(index)})
+        self.assertEqual(len(registry.collect()), 600)
+
+    def test_long_labels_are_shortened(self):
+        registry = get_registry()
+        for suffix in ('a', 'b'):
+            registry.inc('test_total', {'view': 'v' * 300 + suffix, 'status': '2xx'})
+        keys = list(registry.collect())
+        self.assertEqual(len(keys), 2)
+        for key in keys:
+            self.assertLessEqual(len(key), KEY_SIZE)
+            name, labels = json.loads(key)
+            self.assertEqual(dict(labels)['status'], '2xx')
+            self.assertRegex(dict(labels)['view'], r'^v+~[0-9a-f]{8}$')
+
+    def test_middleware_records_view_and_status(self):
+        self.client.get(reverse('shopapp:products_list'))
+        self.client.get('/en/shop/products/0/')
+        text = render_prometheus(get_registry().collect())
+        self.assertIn('_count{status="2xx",view="shopapp:products_list"} 1', text)
+        self.assertIn('_count{status="4xx",view="shopapp:product_details"} 1', text)
+
+    def test_endpoint_is_staff_only(self):
+        url = reverse('requestdataapp:metrics')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_user('metrics-user'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_user('metrics-staff', is_staff=True))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('django_http_request_duration_seconds_bucket', response.content.decode())
+
+
+def n_plus_one_view(request):
+    for order in Order.objects.all():
+        list(order.products.all())
+    return HttpResponse('ok')
+
+
+async def async_queries_view(request):
+    await sync_to_async(list)(Product.objects.all())
+    [product async for product in Product.objects.all()]
+    return HttpResponse('ok')
+
+
+class SQLProfilerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('sql-profiler', is_staff=True)
+        product = Product.objects.create(name='Product', price=1, created_by=cls.user)
+        for _ in range(6):
+            Order.objects.create(user=cls.user).products.add(product)
+
+    def setUp(self) -> None:
+        self.request = RequestFactory().get('/')
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t0 WHERE id = 5 AND name = 'it''s'  AND pk IN (%s, %s)"),
+            'SELECT * FROM t0 WHERE id = ? AND name = ? AND pk IN (...)',
+        )
+        self.assertEqual(normalize_sql('... IN (%s)'), normalize_sql('... IN (%s, %s, %s)'))
+
+    def test_detects_n_plus_one(self):
+        middleware = SQLProfilerMiddleware(n_plus_one_view, sample_rate=1)
+        with self.assertLogs('requestdataapp.sql', 'WARNING') as logs:
+            response = middleware(self.request)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['queries'], 7)
+        self.assertEqual(record['duplicates'], 5)
+        self.assertEqual(record['n_plus_one'][0]['count'], 6)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="7 queries", app;dur=[\d.]+$')
+
+    def test_not_sampled(self):
+        middleware = SQLProfilerMiddleware(n_plus_one_view, sample_rate=0)
+        with self.assertNoLogs('requestdataapp.sql'):
+            response = middleware(self.request)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    async def test_async_queries_are_profiled(self):
+        middleware = SQLProfilerMiddleware(async_queries_view, sample_rate=1)
+        with self.assertLogs('requestdataapp.sql', 'INFO') as logs:
+            await middleware(self.request)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['queries'], record['n_plus_one']), (2, []))
+
+    def test_orders_list_has_no_n_plus_one(self):
+        translation.activate('en')
+        self.client.force_login(self.user)
+        with profile_queries() as profile:
+            response = self.client.get(reverse('shopapp:orders_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(profile.count, 0)
+        self.assertEqual(profile.repeated(1), [])
+
+
+class ProfilingTestCase(TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(PROFILING={'DIR': self.directory, 'MAX_FILES': 2})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.factory = RequestFactory()
+        self.staff = User.objects.create_user('profiling-staff', is_staff=True)
+        translation.activate('en')
+
+    def test_signed_token(self):
+        middleware = ProfilingMiddleware(sync_view)
+        token = make_token('/en/shop/api/')
+        response = middleware(self.factory.get('/en/shop/api/orders/', headers={PROFILE_HEADER: token}))
+        name = response['X-Profile-Id']
+        self.assertIn('-GET-en-shop-api-orders-', name)
+        stats = pstats.Stats(os.path.join(self.directory, name))
+        self.assertTrue(any(function[2] == 'sync_view' for function in stats.stats))
+        # другой путь и испорченный токен не профилируются
+        for request in (
+            self.factory.get('/en/shop/products/', headers={PROFILE_HEADER: token}),
+            self.factory.get('/en/shop/api/orders/', headers={PROFILE_HEADER: token + 'x'}),
+            self.factory.get('/en/shop/api/orders/'),
+        ):
+            self.assertFalse(middleware(request).has_header('X-Profile-Id'))
+
+    async def test_async_token(self):
+        middleware = ProfilingMiddleware(async_view)
+        request = self.factory.get('/', headers={PROFILE_HEADER: make_token()})
+        response = await middleware(request)
+        self.assertTrue(response['X-Profile-Id'].endswith('.prof'))
+
+    def test_staff_flag_and_ring(self):
+        url = reverse('shopapp:products_list')
+        self.client.force_login(User.objects.create_user('profiling-user'))
+        self.assertFalse(self.client.get(url, {'_profile': 1}).has_header('X-Profile-Id'))
+        self.client.force_login(self.staff)
+        names = [self.client.get(url, {'_profile': 1})['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(ProfileStore(self.directory, 2).names(), names[1:])
+
+    def test_list_and_download(self):
+        name = ProfilingMiddleware(sync_view)(self.factory.get('/', headers={PROFILE_HEADER: make_token()}))['X-Profile-Id']
+        list_url = reverse('requestdataapp:profiles')
+        download_url = reverse('requestdataapp:profile-download', kwargs={'name': name})
+        self.assertEqual(self.client.get(list_url).status_code, 302)
+        self.assertEqual(self.client.get(download_url).status_code, 302)
+        self.client.force_login(self.staff)
+        self.assertContains(self.client.get(list_url), name)
+        response = self.client.get(download_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response['Content-Disposition'])
+        bad_url = reverse('requestdataapp:profile-download', kwargs={'name': '..secret.prof'})
+        self.assertEqual(self.client.get(bad_url).status_code, 404)
+
+
+class SlowRequestLogTestCase(TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.factory = RequestFactory()
+
+    def middleware(self, view, **config):
+        return SlowRequestMiddleware(view, config={'DIR': self.directory, 'FLUSH_INTERVAL': 0, **config})
+
+    def test_reservoir_keeps_last_values(self):
+        reservoir = Reservoir(4)
+        for value in range(1, 7):
+            reservoir.add(value)
+        self.assertEqual(reservoir.samples().tolist(), [3, 4, 5, 6])
+        ordered = list(range(1, 101))
+        self.assertEqual([percentile(ordered, q) for q in (50, 95, 99, 100)], [50, 95, 99, 100])
+
+    def test_slow_requests_are_logged(self):
+        User.objects.create_user('slow-log')
+
+        def slow_view(request):
+            list(User.objects.all())
+            return HttpResponse('ok')
+
+        self.middleware(slow_view, THRESHOLD_MS=0)(self.factory.get('/en/shop/api/orders/', {'page_size': 5}))
+        self.middleware(sync_view, THRESHOLD_MS=10000)(self.factory.get('/fast/'))
+        records = list(iter_slow_records(self.directory))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['path'], '/en/shop/api/orders/')
+        self.assertEqual(records[0]['params'], {'page_size': ['5']})
+        self.assertEqual(records[0]['queries'], 1)
+        # оба запроса попали в резервуар, он сброшен на диск
+        self.assertEqual(len(load_latency_samples(self.directory)['<unresolved>']), 2)
+
+    def test_statements_are_not_tracked(self):
+        profiles = []
+
+        def view(request):
+            with profile_queries() as inner:
+                list(User.objects.all())
+            profiles.append(inner.parent)
+            return HttpResponse('ok')
+
+        self.middleware(view, THRESHOLD_MS=0)(self.factory.get('/'))
+        # запрос учтён, но текст SQL в профиль медленных запросов не попал
+        self.assertEqual(profiles[0].count, 1)
+        self.assertEqual(profiles[0].statements, {})
+
+    async def test_async_request(self):
+        middleware = self.middleware(async_view, THRESHOLD_MS=0)
+        loop = threading.get_ident()
+        writers = []
+        persist = middleware.persist
+
+        def spy(*args):
+            writers.append(threading.get_ident())
+            persist(*args)
+
+        middleware.persist = spy
+        await middleware(self.factory.get('/'))
+        self.assertEqual(len(list(iter_slow_records(self.directory))), 1)
+        # файлы пишутся не в потоке цикла событий
+        self.assertEqual(len(writers), 1)
+        self.assertNotEqual(writers[0], loop)
+
+    def test_perf_report(self):
+        middleware = self.middleware(sync_view, THRESHOLD_MS=0)
+        for _ in range(3):
+            middleware(self.factory.get('/en/shop/products/', {'q': 'phone'}))
+        out = StringIO()
+        call_command('perf_report', dir=self.directory, top=2, stdout=out)
+        report = out.getvalue()
+        self.assertIn('Slow requests: 3 logged', report)
+        self.assertIn('GET /en/shop/products/?q=phone', report)
+        self.assertRegex(report, r'<unresolved>\s+3 ')
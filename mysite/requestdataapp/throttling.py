@@ -0,0 +1,198 @@
+"""
+Ограничение частоты запросов по IP.
+
+Алгоритм - скользящее окно на двух счётчиках: оценка числа запросов за
+последние ``period`` секунд равна ``previous * (1 - доля прошедшего окна) + current``.
+Счётчики хранятся либо в процессе (``LocalStore``, LRU на ``MAX_CLIENTS``
+ключей), либо в кэше Django (``CacheStore``), тогда лимит общий для всех
+воркеров. Для точного общего лимита нужен кэш с атомарным ``incr``
+(Redis, Memcached); файловый кэш и кэш в базе тоже работают, но приблизительно.
+
+Настройка ``THROTTLING`` в settings::
+
+    THROTTLING = {
+        'BACKEND': 'local',          # или 'cache'
+        'CACHE_ALIAS': 'default',
+        'MAX_CLIENTS': 10000,
+        'GROUPS': [
+            # первая группа, чей pattern совпал с path_info; rate=None - без лимита
+            {'name': 'api', 'pattern': r'^/[\\w-]+/shop/api/', 'rate': 300, 'period': 60},
+            {'name': 'default', 'pattern': '', 'rate': 500, 'period': 60},
+        ],
+    }
+
+Отклонённые запросы тоже учитываются, так что клиент, который не ждёт
+``Retry-After``, остаётся заблокированным.
+"""
+
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpRequest, HttpResponse
+
+DEFAULT_THROTTLING = {
+    'BACKEND': 'local',
+    'CACHE_ALIAS': 'default',
+    'MAX_CLIENTS': 10000,
+    'GROUPS': [
+        {'name': 'default', 'pattern': '', 'rate': 500, 'period': 60},
+    ],
+}
+
+
+class RouteGroup:
+    def __init__(self, name: str, pattern: str = '', rate: Optional[int] = None, period: int = 60):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.rate = rate
+        self.period = period
+
+    def matches(self, path: str) -> bool:
+        return self.pattern.search(path) is not None
+
+
+class LocalStore:
+    """
+    Счётчики окон в памяти процесса, не больше ``max_clients`` ключей:
+    давно не приходившие клиенты вытесняются первыми.
+    """
+    def __init__(self, max_clients: int = 10000):
+        self.max_clients = max_clients
+        self.windows: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def hit(self, key: str, window: int, period: int) -> Tuple[int, int]:
+        with self.lock:
+            state = self.windows.pop(key, None)
+            if state is None or state[0] < window - 1:
+                previous, current = 0, 0
+            elif state[0] == window - 1:
+                previous, current = state[2], 0
+            else:
+                previous, current = state[1], state[2]
+            current += 1
+            self.windows[key] = (window, previous, current)
+            if len(self.windows) > self.max_clients:
+                self.windows.popitem(last=False)
+        return previous, current
+
+    async def ahit(self, key: str, window: int, period: int) -> Tuple[int, int]:
+        # только память процесса, ждать нечего
+        return self.hit(key, window, period)
+
+
+class CacheStore:
+    """
+    Счётчики окон в кэше Django, общие для всех воркеров.
+    """
+    def __init__(self, alias: str = 'default'):
+        self.cache = caches[alias]
+
+    def hit(self, key: str, window: int, period: int) -> Tuple[int, int]:
+        current_key = f'{key}:{window}'
+        if self.cache.add(current_key, 1, timeout=period * 2):
+            current = 1
+        else:
+            try:
+                current = self.cache.incr(current_key)
+            except ValueError:
+                self.cache.set(current_key, 1, timeout=period * 2)
+                current = 1
+        return self.cache.get(f'{key}:{window - 1}', 0), current
+
+    async def ahit(self, key: str, window: int, period: int) -> Tuple[int, int]:
+        current_key = f'{key}:{window}'
+        if await self.cache.aadd(current_key, 1, timeout=period * 2):
+            current = 1
+        else:
+            try:
+                current = await self.cache.aincr(current_key)
+            except ValueError:
+                await self.cache.aset(current_key, 1, timeout=period * 2)
+                current = 1
+        return await self.cache.aget(f'{key}:{window - 1}', 0), current
+
+
+def retry_after(previous: int, current: int, elapsed: float, period: int, rate: int) -> int:
+    """
+    Через сколько секунд следующий запрос уложится в ``rate``.
+
+    ``current`` - уже учтённые запросы текущего окна, включая отклонённый.
+    """
+    if current < rate:
+        # хватит места в текущем окне, когда "вес" прошлого окна уменьшится
+        fraction = 1 - (rate - current - 1) / previous if previous else 0
+        wait = fraction * period - elapsed
+    else:
+        # в следующем окне текущий счётчик станет прошлым
+        fraction = max(0.0, 1 - (rate - 1) / current)
+        wait = period - elapsed + fraction * period
+    return max(1, math.ceil(wait))
+
+
+class RateLimiter:
+    def __init__(self, groups: List[RouteGroup], store, clock: Callable[[], float] = time.time):
+        self.groups = groups
+        self.store = store
+        self.clock = clock
+
+    @classmethod
+    def from_settings(cls) -> 'RateLimiter':
+        config = {**DEFAULT_THROTTLING, **getattr(settings, 'THROTTLING', {})}
+        if config['BACKEND'] == 'cache':
+            store = CacheStore(config['CACHE_ALIAS'])
+        else:
+            store = LocalStore(config['MAX_CLIENTS'])
+        return cls([RouteGroup(**group) for group in config['GROUPS']], store)
+
+    def get_group(self, path: str) -> Optional[RouteGroup]:
+        for group in self.groups:
+            if group.matches(path):
+                return group
+        return None
+
+    def prepare(self, request: HttpRequest) -> Optional[Tuple[RouteGroup, str, int, float]]:
+        group = self.get_group(request.path_info)
+        if group is None or group.rate is None:
+            return None
+        now = self.clock()
+        window = int(now // group.period)
+        key = f'throttle:{group.name}:{request.META.get("REMOTE_ADDR")}'
+        return group, key, window, now - window * group.period
+
+    @staticmethod
+    def decide(group: RouteGroup, counts: Tuple[int, int], elapsed: float) -> Optional[int]:
+        previous, current = counts
+        estimate = previous * (1 - elapsed / group.period) + current
+        if estimate <= group.rate:
+            return None
+        return retry_after(previous, current, elapsed, group.period, group.rate)
+
+    def check(self, request: HttpRequest) -> Optional[int]:
+        """
+        ``None``, если запрос можно пропустить, иначе ``Retry-After`` в секундах.
+        """
+        prepared = self.prepare(request)
+        if prepared is None:
+            return None
+        group, key, window, elapsed = prepared
+        return self.decide(group, self.store.hit(key, window, group.period), elapsed)
+
+    async def acheck(self, request: HttpRequest) -> Optional[int]:
+        prepared = self.prepare(request)
+        if prepared is None:
+            return None
+        group, key, window, elapsed = prepared
+        return self.decide(group, await self.store.ahit(key, window, group.period), elapsed)
+
+
+def too_many_requests(retry_after_seconds: int) -> HttpResponse:
+    response = HttpResponse('Too many requests', status=429)
+    response['Retry-After'] = str(retry_after_seconds)
+    return response
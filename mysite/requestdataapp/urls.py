@@ -16,11 +16,14 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from .views import process_get_view, user_form, handle_file_upload
+from .views import process_get_view, user_form, handle_file_upload, MetricsView, ProfilesListView, ProfileDownloadView
 
 app_name = 'requestdataapp'
 urlpatterns = [
     path('get/', process_get_view, name='get-view'),
     path('bio/', user_form, name='user-form'),
     path('upload/', handle_file_upload, name='file-upload'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('profiles/', ProfilesListView.as_view(), name='profiles'),
+    path('profiles/<str:name>/', ProfileDownloadView.as_view(), name='profile-download'),
 ]
@@ -1,8 +1,13 @@
+from django.contrib.auth.mixins import UserPassesTestMixin
 from django.core.files.storage import FileSystemStorage
-from django.http import HttpRequest, HttpResponse, HttpResponseBadRequest
+from django.http import FileResponse, Http404, HttpRequest, HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render
+from django.views import View
+from django.views.generic import TemplateView
 
 from requestdataapp.forms import UserBioForm, UploadFileForm
+from requestdataapp.metrics import get_registry, render_prometheus
+from requestdataapp.profiling import PROFILE_FLAG, PROFILE_HEADER, ProfileStore
 
 
 def process_get_view(request: HttpRequest) -> HttpResponse:
@@ -43,3 +48,45 @@ def handle_file_upload(request: HttpRequest) -> HttpResponse:
         'form': form,
     }
     return render(request, 'requestdataapp/file-upload.html', context=context)
+
+
+class MetricsView(UserPassesTestMixin, View):
+    """
+    Метрики всех воркеров в текстовом формате Prometheus, только для персонала.
+    """
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        return HttpResponse(
+            render_prometheus(get_registry().collect()),
+            content_type='text/plain; version=0.0.4; charset=utf-8',
+        )
+
+
+class ProfilesListView(UserPassesTestMixin, TemplateView):
+    """
+    Сохранённые профили запросов, новые сверху.
+    """
+    template_name = 'requestdataapp/profiles-list.html'
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['profiles'] = ProfileStore.from_settings().list()
+        context['profile_flag'] = PROFILE_FLAG
+        context['profile_header'] = PROFILE_HEADER
+        return context
+
+
+class ProfileDownloadView(UserPassesTestMixin, View):
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request: HttpRequest, name: str) -> FileResponse:
+        path = ProfileStore.from_settings().path(name)
+        if path is None:
+            raise Http404
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=name)
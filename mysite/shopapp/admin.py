@@ -2,8 +2,9 @@ from django.contrib import admin
 from django.db.models import QuerySet
 from django.http import HttpRequest
 
-from shopapp.models import Product, Order, ProductImage
+from shopapp.models import Product, Order, ProductImage, ExportJob
 from .admin_mixins import ExportAsCSVMixin
+from .versions import bump_version, PRODUCTS
 
 # Register your models here.
 
@@ -19,11 +20,14 @@ class ProductInline(admin.StackedInline):
 @admin.action(description='Archive products')
 def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
     queryset.update(archived=True)
+    # update() не шлёт сигналов, версию товаров поднимаем сами
+    bump_version(PRODUCTS)
 
 
 @admin.action(description='Unarchive products')
 def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=True)
+    queryset.update(archived=False)
+    bump_version(PRODUCTS)
 
 
 @admin.register(Product)
@@ -33,6 +37,17 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         mark_unarchived,
         'export_csv',
     ]
+    export_csv_fields = (
+        'id',
+        'name',
+        'description',
+        'price',
+        'discount',
+        'created_at',
+        'created_by__username',
+        'archived',
+        'preview',
+    )
     inlines = [
         OrderInline,
         ProductInline,
@@ -79,7 +94,21 @@ class ProductInline(admin.StackedInline):
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+    actions = [
+        'export_csv',
+    ]
+    export_csv_fields = (
+        'id',
+        'delivery_address',
+        'promocode',
+        'created_at',
+        'user__username',
+        'receipt',
+    )
+    export_csv_m2m_fields = (
+        'products',
+    )
     inlines = [
         ProductInline,
     ]
@@ -108,3 +137,11 @@ class OrderAdmin(admin.ModelAdmin):
 
     def user_verbose(self, obj: Order) -> str:
         return obj.user.first_name or obj.user.username
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'kind', 'status', 'source_version', 'row_count', 'created_at', 'finished_at', 'file')
+    list_filter = ['kind', 'status']
+    ordering = ('-created_at',)
+    readonly_fields = ('created_at', 'finished_at')
@@ -0,0 +1,143 @@
+"""
+Асинхронные (ASGI) представления для чтения товаров и заказов.
+
+Списки и карточки используют настройки DRF-вьюсетов (фильтры, сортировку,
+``?fields=``, keyset-курсор, кэш ответов) и быстрый сериализатор из
+``fastpath``, но запросы выполняются через асинхронный ORM (``aiterator``,
+``aget``), а выгрузки отдаются асинхронным потоком.
+"""
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import PermissionDenied
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .caching import CachedReadMixin
+from .exports import aiter_orders_rows, aiter_products_rows, get_export_format, streaming_export_response
+from .sparse import EXCLUDE_PARAM, FIELDS_PARAM
+from .views import OrderViewSet, ProductViewSet
+
+
+def json_response(data, status: int = 200) -> HttpResponse:
+    # тот же рендерер, что и у API, чтобы ответы совпадали байт в байт
+    return HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+
+
+class AsyncViewSetReadView(View):
+    """
+    Базовое асинхронное чтение по настройкам ``viewset_class``.
+    """
+    viewset_class = None
+    # параметры, которые обрабатываются без обращения к базе
+    plain_params = {'cursor', 'page_size', 'ordering', FIELDS_PARAM, EXCLUDE_PARAM}
+
+    async def dispatch(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            return json_response({'detail': exc.detail}, status=exc.status_code)
+
+    def get_viewset(self, request: HttpRequest, action: str, **kwargs):
+        viewset = self.viewset_class(
+            action=action,
+            args=(),
+            kwargs=kwargs,
+            format_kwarg=None,
+            # как у DefaultRouter
+            basename=self.viewset_class.queryset.model._meta.object_name.lower(),
+        )
+        viewset.request = Request(request)
+        return viewset
+
+    async def respond(self, viewset, get_data) -> HttpResponse:
+        if not isinstance(viewset, CachedReadMixin):
+            return json_response(await get_data())
+        data, hit = await viewset.acached_data(viewset.request, get_data)
+        response = json_response(data)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+
+    async def filter_queryset(self, viewset, queryset):
+        if set(viewset.request.query_params) <= self.plain_params:
+            return viewset.filter_queryset(queryset)
+        # валидация ModelChoiceFilter и проверка FTS-индекса читают базу синхронно
+        return await sync_to_async(viewset.filter_queryset)(queryset)
+
+
+class AsyncListView(AsyncViewSetReadView):
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        viewset = self.get_viewset(request, 'list')
+
+        async def get_data():
+            fast = viewset.get_fast_serializer()
+            queryset = await self.filter_queryset(viewset, viewset.get_queryset())
+            queryset = fast.prepare(queryset, viewset.get_fast_extra_columns(queryset))
+            paginator = viewset.paginator
+            page = await paginator.apaginate_queryset(queryset, viewset.request, view=viewset)
+            return paginator.get_paginated_data(await fast.aserialize(page))
+
+        return await self.respond(viewset, get_data)
+
+
+class AsyncDetailView(AsyncViewSetReadView):
+    async def get(self, request: HttpRequest, pk: int) -> HttpResponse:
+        viewset = self.get_viewset(request, 'retrieve', pk=pk)
+
+        async def get_data():
+            fast = viewset.get_fast_serializer()
+            # те же фильтры, что у синхронного retrieve
+            queryset = await self.filter_queryset(viewset, viewset.get_queryset())
+            try:
+                row = await fast.prepare(queryset.filter(pk=pk), ['pk']).aget()
+            except viewset.queryset.model.DoesNotExist:
+                raise NotFound
+            return (await fast.aserialize([row]))[0]
+
+        return await self.respond(viewset, get_data)
+
+
+class AsyncProductsListView(AsyncListView):
+    viewset_class = ProductViewSet
+
+
+class AsyncProductDetailsView(AsyncDetailView):
+    viewset_class = ProductViewSet
+
+
+class AsyncOrdersListView(AsyncListView):
+    viewset_class = OrderViewSet
+
+
+class AsyncProductsDataExportView(View):
+    """
+    Асинхронный вариант ``ProductsDataExportView``.
+    """
+    async def get(self, request: HttpRequest) -> StreamingHttpResponse:
+        return streaming_export_response(
+            'products',
+            aiter_products_rows(),
+            export_format=get_export_format(request),
+        )
+
+
+class AsyncOrdersDataExportView(View):
+    """
+    Асинхронный вариант ``OrdersDataExportView``, только для персонала.
+    """
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        # request.user ленивый и читает сессию синхронно
+        user = await sync_to_async(get_user)(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        if not user.is_staff:
+            raise PermissionDenied
+        return streaming_export_response(
+            'orders',
+            aiter_orders_rows(),
+            export_format=get_export_format(request),
+        )
@@ -0,0 +1,168 @@
+"""
+Пакетные операции для API магазина.
+
+Массив объектов проверяется сериализатором поштучно, а в базу
+попадает одной транзакцией через ``bulk_create``/``bulk_update``
+и пакетную вставку в промежуточные таблицы M2M. Ошибки возвращаются
+по индексу элемента во входном массиве.
+"""
+
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from django.db import transaction
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .versions import bump_version
+
+
+class BulkWriteMixin:
+    """
+    ``POST <prefix>/bulk/`` - создать, ``PATCH <prefix>/bulk/`` - частично обновить.
+
+    Для обновления каждый элемент должен содержать ``pk``, без повторов.
+    ``bulk_version_table`` - счётчик из ``versions``, который нужно поднять,
+    так как пакетные операции не отправляют сигналов моделей.
+    """
+    bulk_batch_size = 1000
+    bulk_max_items = 10000
+    bulk_version_table: str = None
+
+    def get_serializer(self, *args, **kwargs):
+        # схема OpenAPI должна описывать тело bulk-запросов как массив
+        if getattr(self, 'swagger_fake_view', False) and self.action in ('bulk', 'bulk_update'):
+            kwargs['many'] = True
+        return super().get_serializer(*args, **kwargs)
+
+    def get_bulk_items(self, request) -> list:
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of items.']})
+        if len(items) > self.bulk_max_items:
+            raise ValidationError({'non_field_errors': [f'At most {self.bulk_max_items} items are allowed.']})
+        return items
+
+    def _split_m2m(self, validated_data: dict) -> Tuple[dict, Dict[str, list]]:
+        m2m = {}
+        for field in self.get_serializer_class().Meta.model._meta.many_to_many:
+            if field.name in validated_data:
+                m2m[field.name] = validated_data.pop(field.name)
+        return validated_data, m2m
+
+    def _set_m2m(self, instances_m2m: List[Tuple[object, Dict[str, list]]], replace: bool) -> None:
+        model = self.get_serializer_class().Meta.model
+        replaced = set()
+        for field in model._meta.many_to_many:
+            through = field.remote_field.through
+            source = f'{field.m2m_field_name()}_id'
+            target = f'{field.m2m_reverse_field_name()}_id'
+            affected = [(obj, m2m[field.name]) for obj, m2m in instances_m2m if field.name in m2m]
+            if not affected:
+                continue
+            if replace:
+                through.objects.filter(**{f'{source}__in': [obj.pk for obj, _ in affected]}).delete()
+                replaced.update(obj.pk for obj, _ in affected)
+            through.objects.bulk_create(
+                [
+                    through(**{source: obj.pk, target: related.pk})
+                    for obj, related_objects in affected
+                    for related in related_objects
+                ],
+                batch_size=self.bulk_batch_size,
+                ignore_conflicts=True,
+            )
+        if replaced:
+            # m2m_changed не отправлялся: updated_at для условных GET сдвигаем сами
+            model.objects.filter(pk__in=replaced).update()
+
+    def bulk_response(self, done_key: str, done: list, errors: list, success_status: int) -> Response:
+        if errors and not done:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif errors:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = success_status
+        return Response({done_key: done, 'errors': errors}, status=response_status)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request, *args, **kwargs):
+        model = self.get_serializer_class().Meta.model
+        items = self.get_bulk_items(request)
+        errors = []
+        valid: List[Tuple[object, Dict[str, list]]] = []
+        for index, item in enumerate(items):
+            serializer = self.get_serializer(data=item)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+            data, m2m = self._split_m2m(dict(serializer.validated_data))
+            valid.append((model(**data), m2m))
+
+        with transaction.atomic():
+            model.objects.bulk_create([obj for obj, _ in valid], batch_size=self.bulk_batch_size)
+            self._set_m2m(valid, replace=False)
+            if valid and self.bulk_version_table:
+                bump_version(self.bulk_version_table)
+        return self.bulk_response('created', [obj.pk for obj, _ in valid], errors, status.HTTP_201_CREATED)
+
+    @bulk.mapping.patch
+    def bulk_update(self, request, *args, **kwargs):
+        model = self.get_serializer_class().Meta.model
+        items = self.get_bulk_items(request)
+        pks = [item.get('pk') for item in items if isinstance(item, dict)]
+        # bulk_update() записал бы только последнюю из правок одного объекта
+        counts = Counter(pk for pk in pks if isinstance(pk, int))
+        duplicates = sorted(pk for pk, count in counts.items() if count > 1)
+        if duplicates:
+            raise ValidationError({'non_field_errors': [f'Duplicate pk values: {duplicates}.']})
+        instances = model.objects.in_bulk([pk for pk in pks if isinstance(pk, int)])
+
+        errors = []
+        valid: List[Tuple[object, Dict[str, list]]] = []
+        update_fields = set()
+        for index, item in enumerate(items):
+            instance = instances.get(item.get('pk')) if isinstance(item, dict) else None
+            if instance is None:
+                errors.append({'index': index, 'errors': {'pk': ['Object not found.']}})
+                continue
+            serializer = self.get_serializer(instance, data=item, partial=True)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+            data, m2m = self._split_m2m(dict(serializer.validated_data))
+            for name, value in data.items():
+                setattr(instance, name, value)
+            update_fields.update(data)
+            valid.append((instance, m2m))
+
+        with transaction.atomic():
+            if update_fields:
+                model.objects.bulk_update(
+                    [obj for obj, _ in valid],
+                    fields=sorted(update_fields),
+                    batch_size=self.bulk_batch_size,
+                )
+            self._set_m2m(valid, replace=True)
+            if valid and self.bulk_version_table:
+                bump_version(self.bulk_version_table)
+        return self.bulk_response('updated', [obj.pk for obj, _ in valid], errors, status.HTTP_200_OK)
+
+
+class BulkArchiveMixin:
+    """
+    ``POST <prefix>/bulk-archive/`` с телом ``{"pks": [...]}``.
+    """
+    @action(detail=False, methods=['post'], url_path='bulk-archive')
+    def bulk_archive(self, request, *args, **kwargs):
+        pks = request.data.get('pks') if isinstance(request.data, dict) else None
+        if not isinstance(pks, list) or not all(isinstance(pk, int) for pk in pks):
+            raise ValidationError({'pks': ['Expected a list of integer ids.']})
+        model = self.get_serializer_class().Meta.model
+        with transaction.atomic():
+            archived = model.objects.filter(pk__in=pks).update(archived=True)
+            if archived and self.bulk_version_table:
+                bump_version(self.bulk_version_table)
+        return Response({'archived': archived})
@@ -0,0 +1,131 @@
+"""
+Кэширование ответов API магазина.
+
+Ключ строится из действия, пути, нормализованной строки запроса (фильтры,
+поиск, сортировка, курсор), языка и версии таблицы. При записи в таблицу
+версия растёт (см. ``versions``), и старые ключи просто перестают
+использоваться, так что точечно удалять их не нужно.
+"""
+
+from hashlib import md5
+from typing import Awaitable, Callable, Tuple
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import get_language
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .versions import aget_version, get_version
+
+API_CACHE_TIMEOUT = getattr(settings, 'SHOPAPP_API_CACHE_TIMEOUT', 300)
+
+API_CACHE_HITS_KEY = 'shopapp:api-cache:hits'
+API_CACHE_MISSES_KEY = 'shopapp:api-cache:misses'
+
+
+def _incr(key: str) -> None:
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+async def _aincr(key: str) -> None:
+    if not await cache.aadd(key, 1, timeout=None):
+        try:
+            await cache.aincr(key)
+        except ValueError:
+            await cache.aset(key, 1, timeout=None)
+
+
+def get_api_cache_stats() -> dict:
+    hits = cache.get(API_CACHE_HITS_KEY, 0)
+    misses = cache.get(API_CACHE_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+def reset_api_cache_stats() -> None:
+    cache.delete_many([API_CACHE_HITS_KEY, API_CACHE_MISSES_KEY])
+
+
+class CachedReadMixin:
+    """
+    Кэширует ``list``/``retrieve`` вьюсета до следующей записи в таблицу.
+
+    ``cache_version_table`` - имя счётчика из ``versions``, от которого
+    зависит ответ. Ответ помечается заголовком ``X-Cache: HIT``/``MISS``.
+    """
+    cache_version_table: str = None
+    cache_timeout = API_CACHE_TIMEOUT
+
+    def get_response_cache_key(self, request: Request) -> str:
+        return self.build_response_cache_key(request, get_version(self.cache_version_table))
+
+    async def aget_response_cache_key(self, request: Request) -> str:
+        return self.build_response_cache_key(request, await aget_version(self.cache_version_table))
+
+    def build_response_cache_key(self, request: Request, version: int) -> str:
+        query = urlencode(sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            for value in values
+        ))
+        raw = '|'.join([
+            self.basename,
+            self.action,
+            str(self.kwargs.get(self.lookup_url_kwarg or self.lookup_field, '')),
+            get_language() or '',
+            request.scheme,
+            request.get_host(),
+            # синхронный API и async-представления отдают разные ссылки пагинации
+            request.path,
+            query,
+        ])
+        return f'shopapp:api:{self.cache_version_table}:{version}:{md5(raw.encode()).hexdigest()}'
+
+    def cached_response(self, handler, request: Request, *args, **kwargs) -> Response:
+        key = self.get_response_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            _incr(API_CACHE_HITS_KEY)
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        _incr(API_CACHE_MISSES_KEY)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, self.cache_timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    async def acached_data(self, request: Request, get_data: Callable[[], Awaitable]) -> Tuple[object, bool]:
+        """
+        Асинхронный вариант для ``async_views``: данные и признак попадания в кэш.
+
+        Ключ включает путь, так что с кэшем синхронного API он не смешивается.
+        """
+        key = await self.aget_response_cache_key(request)
+        data = await cache.aget(key)
+        if data is not None:
+            await _aincr(API_CACHE_HITS_KEY)
+            return data, True
+
+        await _aincr(API_CACHE_MISSES_KEY)
+        data = await get_data()
+        await cache.aset(key, data, self.cache_timeout)
+        return data, False
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,129 @@
+"""
+Условные GET-запросы (``If-None-Match``/``If-Modified-Since``) для товаров и заказов.
+
+Валидаторы считаются одним лёгким запросом по ``updated_at`` (строка
+или ключи строк страницы) до того, как что-то загружено и сериализовано.
+Если клиент прислал совпадающие валидаторы, ответ - 304 без тела.
+"""
+
+from calendar import timegm
+from datetime import datetime
+from hashlib import md5
+from typing import Callable, Iterable, Optional, Tuple
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.utils.translation import get_language
+
+from .caching import CachedReadMixin
+
+Validators = Tuple[str, Optional[datetime]]
+
+
+def make_etag(parts: Iterable) -> str:
+    return quote_etag(md5('|'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def conditional_response(validators: Optional[Validators], handler: Callable, request, *args, **kwargs):
+    """
+    304/412 по валидаторам, иначе ответ ``handler`` с ``ETag`` и ``Last-Modified``.
+
+    ``validators=None`` - объекта нет, ``handler`` сам ответит 404.
+    """
+    if validators is None:
+        return handler(request, *args, **kwargs)
+    etag, last_modified = validators
+    timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = handler(request, *args, **kwargs)
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+class ConditionalDetailMixin:
+    """
+    Для ``DetailView``: ``get_validators()`` вызывается до загрузки объекта.
+    """
+    def get_validators(self) -> Optional[Validators]:
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        return conditional_response(self.get_validators(), super().get, request, *args, **kwargs)
+
+
+class ConditionalReadMixin:
+    """
+    Условные ``list``/``retrieve`` для вьюсетов с моделью на ``UpdatedAtModel``.
+
+    ``retrieve`` читает только ``updated_at`` строки. ``list`` читает
+    ``(pk, updated_at)`` строк текущей страницы тем же keyset-запросом, что
+    и пагинатор, без ``COUNT(*)`` по всей выборке: так в ETag попадают и
+    изменения, и удаления на странице. У списка нет ``Last-Modified``:
+    по времени изменения строк не видно, что строку удалили.
+
+    Со ``CachedReadMixin`` валидаторы кэшируются рядом с ответом,
+    и попадание в кэш по-прежнему не стоит запросов к базе.
+    """
+    def get_etag_parts(self, request) -> list:
+        return [
+            self.basename,
+            self.action,
+            get_language() or '',
+            request.accepted_renderer.format,
+            urlencode(sorted(
+                (key, value)
+                for key, values in request.query_params.lists()
+                for value in values
+            )),
+        ]
+
+    def get_retrieve_validators(self, request) -> Optional[Validators]:
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        updated_at = (
+            self.filter_queryset(self.get_queryset())
+            .filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+            .values_list('updated_at', flat=True)
+            .first()
+        )
+        if updated_at is None:
+            return None
+        etag = make_etag([*self.get_etag_parts(request), self.kwargs[lookup_url_kwarg], updated_at.isoformat()])
+        return etag, updated_at
+
+    def get_list_validators(self, request) -> Optional[Validators]:
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        paginator = self.paginator
+        if paginator is None or not hasattr(paginator, 'get_page_queryset'):
+            return None
+        rows = paginator.get_page_queryset(queryset, request, view=self).values_list('pk', 'updated_at')
+        etag = make_etag([
+            *self.get_etag_parts(request),
+            *(f'{pk}:{updated_at.isoformat()}' for pk, updated_at in rows),
+        ])
+        return etag, None
+
+    def get_validators(self, request, compute: Callable) -> Optional[Validators]:
+        if not isinstance(self, CachedReadMixin):
+            return compute(request)
+        # ключ ответа включает версию таблицы, так что валидаторы устаревают вместе с ним
+        key = f'{self.get_response_cache_key(request)}:validators'
+        validators = cache.get(key)
+        if validators is None:
+            validators = compute(request)
+            if validators is not None:
+                cache.set(key, validators, self.cache_timeout)
+        return validators
+
+    def list(self, request, *args, **kwargs):
+        validators = self.get_validators(request, self.get_list_validators)
+        return conditional_response(validators, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        validators = self.get_validators(request, self.get_retrieve_validators)
+        return conditional_response(validators, super().retrieve, request, *args, **kwargs)
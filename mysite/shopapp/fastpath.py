@@ -0,0 +1,289 @@
+"""
+Быстрое чтение для API магазина в обход ``ModelSerializer.to_representation``.
+
+Строки читаются через ``values()``, а каждое поле сериализатора заранее
+превращается в простую функцию-конвертер (Decimal, datetime, URL файла).
+Результат совпадает с выводом ``ProductSerializer``/``OrderSerializer``
+байт в байт, но без обхода полей DRF на каждой строке.
+"""
+
+import decimal
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db.models import QuerySet
+from django.http import Http404
+from django.utils.encoding import filepath_to_uri
+from django.utils.functional import LazyObject
+from rest_framework import fields as drf_fields
+from rest_framework import relations
+from rest_framework.permissions import BasePermission
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+def _identity(value):
+    return value
+
+
+def _decimal_converter(field: drf_fields.DecimalField) -> Callable:
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if field.localize or field.decimal_places is None:
+        return field.to_representation
+
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        quantized = value.quantize(exponent, rounding=rounding, context=context)
+        return '{:f}'.format(quantized) if coerce_to_string else quantized
+
+    return convert
+
+
+def _datetime_converter(field: drf_fields.DateTimeField) -> Callable:
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != drf_fields.ISO_8601:
+        return field.to_representation
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if isinstance(value, str):
+            return value
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    return convert
+
+
+# символы, которые filepath_to_uri() оставляет как есть
+_URL_SAFE_PATH = re.compile(r"[A-Za-z0-9_.\-/~!*()']*\Z")
+
+
+def _file_converter(field: drf_fields.FileField, model_field, request) -> Callable:
+    use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+    if not use_url:
+        return lambda name: name or None
+    storage = model_field.storage
+
+    def convert(name):
+        if not name:
+            return None
+        url = storage.url(name)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    # Для FileSystemStorage с абсолютным MEDIA_URL результат storage.url()
+    # и build_absolute_uri() - это просто префикс плюс экранированное имя
+    base_url = getattr(storage, 'base_url', None)
+    real_storage = storage._wrapped if isinstance(storage, LazyObject) else storage
+    if (
+        type(real_storage).url is not FileSystemStorage.url
+        or not base_url
+        or not base_url.startswith('/')
+        or base_url.startswith('//')
+        or not base_url.endswith('/')
+        or settings.FORCE_SCRIPT_NAME is not None
+    ):
+        return convert
+
+    prefix = base_url
+    if request is not None:
+        prefix = request.build_absolute_uri('/')[:-1] + base_url
+
+    def convert_fast(name):
+        if not name:
+            return None
+        name = name.lstrip('/')
+        if '..' in name or './' in name or '\\' in name:
+            return convert(name)
+        if _URL_SAFE_PATH.match(name):
+            return prefix + name
+        return prefix + filepath_to_uri(name)
+
+    return convert_fast
+
+
+class FastRowSerializer:
+    """
+    Сериализатор строк ``values()`` по описанию полей DRF-сериализатора.
+
+    Поля, для которых нет быстрого конвертера, сериализуются своим
+    ``to_representation``, так что вывод всегда совпадает с DRF.
+    """
+    def __init__(self, serializer_class, context: dict):
+        serializer = serializer_class(context=context)
+        self.model = serializer_class.Meta.model
+        self.request = context.get('request')
+        self.columns: List[str] = []
+        self.m2m: List[Tuple[str, str]] = []
+        # (имя в ответе, колонка values(), конвертер или None для M2M)
+        self.plan: List[Tuple[str, str, Optional[Callable]]] = []
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, relations.ManyRelatedField):
+                self.m2m.append((name, field.source))
+                self.plan.append((name, field.source, None))
+            else:
+                # одна колонка может питать несколько полей
+                if field.source not in self.columns:
+                    self.columns.append(field.source)
+                self.plan.append((name, field.source, self.build_converter(field)))
+
+    def build_converter(self, field) -> Callable:
+        if isinstance(field, relations.PrimaryKeyRelatedField) and field.pk_field is None:
+            return _identity
+        if isinstance(field, drf_fields.DecimalField):
+            return _decimal_converter(field)
+        if isinstance(field, drf_fields.DateTimeField):
+            return _datetime_converter(field)
+        if isinstance(field, drf_fields.FileField):
+            return _file_converter(field, self.model._meta.get_field(field.source), self.request)
+        if isinstance(field, (
+                drf_fields.ReadOnlyField,
+                drf_fields.CharField,
+                drf_fields.IntegerField,
+                drf_fields.BooleanField,
+        )):
+            # значения из базы уже нужного типа
+            return _identity
+        return field.to_representation
+
+    def values_columns(self, extra: Iterable[str] = ()) -> List[str]:
+        columns = list(self.columns)
+        for name in extra:
+            if name not in columns:
+                columns.append(name)
+        return columns
+
+    def prepare(self, queryset: QuerySet, extra_columns: Iterable[str] = ()) -> QuerySet:
+        return (
+            queryset
+            .select_related(None)
+            .prefetch_related(None)
+            .values(*self.values_columns(extra_columns))
+        )
+
+    def _m2m_queryset(self, source: str, pks: list) -> QuerySet:
+        """
+        Пары (id объекта, id связанного) одним запросом, в порядке
+        ``Meta.ordering`` связанной модели, как у ``instance.<m2m>.all()``.
+        """
+        field = self.model._meta.get_field(source)
+        from_name = field.m2m_field_name()
+        to_name = field.m2m_reverse_field_name()
+        ordering = [
+            f'-{to_name}__{name[1:]}' if name.startswith('-') else f'{to_name}__{name}'
+            for name in field.related_model._meta.ordering
+        ]
+        return (
+            field.remote_field.through.objects
+            .filter(**{f'{from_name}__in': pks})
+            .order_by(f'{from_name}_id', *ordering, f'{to_name}_id')
+            .values_list(f'{from_name}_id', f'{to_name}_id')
+        )
+
+    def _m2m_values(self, source: str, rows: List[dict]) -> Dict[object, list]:
+        pks = [row['pk'] for row in rows]
+        result = {pk: [] for pk in pks}
+        for from_id, to_id in self._m2m_queryset(source, pks):
+            result[from_id].append(to_id)
+        return result
+
+    async def _am2m_values(self, source: str, rows: List[dict]) -> Dict[object, list]:
+        pks = [row['pk'] for row in rows]
+        result = {pk: [] for pk in pks}
+        async for from_id, to_id in self._m2m_queryset(source, pks):
+            result[from_id].append(to_id)
+        return result
+
+    def _serialize_rows(self, rows: List[dict], related: Dict[str, dict]) -> List[dict]:
+        plan = self.plan
+        result = []
+        for row in rows:
+            data = {}
+            for name, source, convert in plan:
+                if convert is None:
+                    data[name] = related[name][row['pk']]
+                    continue
+                value = row[source]
+                data[name] = None if value is None else convert(value)
+            result.append(data)
+        return result
+
+    def serialize(self, rows: Iterable[dict]) -> List[dict]:
+        rows = list(rows)
+        related = {name: self._m2m_values(source, rows) for name, source in self.m2m} if rows else {}
+        return self._serialize_rows(rows, related)
+
+    async def aserialize(self, rows: List[dict]) -> List[dict]:
+        related = {}
+        if rows:
+            for name, source in self.m2m:
+                related[name] = await self._am2m_values(source, rows)
+        return self._serialize_rows(rows, related)
+
+
+class FastReadMixin:
+    """
+    ``list``/``retrieve`` через ``FastRowSerializer``.
+
+    Фильтры, сортировка, пагинация и ``?fields=`` работают как обычно,
+    только queryset отдаёт словари вместо экземпляров модели. Поэтому
+    если какой-то класс прав переопределяет ``has_object_permission``
+    (ему нужен экземпляр: ``obj.created_by``, ``obj.user``), ``retrieve``
+    идёт обычным путём DRF.
+    """
+    def get_fast_serializer(self) -> FastRowSerializer:
+        return FastRowSerializer(self.get_serializer_class(), self.get_serializer_context())
+
+    def get_fast_extra_columns(self, queryset: QuerySet) -> List[str]:
+        # pk нужен для M2M, а колонки курсора - для keyset-пагинации
+        columns = ['pk']
+        paginator = self.paginator
+        if paginator is not None and hasattr(paginator, 'get_keyset'):
+            columns += [name for name, _ in paginator.get_keyset(self.request, queryset, self).fields]
+        return columns
+
+    def list(self, request, *args, **kwargs):
+        fast = self.get_fast_serializer()
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = fast.prepare(queryset, self.get_fast_extra_columns(queryset))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(fast.serialize(page))
+        return Response(fast.serialize(queryset))
+
+    def has_object_permission_checks(self) -> bool:
+        return any(
+            type(permission).has_object_permission is not BasePermission.has_object_permission
+            for permission in self.get_permissions()
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.has_object_permission_checks():
+            return super().retrieve(request, *args, **kwargs)
+        fast = self.get_fast_serializer()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+        row: Optional[dict] = fast.prepare(queryset, ['pk']).first()
+        if row is None:
+            raise Http404
+        return Response(fast.serialize([row])[0])
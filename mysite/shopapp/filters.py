@@ -0,0 +1,38 @@
+"""
+Фильтры API магазина.
+
+Фильтры по M2M строятся через ``EXISTS`` к промежуточной таблице,
+а не через JOIN: так заказ не размножается на число совпавших товаров
+и не нужен ``DISTINCT``.
+"""
+
+from django.db.models import Exists, OuterRef, QuerySet
+from django_filters import rest_framework as filters
+
+from .models import Order, Product
+
+
+class OrderFilter(filters.FilterSet):
+    products = filters.ModelMultipleChoiceFilter(
+        queryset=Product.objects.all(),
+        method='filter_products',
+    )
+
+    class Meta:
+        model = Order
+        fields = [
+            'delivery_address',
+            'promocode',
+            'created_at',
+            'user',
+            'products',
+        ]
+
+    def filter_products(self, queryset: QuerySet, name: str, value) -> QuerySet:
+        # заказы, в которых есть хотя бы один из переданных товаров
+        if not value:
+            return queryset
+        through = Order.products.through
+        return queryset.filter(Exists(
+            through.objects.filter(order_id=OuterRef('pk'), product__in=value)
+        ))
@@ -2,15 +2,52 @@ from django import forms
 from django.contrib.auth.models import Group
 
 from .models import Product, Order
+from .uploads import find_invalid_images
+
+
+class MultipleFileInput(forms.FileInput):
+    allow_multiple_selected = True
+
+    def __init__(self, attrs=None):
+        super().__init__({'multiple': True, **(attrs or {})})
+
+    def value_from_datadict(self, data, files, name):
+        return files.getlist(name)
+
+
+class MultipleFileField(forms.FileField):
+    """
+    Список файлов; каждый проверяется как в ``FileField``.
+    """
+    widget = MultipleFileInput
+
+    def clean(self, data, initial=None):
+        files = [super(MultipleFileField, self).clean(file, initial) for file in data or []]
+        files = [file for file in files if file]
+        if self.required and not files:
+            raise forms.ValidationError(self.error_messages['required'], code='required')
+        return files
 
 
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product
         fields = 'name', 'price', 'description', 'discount', 'preview'
-    images = forms.ImageField(
-        widget=forms.ClearableFileInput(attrs={'multiple': True}),
-    )
+    images = MultipleFileField(required=False)
+
+    def clean_images(self):
+        images = self.cleaned_data['images']
+        invalid = find_invalid_images(images)
+        if invalid:
+            raise forms.ValidationError([
+                forms.ValidationError(
+                    '%(name)s: %(error)s',
+                    code='invalid_image',
+                    params={'name': file.name, 'error': forms.ImageField.default_error_messages['invalid_image']},
+                )
+                for file in invalid
+            ])
+        return images
 
 
 class OrderForm(forms.ModelForm):
@@ -0,0 +1,58 @@
+"""
+Уменьшенные копии картинок на Pillow.
+
+Модуль не трогает Django: функции выполняются в дочерних процессах
+``ProcessPoolExecutor`` и получают и возвращают только байты.
+"""
+
+from io import BytesIO
+from typing import Iterable, List, Tuple
+
+from PIL import Image, ImageOps
+
+# формат -> (расширение, параметры Image.save)
+FORMATS = {
+    'webp': ('webp', {'format': 'WEBP', 'method': 4}),
+    'jpeg': ('jpg', {'format': 'JPEG', 'optimize': True, 'progressive': True}),
+}
+
+# (ширина, формат, байты)
+Variant = Tuple[int, str, bytes]
+
+
+def target_widths(source_width: int, widths: Iterable[int]) -> List[int]:
+    """
+    Ширины копий без увеличения: всё, что меньше исходной,
+    и сама исходная, если какая-то из ``widths`` до неё дотягивается.
+    """
+    widths = sorted(set(widths))
+    result = [width for width in widths if width < source_width]
+    if widths and widths[-1] >= source_width:
+        result.append(source_width)
+    return result
+
+
+def _for_format(image: Image.Image, fmt: str) -> Image.Image:
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if fmt == 'webp' and has_alpha:
+        return image.convert('RGBA')
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def render_variants(data: bytes, widths: Iterable[int], formats: Iterable[str], quality: int) -> List[Variant]:
+    with Image.open(BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        image.load()
+
+    variants = []
+    for width in target_widths(image.width, widths):
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+        for fmt in formats:
+            _, options = FORMATS[fmt]
+            buffer = BytesIO()
+            _for_format(resized, fmt).save(buffer, quality=quality, **options)
+            variants.append((width, fmt, buffer.getvalue()))
+    return variants
@@ -0,0 +1,67 @@
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from shopapp.fastpath import FastRowSerializer
+from shopapp.models import Product
+from shopapp.serializers import ProductSerializer
+
+
+class Command(BaseCommand):
+    """
+    Compare rows per second of ProductSerializer and FastRowSerializer.
+
+    Test rows are created inside a transaction that is rolled back.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def measure(self, func, repeat: int) -> float:
+        best = None
+        for _ in range(repeat):
+            start = default_timer()
+            func()
+            elapsed = default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        request = Request(APIRequestFactory().get('/shop/api/products/', HTTP_HOST='localhost'))
+        context = {'request': request}
+
+        with transaction.atomic():
+            user = User.objects.create(username='bench-api-serializers')
+            Product.objects.bulk_create(
+                Product(
+                    name=f'Product {index}',
+                    description='Lorem ipsum dolor sit amet ' * 10,
+                    price=index % 1000 + 0.99,
+                    discount=index % 50,
+                    created_by=user,
+                    preview=f'products/preview/{index}.png',
+                )
+                for index in range(rows)
+            )
+            queryset = Product.objects.filter(created_by=user).order_by('pk')
+
+            drf_time = self.measure(
+                lambda: ProductSerializer(list(queryset), many=True, context=context).data,
+                options['repeat'],
+            )
+            fast = FastRowSerializer(ProductSerializer, context)
+            fast_time = self.measure(
+                lambda: fast.serialize(fast.prepare(queryset, ['pk'])),
+                options['repeat'],
+            )
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'ProductSerializer:  {rows / drf_time:12,.0f} rows/s')
+        self.stdout.write(f'FastRowSerializer:  {rows / fast_time:12,.0f} rows/s')
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {drf_time / fast_time:.1f}x'))
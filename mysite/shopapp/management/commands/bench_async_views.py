@@ -0,0 +1,113 @@
+import asyncio
+from statistics import quantiles
+from timeit import default_timer
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+from django.test import AsyncClient, override_settings
+from django.urls import reverse
+from django.utils import translation
+
+from shopapp.models import Product
+
+BENCH_NAME = 'bench-async-views'
+
+
+class Command(BaseCommand):
+    """
+    Compare sync and async shop read views under concurrent ASGI requests.
+
+    Requests go through the ASGI handler in process (the same path uvicorn uses),
+    so sync views pay the thread hop and async views run on the event loop.
+    Test rows are created before the run and deleted afterwards.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--page-size', type=int, default=50)
+
+    async def run_target(self, run: int, url: str, query: dict, options: dict) -> dict:
+        # отдельный адрес клиента на каждый слот, чтобы не упереться в ThrottlingMiddleware
+        clients = [
+            AsyncClient(client=[f'10.{run}.{slot // 256}.{slot % 256}', 0])
+            for slot in range(options['concurrency'])
+        ]
+        queue = asyncio.Queue()
+        for _ in range(options['requests']):
+            queue.put_nowait(None)
+        latencies = []
+        errors = 0
+
+        async def worker(client):
+            nonlocal errors
+            while not queue.empty():
+                queue.get_nowait()
+                start = default_timer()
+                response = await client.get(url, query)
+                if response.streaming:
+                    # так же, как ASGI-обработчик: синхронный поток читается в потоке
+                    async for _ in response:
+                        pass
+                latencies.append(default_timer() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = default_timer()
+        await asyncio.gather(*(worker(client) for client in clients))
+        elapsed = default_timer() - start
+        cuts = quantiles(latencies, n=20)
+        return {
+            'rps': len(latencies) / elapsed,
+            'p50': cuts[9] * 1000,
+            'p95': cuts[18] * 1000,
+            'errors': errors,
+        }
+
+    async def run_all(self, targets, options) -> list:
+        results = []
+        for run, (label, url, query) in enumerate(targets, start=1):
+            # прогрев: первый запрос импортирует модули и открывает соединение
+            await AsyncClient(client=[f'10.{run}.255.255', 0]).get(url, query)
+            results.append((label, await self.run_target(run, url, query, options)))
+        return results
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username=BENCH_NAME)
+        Product.objects.bulk_create(
+            [
+                Product(name=f'{BENCH_NAME} {index}', price=index % 1000, created_by=user)
+                for index in range(options['rows'])
+            ],
+            batch_size=1000,
+        )
+        try:
+            # AsyncClient всегда шлёт Host: testserver
+            allowed_hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+            with translation.override('en'), override_settings(ALLOWED_HOSTS=allowed_hosts):
+                page = {'page_size': options['page_size']}
+                targets = [
+                    ('sync  api/products/', reverse('shopapp:product-list'), page),
+                    ('async async/products/', reverse('shopapp:async-product-list'), page),
+                    ('sync  api/orders/', reverse('shopapp:order-list'), page),
+                    ('async async/orders/', reverse('shopapp:async-order-list'), page),
+                    ('sync  products/export/', reverse('shopapp:products-export'), {}),
+                    ('async async/products/export/', reverse('shopapp:async-products-export'), {}),
+                ]
+                results = asyncio.run(self.run_all(targets, options))
+        finally:
+            Product.objects.filter(created_by=user).delete()
+            user.delete()
+
+        self.stdout.write(
+            f'{options["requests"]} requests, concurrency {options["concurrency"]}, '
+            f'{Product.objects.count() + options["rows"]} products'
+        )
+        for label, result in results:
+            self.stdout.write(
+                f'{label:32} {result["rps"]:8.1f} req/s  '
+                f'p50 {result["p50"]:7.1f} ms  p95 {result["p95"]:7.1f} ms  '
+                f'errors {result["errors"]}'
+            )
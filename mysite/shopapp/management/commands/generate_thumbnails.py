@@ -0,0 +1,82 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from django.core.management import BaseCommand
+
+from shopapp.models import Product, ProductImage
+from shopapp.thumbnails import (
+    get_thumbnail_settings,
+    get_variants,
+    make_pool,
+    read_source,
+    render_variants,
+    save_variants,
+    store_preview_variants,
+    touch_products,
+)
+
+
+class Command(BaseCommand):
+    """
+    Generate missing thumbnails for product previews and images in parallel
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Worker processes (default: one per CPU)')
+        parser.add_argument('--force', action='store_true', help='Regenerate existing thumbnails')
+
+    def iter_sources(self):
+        for field, queryset, product_pk in (
+                ('preview', Product.objects.exclude(preview=''), 'pk'),
+                ('image', ProductImage.objects.exclude(image=''), 'product_id'),
+        ):
+            storage = queryset.model._meta.get_field(field).storage
+            for name, pk in queryset.exclude(**{f'{field}__isnull': True}).values_list(field, product_pk).iterator():
+                yield name, pk, storage
+
+    def handle(self, *args, **options):
+        config = get_thumbnail_settings()
+        sources = [
+            (name, pk, storage)
+            for name, pk, storage in self.iter_sources()
+            if options['force'] or not get_variants(name)
+        ]
+        self.stdout.write(f'{len(sources)} images need thumbnails')
+
+        done = failed = 0
+        touched = set()
+        workers = options['workers'] or os.cpu_count() or 1
+        # в полёте не больше двух картинок на процесс, чтобы не держать в памяти весь каталог
+        limit = 2 * workers
+        with make_pool(workers) as pool:
+            pending = {}
+            sources = iter(sources)
+            while True:
+                for name, pk, storage in sources:
+                    try:
+                        data = read_source(name, storage)
+                    except OSError as exc:
+                        failed += 1
+                        self.stderr.write(f'{name}: {exc}')
+                        continue
+                    future = pool.submit(render_variants, data, config['SIZES'], config['FORMATS'], config['QUALITY'])
+                    pending[future] = (name, pk)
+                    if len(pending) >= limit:
+                        break
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, pk = pending.pop(future)
+                    try:
+                        store_preview_variants(name, pk, save_variants(name, future.result()))
+                    except Exception as exc:
+                        failed += 1
+                        self.stderr.write(f'{name}: {exc}')
+                        continue
+                    done += 1
+                    touched.add(pk)
+
+        if touched:
+            touch_products(*touched)
+        self.stdout.write(self.style.SUCCESS(f'Thumbnails generated for {done} images, {failed} failed'))
@@ -0,0 +1,136 @@
+import datetime
+import re
+from decimal import Decimal
+from typing import Iterator, List, Optional, Tuple
+
+from django.core.management import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, models
+from django.db.models import QuerySet
+from django.utils import timezone
+from django_filters.rest_framework import DjangoFilterBackend
+
+from shopapp.pagination import Keyset
+from shopapp.views import OrderViewSet, ProductViewSet, ProductsListView
+
+VIEWSETS = [ProductViewSet, OrderViewSet]
+
+# признаки полного чтения таблицы и сортировки во временной структуре
+PLAN_PATTERNS = {
+    'sqlite': (
+        re.compile(r'\bSCAN (?!.*\bUSING (?:COVERING )?INDEX\b)\S+'),
+        re.compile(r'\bUSE TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY\b'),
+    ),
+    'postgresql': (
+        re.compile(r'\bSeq Scan on\b'),
+        re.compile(r'(?:^|->\s*)(?:Incremental )?Sort\b', re.M),
+    ),
+    'mysql': (
+        re.compile(r'\btype\W+ALL\b|\bTable scan\b', re.I),
+        re.compile(r'\bfilesort\b', re.I),
+    ),
+}
+
+
+def sample_value(field):
+    if field.many_to_many:
+        return [1]
+    if field.is_relation:
+        return 1
+    if isinstance(field, models.BooleanField):
+        return False
+    if isinstance(field, models.DateTimeField):
+        return timezone.now()
+    if isinstance(field, models.DateField):
+        return datetime.date.today()
+    if isinstance(field, models.DecimalField):
+        return Decimal('0')
+    if isinstance(field, (models.IntegerField, models.FloatField)):
+        return 0
+    return ''
+
+
+class Command(BaseCommand):
+    """
+    EXPLAIN every filter/ordering combination the shop API exposes
+    and report the ones that read the whole table or sort in a temporary structure
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument(
+            '--fail',
+            action='store_true',
+            help='Exit with an error if any combination is not covered by an index',
+        )
+
+    def combinations(self, viewset) -> Iterator[Tuple[str, QuerySet]]:
+        view = viewset()
+        queryset = viewset.queryset.all()
+        model = queryset.model
+        page_size = view.paginator.page_size if view.paginator is not None else None
+
+        filterset_class = DjangoFilterBackend().get_filterset_class(view, queryset)
+        filterset = filterset_class(data={}, queryset=queryset) if filterset_class else None
+        filters = [None] + (list(filterset.filters) if filterset else [])
+        orderings = [None] + list(view.ordering_fields or [])
+
+        for filter_name in filters:
+            filtered = queryset
+            if filter_name is not None:
+                filter_ = filterset.filters[filter_name]
+                value = sample_value(model._meta.get_field(filter_.field_name))
+                filtered = filter_.filter(queryset, value)
+            for ordering in orderings:
+                keyset = Keyset(model, [ordering] if ordering else list(model._meta.ordering))
+                label = '{} filter={} ordering={}'.format(
+                    viewset.__name__, filter_name or '-', ','.join(keyset.ordering),
+                )
+                yield label, filtered.order_by(*keyset.order_by())[:page_size]
+
+    def extra_combinations(self) -> Iterator[Tuple[str, QuerySet]]:
+        yield 'ProductsListView', ProductsListView.queryset.all()
+
+    def plan_issues(self, vendor: str, plan: str, filtered: bool) -> List[str]:
+        patterns: Optional[tuple] = PLAN_PATTERNS.get(vendor)
+        if patterns is None:
+            return []
+        scan, sort = patterns
+        issues = []
+        # без фильтра чтение по порядку с LIMIT останавливается на первой странице,
+        # так что полное сканирование важно только вместе с условием
+        if filtered and scan.search(plan):
+            issues.append('full scan')
+        if sort.search(plan):
+            issues.append('sort')
+        return issues
+
+    def handle(self, *args, **options):
+        database = options['database']
+        vendor = connections[database].vendor
+        if vendor not in PLAN_PATTERNS:
+            self.stdout.write(self.style.WARNING(f'Plan checks are not implemented for {vendor}'))
+
+        combinations = [
+            (label, queryset)
+            for viewset in VIEWSETS
+            for label, queryset in self.combinations(viewset)
+        ]
+        combinations += list(self.extra_combinations())
+
+        problems = 0
+        for label, queryset in combinations:
+            queryset = queryset.using(database)
+            plan = queryset.explain()
+            issues = self.plan_issues(vendor, plan, filtered=queryset.query.has_filters())
+            if issues:
+                problems += 1
+                self.stdout.write(self.style.WARNING(f'{label}: {", ".join(issues)}'))
+            elif options['verbosity'] > 1:
+                self.stdout.write(f'{label}: ok')
+            if options['verbosity'] > 2 or (issues and options['verbosity'] > 1):
+                self.stdout.write(plan)
+
+        summary = f'{problems} of {len(combinations)} query shapes are not covered by an index'
+        if problems and options['fail']:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary) if not problems else summary)
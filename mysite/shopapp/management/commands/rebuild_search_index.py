@@ -0,0 +1,27 @@
+from django.core.management import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from shopapp.search import create_search_index, search_index_available
+from shopapp.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the product full-text search index from the Product table
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                f'Full-text index is SQLite-only, {connection.vendor} uses the plain search filter'
+            ))
+            return
+        create_search_index(connection)
+        if search_index_available(connection, Product):
+            self.stdout.write(self.style.SUCCESS(
+                f'Search index rebuilt for {Product.objects.using(options["database"]).count()} products'
+            ))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management import BaseCommand
+
+from shopapp.models import ExportJob
+from shopapp.snapshots import run_export_job
+
+
+class Command(BaseCommand):
+    """
+    Refresh export snapshots whose source tables have changed
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--kind',
+            choices=[kind for kind, _ in ExportJob.KIND_CHOICES],
+            action='append',
+            help='Export kind to refresh (default: all)',
+        )
+        parser.add_argument('--force', action='store_true', help='Rebuild even if nothing changed')
+        parser.add_argument('--loop', action='store_true', help='Keep running as a worker')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        kinds = options['kind'] or [kind for kind, _ in ExportJob.KIND_CHOICES]
+        while True:
+            for kind in kinds:
+                job = run_export_job(kind, force=options['force'])
+                self.stdout.write(
+                    f'{kind}: version {job.source_version}, {job.row_count} rows, {job.file.name}'
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Export snapshots are up to date'))
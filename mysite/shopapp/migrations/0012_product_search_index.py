@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from shopapp.search import create_search_index, drop_search_index
+
+
+def forwards(apps, schema_editor):
+    create_search_index(schema_editor.connection)
+
+
+def backwards(apps, schema_editor):
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0011_tableversion_exportjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
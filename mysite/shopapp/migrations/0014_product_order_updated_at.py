@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-18 18:44
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+from shopapp.search import create_search_index
+
+
+def fill_updated_at(apps, schema_editor):
+    # для старых строк лучшее, что известно, - время создания
+    for name in ('Product', 'Order'):
+        model = apps.get_model('shopapp', name)
+        model.objects.using(schema_editor.connection.alias).update(updated_at=F('created_at'))
+
+
+def restore_search_index(apps, schema_editor):
+    # AddField/RemoveField на SQLite пересоздают таблицу товаров вместе с триггерами FTS
+    create_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0013_product_order_indexes'),
+    ]
+
+    operations = [
+        # при откате выполняется последней, после удаления колонок
+        migrations.RunPython(migrations.RunPython.noop, restore_search_index),
+        migrations.AddField(
+            model_name='order',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+        migrations.RunPython(restore_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-18 18:57
+
+from django.db import migrations, models
+import mysite.storage
+import shopapp.models
+from shopapp.search import create_search_index
+
+
+def restore_search_index(apps, schema_editor):
+    # AlterField на SQLite пересоздаёт таблицу товаров вместе с триггерами FTS
+    create_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0015_productimage_sha256'),
+    ]
+
+    operations = [
+        # при откате выполняется последней
+        migrations.RunPython(migrations.RunPython.noop, restore_search_index),
+        migrations.AlterField(
+            model_name='order',
+            name='receipt',
+            field=models.FileField(null=True, storage=mysite.storage.ContentAddressedStorage(), upload_to='orders/receipts/'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='preview',
+            field=models.ImageField(blank=True, null=True, storage=mysite.storage.ContentAddressedStorage(), upload_to=shopapp.models.product_preview_directory_path),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=mysite.storage.ContentAddressedStorage(), upload_to=shopapp.models.product_images_directory_path),
+        ),
+        migrations.RunPython(restore_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2 on 2026-10-18 19:22
+
+from django.db import migrations, models
+from shopapp.search import create_search_index
+from shopapp.thumbnails import read_manifest
+
+
+def restore_search_index(apps, schema_editor):
+    # AddField со значением по умолчанию на SQLite пересоздаёт таблицу вместе с триггерами FTS
+    create_search_index(schema_editor.connection)
+
+
+def copy_preview_variants(apps, schema_editor):
+    Product = apps.get_model('shopapp', 'Product')
+    products = Product.objects.using(schema_editor.connection.alias).exclude(preview='').exclude(preview__isnull=True)
+    for pk, preview in products.values_list('pk', 'preview').iterator():
+        variants = read_manifest(preview)
+        if variants:
+            Product.objects.using(schema_editor.connection.alias).filter(pk=pk).update(preview_variants=variants)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0016_content_addressed_storage'),
+    ]
+
+    operations = [
+        # при откате выполняется последней
+        migrations.RunPython(migrations.RunPython.noop, restore_search_index),
+        migrations.AddField(
+            model_name='product',
+            name='preview_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(copy_preview_variants, migrations.RunPython.noop),
+        migrations.RunPython(restore_search_index, migrations.RunPython.noop),
+    ]
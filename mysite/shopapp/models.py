@@ -1,7 +1,52 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from mysite.storage import content_storage
+
+
+class UpdatedAtQuerySet(models.QuerySet):
+    """
+    ``update()`` и ``bulk_update()`` сами обновляют ``updated_at``:
+    они не вызывают ``save()``, а валидаторы условных GET на него опираются.
+    """
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())
+        return super().update(**kwargs)
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        objs = list(objs)
+        now = timezone.now()
+        for obj in objs:
+            obj.updated_at = now
+        fields = list(fields)
+        if 'updated_at' not in fields:
+            fields.append('updated_at')
+        return super().bulk_update(objs, fields, batch_size=batch_size)
+
+
+class UpdatedAtModel(models.Model):
+    """
+    Модель с временем последнего изменения строки.
+
+    Поле заполняется по умолчанию (а не ``auto_now``), чтобы фикстуры
+    без него загружались, и обновляется в ``save()`` и в ``UpdatedAtQuerySet``.
+    """
+    class Meta:
+        abstract = True
+
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = UpdatedAtQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        self.updated_at = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'updated_at' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'updated_at']
+        super().save(*args, **kwargs)
+
 
 def product_preview_directory_path(instance: 'Product', filename: str) -> str:
     return 'products/product_{pk}/preview/{filename}'.format(
@@ -10,7 +55,7 @@ def product_preview_directory_path(instance: 'Product', filename: str) -> str:
     )
 
 
-class Product(models.Model):
+class Product(UpdatedAtModel):
     """
     Модель Product представляет товар,
     который можно продавать в интернет-магазине.
@@ -21,6 +66,18 @@ class Product(models.Model):
         ordering = ['name', 'price']
         verbose_name = _('Product')
         verbose_name_plural = _('Products')
+        indexes = [
+            # сортировка по умолчанию и фильтр ?name=
+            models.Index(fields=['name', 'price'], name='shopapp_product_name_price'),
+            # ?archived= вместе с сортировкой по умолчанию
+            models.Index(fields=['archived', 'name', 'price'], name='shopapp_product_archived'),
+            # витрина: только активные товары
+            models.Index(
+                fields=['name', 'price'],
+                condition=models.Q(archived=False),
+                name='shopapp_product_active',
+            ),
+        ]
 
     name = models.CharField(max_length=100)
     description = models.TextField(null=False, blank=True)
@@ -29,7 +86,9 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     archived = models.BooleanField(default=False)
-    preview = models.ImageField(null=True, blank=True, upload_to=product_preview_directory_path)
+    preview = models.ImageField(null=True, blank=True, upload_to=product_preview_directory_path, storage=content_storage)
+    # копии preview из манифеста (см. thumbnails): API читает их вместе со строкой
+    preview_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     # @property
     # def description_short(self) -> str:
@@ -49,15 +108,27 @@ def product_images_directory_path(instance: 'ProductImage', filename: str) -> st
 
 
 class ProductImage(models.Model):
+    class Meta:
+        indexes = [
+            # поиск уже загруженных файлов товара по содержимому
+            models.Index(fields=['product', 'sha256'], name='shopapp_productimage_sha256'),
+        ]
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to=product_images_directory_path)
+    image = models.ImageField(upload_to=product_images_directory_path, storage=content_storage)
     description = models.CharField(max_length=200, null=True, blank=True)
+    # пусто у картинок, загруженных до подсчёта хэшей
+    sha256 = models.CharField(max_length=64, blank=True, default='', editable=False)
 
 
-class Order(models.Model):
+class Order(UpdatedAtModel):
     class Meta:
         verbose_name = _('Order')
         verbose_name_plural = _('Orders')
+        indexes = [
+            # заказы пользователя по дате
+            models.Index(fields=['user', 'created_at'], name='shopapp_order_user_created'),
+        ]
 
     delivery_address = models.TextField(null=True, blank=True)
     promocode = models.CharField(max_length=20, null=False, blank=True)
@@ -67,7 +138,61 @@ class Order(models.Model):
     # many-to-many
     products = models.ManyToManyField(Product, related_name='orders')
 
-    receipt = models.FileField(null=True, upload_to='orders/receipts/')
+    receipt = models.FileField(null=True, upload_to='orders/receipts/', storage=content_storage)
 
     def __str__(self) -> str:
         return f'Order (pk={self.pk})'
+
+
+class TableVersion(models.Model):
+    """
+    Счётчик изменений таблицы: увеличивается при каждой записи в неё.
+
+    По нему выгрузки и кэши понимают, менялись ли данные.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    changed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f'TableVersion (name={self.name!r}, version={self.version})'
+
+
+class ExportJob(models.Model):
+    """
+    Запуск фоновой выгрузки: сжатый снимок таблицы в ``MEDIA_ROOT/exports/``.
+    """
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = _('Export job')
+        verbose_name_plural = _('Export jobs')
+
+    KIND_PRODUCTS = 'products'
+    KIND_ORDERS = 'orders'
+    KIND_CHOICES = [
+        (KIND_PRODUCTS, _('Products')),
+        (KIND_ORDERS, _('Orders')),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_RUNNING, _('Running')),
+        (STATUS_DONE, _('Done')),
+        (STATUS_FAILED, _('Failed')),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    source_version = models.PositiveBigIntegerField(default=0)
+    file = models.FileField(null=True, blank=True, upload_to='exports/')
+    row_count = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f'ExportJob (pk={self.pk}, kind={self.kind!r}, status={self.status!r})'
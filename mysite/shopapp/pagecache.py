@@ -0,0 +1,95 @@
+"""
+Кэш HTML-страниц каталога для анонимных посетителей.
+
+Для всех анонимов одного языка страница каталога одинакова, поэтому
+готовый ответ кэшируется целиком по пути, строке запроса, языку и версии
+товаров (см. ``versions``). Любая запись в ``Product``/``ProductImage``
+увеличивает версию, и старые страницы перестают использоваться.
+Вошедшим пользователям страница собирается заново: в ней могут быть
+ссылки по правам и CSRF-токены.
+
+Часы и день недели из ``base.html`` в кэше застыли бы на
+``PAGE_CACHE_TIMEOUT``, поэтому страницам с этим миксином в контекст
+передаётся ``page_cached``, и шаблон выводит время скриптом в браузере.
+"""
+
+from hashlib import md5
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from django.utils.translation import get_language
+
+from .versions import PRODUCTS, get_version
+
+PAGE_CACHE_TIMEOUT = getattr(settings, 'SHOPAPP_PAGE_CACHE_TIMEOUT', 60 * 10)
+
+
+class AnonymousPageCacheMixin:
+    """
+    Отдаёт анонимным ``GET`` закэшированную страницу без запросов к базе.
+
+    Если у закэшированной страницы есть ``ETag``/``Last-Modified``,
+    условный запрос получает 304 прямо из кэша. Ответ помечается
+    заголовком ``X-Cache: HIT``/``MISS``.
+    """
+    page_cache_version_table = PRODUCTS
+    page_cache_timeout = PAGE_CACHE_TIMEOUT
+
+    def should_cache_page(self, request: HttpRequest) -> bool:
+        # без cookie сессии проверка пользователя не идёт в базу
+        return request.method == 'GET' and not request.user.is_authenticated
+
+    def get_page_cache_key(self, request: HttpRequest) -> str:
+        query = urlencode(sorted(
+            (key, value)
+            for key, values in request.GET.lists()
+            for value in values
+        ))
+        raw = '|'.join([
+            get_language() or '',
+            request.scheme,
+            request.get_host(),
+            request.path,
+            query,
+        ])
+        version = get_version(self.page_cache_version_table)
+        return f'shopapp:page:{self.page_cache_version_table}:{version}:{md5(raw.encode()).hexdigest()}'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['page_cached'] = True
+        return context
+
+    def store_page(self, request: HttpRequest, key: str, response: HttpResponse) -> None:
+        # страница с выданным CSRF-токеном или cookie личная
+        if response.cookies or request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+            return
+        cache.set(key, response, self.page_cache_timeout)
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.should_cache_page(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        key = self.get_page_cache_key(request)
+        response = cache.get(key)
+        if response is not None:
+            response['X-Cache'] = 'HIT'
+            return get_conditional_response(
+                request,
+                etag=response.get('ETag'),
+                last_modified=parse_http_date_safe(response.get('Last-Modified')),
+                response=response,
+            ) or response
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            if hasattr(response, 'render') and callable(response.render):
+                response.add_post_render_callback(lambda rendered: self.store_page(request, key, rendered))
+            else:
+                self.store_page(request, key, response)
+        response['X-Cache'] = 'MISS'
+        return response
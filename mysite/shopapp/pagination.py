@@ -0,0 +1,281 @@
+"""
+Keyset-пагинация (по курсору) для API магазина.
+
+Страница выбирается условием ``WHERE (поля сортировки) > (значения
+последней строки)`` вместо ``OFFSET``, а ``COUNT(*)`` не выполняется
+вовсе, поэтому стоимость страницы не зависит от её глубины.
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+from functools import reduce
+from operator import or_
+from typing import Any, List, Optional, Sequence, Tuple
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q, QuerySet
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorJSONEncoder(DjangoJSONEncoder):
+    """
+    В отличие от DjangoJSONEncoder не обрезает микросекунды,
+    иначе строки с близким временем сравнивались бы неверно.
+    """
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(payload: dict) -> str:
+    data = json.dumps(payload, cls=CursorJSONEncoder, separators=(',', ':'))
+    return urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> dict:
+    padding = '=' * (-len(cursor) % 4)
+    return json.loads(urlsafe_b64decode((cursor + padding).encode()).decode())
+
+
+class Keyset:
+    """
+    Сортировка queryset'а и условия "после"/"до" строки для неё.
+
+    Поля с NULL сортируются так: по возрастанию NULL первыми,
+    по убыванию последними, чтобы обратный проход был зеркальным.
+    """
+    def __init__(self, model, ordering: Sequence[str]):
+        self.model = model
+        self.fields: List[Tuple[str, bool]] = []
+        for name in ordering:
+            desc = name.startswith('-')
+            name = name.lstrip('-')
+            if name == 'pk':
+                name = model._meta.pk.attname
+            field = self._get_field(name)
+            if field is not None and field.is_relation:
+                if field.many_to_many or field.one_to_many:
+                    continue
+                name = field.attname
+            self.fields.append((name, desc))
+        pk_name = model._meta.pk.attname
+        if pk_name not in [name for name, _desc in self.fields]:
+            self.fields.append((pk_name, False))
+
+    def _get_field(self, name: str):
+        try:
+            return self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def _nullable(self, name: str) -> bool:
+        field = self._get_field(name)
+        return field is not None and field.null
+
+    @property
+    def ordering(self) -> List[str]:
+        return [f'-{name}' if desc else name for name, desc in self.fields]
+
+    def order_by(self, reverse: bool = False) -> list:
+        expressions = []
+        for name, desc in self.fields:
+            desc = desc != reverse
+            if self._nullable(name):
+                expressions.append(F(name).desc(nulls_last=True) if desc else F(name).asc(nulls_first=True))
+            else:
+                expressions.append(f'-{name}' if desc else name)
+        return expressions
+
+    def values(self, item: Any) -> list:
+        if isinstance(item, dict):
+            return [item[name] for name, _desc in self.fields]
+        return [getattr(item, name) for name, _desc in self.fields]
+
+    def parse_values(self, raw_values: Sequence) -> list:
+        values = []
+        for (name, _desc), value in zip(self.fields, raw_values):
+            field = self._get_field(name)
+            if value is not None and field is not None:
+                value = field.to_python(value)
+            values.append(value)
+        return values
+
+    @staticmethod
+    def _equal(name: str, value) -> Q:
+        if value is None:
+            return Q(**{f'{name}__isnull': True})
+        return Q(**{name: value})
+
+    def _beyond(self, name: str, value, desc: bool) -> Q:
+        nullable = self._nullable(name)
+        if not desc:
+            if value is None:
+                return Q(**{f'{name}__isnull': False})
+            return Q(**{f'{name}__gt': value})
+        if value is None:
+            return Q(pk__in=[])
+        condition = Q(**{f'{name}__lt': value})
+        if nullable:
+            condition |= Q(**{f'{name}__isnull': True})
+        return condition
+
+    def filter_after(self, values: Sequence, reverse: bool = False) -> Q:
+        conditions = []
+        for index, (name, desc) in enumerate(self.fields):
+            condition = Q()
+            for (prev_name, _prev_desc), prev_value in zip(self.fields[:index], values):
+                condition &= self._equal(prev_name, prev_value)
+            condition &= self._beyond(name, values[index], desc != reverse)
+            conditions.append(condition)
+        return reduce(or_, conditions)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по непрозрачному курсору с учётом ``?ordering=``.
+
+    Порядок берётся из ``OrderingFilter`` (с проверкой по ``ordering_fields``),
+    затем из уже заданного у queryset'а, затем из ``Meta.ordering``.
+    В конец всегда добавляется pk, чтобы порядок был строгим.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    cursor_query_description = _('The pagination cursor value.')
+    page_size_query_description = _('Number of results to return per page.')
+    invalid_cursor_message = _('Invalid cursor')
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request, queryset: QuerySet, view) -> List[str]:
+        ordering = OrderingFilter().get_ordering(request, queryset, view)
+        if not ordering:
+            ordering = [
+                field for field in queryset.query.order_by
+                if isinstance(field, str)
+            ] or list(queryset.model._meta.ordering)
+        return list(ordering)
+
+    def get_keyset(self, request, queryset: QuerySet, view) -> Keyset:
+        return Keyset(queryset.model, self.get_ordering(request, queryset, view))
+
+    def get_page_queryset(self, queryset: QuerySet, request, view=None) -> QuerySet:
+        """
+        Запрос страницы (на одну строку больше, чтобы узнать, есть ли ещё).
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.keyset = self.get_keyset(request, queryset, view)
+
+        cursor = self.decode_request_cursor(request)
+        self.reverse = bool(cursor and cursor['r'])
+        self.has_cursor = cursor is not None
+        queryset = queryset.order_by(*self.keyset.order_by(self.reverse))
+        if cursor:
+            queryset = queryset.filter(self.keyset.filter_after(cursor['v'], self.reverse))
+        return queryset[:self.page_size + 1]
+
+    def paginate_queryset(self, queryset: QuerySet, request, view=None) -> Optional[list]:
+        return self.finish_page(list(self.get_page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset: QuerySet, request, view=None) -> Optional[list]:
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        return self.finish_page([item async for item in page_queryset])
+
+    def finish_page(self, results: list) -> list:
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.has_cursor
+
+        self.first_values = self.keyset.values(results[0]) if results else None
+        self.last_values = self.keyset.values(results[-1]) if results else None
+        return results
+
+    def decode_request_cursor(self, request) -> Optional[dict]:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = decode_cursor(encoded)
+            if cursor['o'] != self.keyset.ordering or len(cursor['v']) != len(self.keyset.fields):
+                raise ValueError
+            cursor['v'] = self.keyset.parse_values(cursor['v'])
+            cursor['r'] = bool(cursor.get('r'))
+        except (TypeError, KeyError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def build_link(self, values: list, reverse: bool) -> str:
+        url = self.request.build_absolute_uri()
+        cursor = encode_cursor({'o': self.keyset.ordering, 'v': values, 'r': int(reverse)})
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.has_next or self.last_values is None:
+            return None
+        return self.build_link(self.last_values, reverse=False)
+
+    def get_previous_link(self) -> Optional[str]:
+        if not self.has_previous or self.first_values is None:
+            return None
+        return self.build_link(self.first_values, reverse=True)
+
+    def get_paginated_data(self, data) -> OrderedDict:
+        return OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+
+    def get_paginated_response(self, data) -> Response:
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema: dict) -> dict:
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view) -> list:
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': str(self.cursor_query_description),
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': str(self.page_size_query_description),
+                'schema': {'type': 'integer'},
+            },
+        ]
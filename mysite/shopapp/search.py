@@ -0,0 +1,137 @@
+"""
+Полнотекстовый поиск по товарам.
+
+На SQLite рядом с ``shopapp_product`` живёт FTS5-таблица с внешним
+содержимым, которую синхронизируют триггеры (в том числе при
+``QuerySet.update()``). На других СУБД, а также если индекса нет,
+фильтр откатывается к обычному ``SearchFilter``.
+"""
+
+from typing import Iterable, List
+
+from django.db import connections
+from django.db.models import QuerySet
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+from .models import Product
+
+SEARCH_INDEX_MODELS = {
+    Product: ('name', 'description'),
+}
+
+
+def index_table(model) -> str:
+    return f'{model._meta.db_table}_fts'
+
+
+def _trigger_sql(model, columns: Iterable[str]) -> List[str]:
+    table = model._meta.db_table
+    fts = index_table(model)
+    pk = model._meta.pk.column
+    columns = list(columns)
+    names = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+    delete_old = (
+        f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES('delete', old.{pk}, {old_values});"
+    )
+    insert_new = f'INSERT INTO {fts}(rowid, {names}) VALUES (new.{pk}, {new_values});'
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN {insert_new} END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN {delete_old} END',
+        f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {names} ON {table} '
+        f'BEGIN {delete_old} {insert_new} END',
+    ]
+
+
+def create_search_index(connection) -> None:
+    """
+    Создаёт FTS5-таблицы и триггеры и заполняет их (только SQLite).
+
+    Безопасно вызывать повторно: миграции, пересоздающие таблицу
+    товаров на SQLite, теряют триггеры и вызывают эту функцию снова.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for model, columns in SEARCH_INDEX_MODELS.items():
+            fts = index_table(model)
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5('
+                f"{', '.join(columns)}, "
+                f"content='{model._meta.db_table}', content_rowid='{model._meta.pk.column}', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+            for sql in _trigger_sql(model, columns):
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES('rebuild')")
+    _available.clear()
+
+
+def drop_search_index(connection) -> None:
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for model in SEARCH_INDEX_MODELS:
+            fts = index_table(model)
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {fts}_{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {fts}')
+    _available.clear()
+
+
+_available = {}
+
+
+def search_index_available(connection, model) -> bool:
+    if connection.vendor != 'sqlite' or model not in SEARCH_INDEX_MODELS:
+        return False
+    key = (connection.alias, connection.settings_dict['NAME'], model)
+    if key not in _available:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                [index_table(model)],
+            )
+            _available[key] = cursor.fetchone() is not None
+    return _available[key]
+
+
+def build_match_query(terms: Iterable[str]) -> str:
+    # каждое слово в кавычках, чтобы пользовательский ввод не ломал синтаксис FTS5,
+    # и со звёздочкой для поиска по префиксу
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    ``?search=`` через FTS5 с сортировкой по релевантности (bm25).
+
+    Явный ``?ordering=`` применяется после и имеет приоритет.
+    """
+    rank_field = 'search_rank'
+
+    def filter_queryset(self, request, queryset: QuerySet, view) -> QuerySet:
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        model = queryset.model
+        connection = connections[queryset.db]
+        if not search_index_available(connection, model):
+            return super().filter_queryset(request, queryset, view)
+
+        fts = index_table(model)
+        match = build_match_query(terms)
+        pk_column = f'{model._meta.db_table}.{model._meta.pk.column}'
+        return (
+            queryset
+            .filter(pk__in=RawSQL(f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', (match,)))
+            .annotate(**{
+                self.rank_field: RawSQL(
+                    f'SELECT bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND {fts}.rowid = {pk_column}',
+                    (match,),
+                ),
+            })
+            .order_by(self.rank_field, 'pk')
+        )
@@ -1,9 +1,47 @@
+from django.core.files.storage import default_storage
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
 from .models import Product, Order
+from .sparse import SparseFieldsetSerializerMixin
+from .thumbnails import build_srcset
 
 
-class ProductSerializer(serializers.ModelSerializer):
+@extend_schema_field({
+    'type': 'object',
+    'nullable': True,
+    'additionalProperties': {'type': 'string'},
+    'example': {'webp': 'https://example.com/media/thumbnails/a/160w.webp 160w'},
+})
+class ImageSrcsetField(serializers.Field):
+    """
+    ``srcset`` копий картинки по форматам (см. ``thumbnails``),
+    ``None``, пока копии не готовы.
+
+    Источник - поле с уже готовыми копиями (``Product.preview_variants``):
+    так ``fastpath`` берёт их из той же строки ``values()``, без запроса
+    к кэшу на каждый товар.
+    """
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        if not variants:
+            return None
+        request = self.context.get('request')
+
+        def build_url(name: str) -> str:
+            url = default_storage.url(name)
+            # как у ImageField: абсолютный URL, если есть запрос
+            return request.build_absolute_uri(url) if request is not None else url
+
+        return {fmt: build_srcset(items, build_url) for fmt, items in variants.items()}
+
+
+class ProductSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    preview_srcset = ImageSrcsetField(source='preview_variants')
+
     class Meta:
         model = Product
         fields = (
@@ -15,11 +53,12 @@ class ProductSerializer(serializers.ModelSerializer):
             'created_at',
             'archived',
             'preview',
+            'preview_srcset',
             'created_by',
         )
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = (
@@ -0,0 +1,80 @@
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Product, Order, ProductImage
+from .thumbnails import schedule_thumbnails
+from .versions import bump_version, PRODUCTS, ORDERS
+
+# модель -> (поле с картинкой, атрибут с pk товара)
+THUMBNAIL_FIELDS = {
+    Product: ('preview', 'pk'),
+    ProductImage: ('image', 'product_id'),
+}
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance: Product, **kwargs):
+    bump_version(PRODUCTS)
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleting(sender, instance: Product, **kwargs):
+    # связи с заказами удалятся каскадом, без m2m_changed
+    instance.orders.update()
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance: Product, **kwargs):
+    # вместе с товаром удаляются и его связи с заказами
+    bump_version(PRODUCTS, ORDERS)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance: ProductImage, **kwargs):
+    # картинки показываются на странице товара и в кэше страниц каталога
+    Product.objects.filter(pk=instance.product_id).update()
+    bump_version(PRODUCTS)
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=ProductImage)
+def image_uploading(sender, instance, **kwargs):
+    field, _ = THUMBNAIL_FIELDS[sender]
+    file = getattr(instance, field)
+    # загруженный файл ещё не записан в хранилище
+    instance._image_uploaded = bool(file) and not file._committed
+    if sender is Product and (instance._image_uploaded or not file):
+        # копии прежней картинки новой не подходят
+        instance.preview_variants = {}
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def image_uploaded(sender, instance, **kwargs):
+    if not getattr(instance, '_image_uploaded', False):
+        return
+    field, product_pk = THUMBNAIL_FIELDS[sender]
+    file = getattr(instance, field)
+    schedule_thumbnails(file.name, getattr(instance, product_pk), file.storage)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_changed(sender, instance: Order, **kwargs):
+    bump_version(ORDERS)
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_changed(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # после clear() со стороны товара уже не узнать, какие заказы он покинул
+        instance.orders.update()
+    if not action.startswith('post_'):
+        return
+    # update() без аргументов только сдвигает updated_at
+    if not reverse:
+        Order.objects.filter(pk=instance.pk).update()
+    elif pk_set:
+        Order.objects.filter(pk__in=pk_set).update()
+    bump_version(ORDERS)
@@ -0,0 +1,234 @@
+"""
+Фоновые выгрузки: сжатые снимки таблиц на диске.
+
+Снимок пересобирается, только если версия таблицы (см. ``versions``)
+изменилась с прошлого запуска. Клиенты получают последний готовый файл
+или 304, а устаревший снимок пересобирается в фоне
+(``SHOPAPP_EXPORT_REBUILD_WORKERS``, 0 - прямо в запросе). Пересборку
+одного вида держит блокировка в кэше, так что параллельные запросы
+не запускают её повторно.
+"""
+
+import gzip
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.db import connections
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from .exports import iter_json_array, iter_products_rows, iter_orders_rows
+from .models import ExportJob
+from .versions import get_version, PRODUCTS, ORDERS
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SOURCES = {
+    ExportJob.KIND_PRODUCTS: (PRODUCTS, iter_products_rows),
+    ExportJob.KIND_ORDERS: (ORDERS, iter_orders_rows),
+}
+
+KEEP_SNAPSHOTS = getattr(settings, 'SHOPAPP_EXPORT_KEEP_SNAPSHOTS', 3)
+
+# с запасом на самую долгую выгрузку: блокировку упавшего процесса снимет срок
+REBUILD_LOCK_TIMEOUT = 10 * 60
+
+SNAPSHOT_BLOCK_SIZE = 64 * 1024
+
+_rebuild_pool: Optional[ThreadPoolExecutor] = None
+_rebuild_pool_lock = threading.Lock()
+
+
+def latest_snapshot(kind: str, version: Optional[int] = None) -> Optional[ExportJob]:
+    jobs = ExportJob.objects.filter(kind=kind, status=ExportJob.STATUS_DONE)
+    if version is not None:
+        jobs = jobs.filter(source_version=version)
+    return jobs.order_by('-created_at', '-pk').first()
+
+
+def run_export_job(kind: str, force: bool = False) -> ExportJob:
+    """
+    Пишет свежий снимок ``kind``, если данные изменились с прошлого раза.
+    """
+    table, iter_rows = SNAPSHOT_SOURCES[kind]
+    version = get_version(table, use_cache=False)
+    if not force:
+        job = latest_snapshot(kind, version)
+        if job is not None:
+            return job
+
+    job = ExportJob.objects.create(
+        kind=kind,
+        status=ExportJob.STATUS_RUNNING,
+        source_version=version,
+    )
+    row_count = 0
+
+    def counted_rows():
+        nonlocal row_count
+        for row in iter_rows():
+            row_count += 1
+            yield row
+
+    try:
+        with tempfile.TemporaryFile() as tmp:
+            with gzip.GzipFile(fileobj=tmp, mode='wb') as gz:
+                for chunk in iter_json_array(kind, counted_rows()):
+                    gz.write(chunk.encode())
+            tmp.seek(0)
+            job.file.save(f'{kind}-v{version}.json.gz', File(tmp), save=False)
+    except Exception as exc:
+        job.status = ExportJob.STATUS_FAILED
+        job.error = repr(exc)
+        job.finished_at = timezone.now()
+        job.save()
+        raise
+
+    job.status = ExportJob.STATUS_DONE
+    job.row_count = row_count
+    job.finished_at = timezone.now()
+    job.save()
+    prune_snapshots(kind)
+    return job
+
+
+def prune_snapshots(kind: str, keep: int = KEEP_SNAPSHOTS) -> None:
+    # незаконченный снимок ещё пишется
+    stale_jobs = (
+        ExportJob.objects
+        .filter(kind=kind)
+        .exclude(status=ExportJob.STATUS_RUNNING)
+        .order_by('-created_at', '-pk')[keep:]
+    )
+    for job in stale_jobs:
+        if job.file:
+            job.file.delete(save=False)
+        job.delete()
+
+
+def _rebuild_lock_key(kind: str) -> str:
+    return f'shopapp:snapshot-rebuild:{kind}'
+
+
+def _lock_rebuild(kind: str) -> bool:
+    return cache.add(_rebuild_lock_key(kind), 1, REBUILD_LOCK_TIMEOUT)
+
+
+def _rebuild(kind: str) -> ExportJob:
+    try:
+        return run_export_job(kind)
+    finally:
+        cache.delete(_rebuild_lock_key(kind))
+
+
+def _rebuild_in_background(kind: str) -> None:
+    try:
+        _rebuild(kind)
+    except Exception:
+        logger.exception('Failed to rebuild %s snapshot', kind)
+    finally:
+        connections.close_all()
+
+
+def get_rebuild_workers() -> int:
+    return getattr(settings, 'SHOPAPP_EXPORT_REBUILD_WORKERS', 1)
+
+
+def get_rebuild_pool() -> ThreadPoolExecutor:
+    global _rebuild_pool
+    with _rebuild_pool_lock:
+        if _rebuild_pool is None:
+            _rebuild_pool = ThreadPoolExecutor(max_workers=get_rebuild_workers(), thread_name_prefix='snapshots')
+        return _rebuild_pool
+
+
+def schedule_rebuild(kind: str) -> Optional[ExportJob]:
+    """
+    Ставит пересборку ``kind`` в очередь, если её ещё никто не начал.
+
+    Без фоновых потоков пересобирает сразу и возвращает новый снимок.
+    """
+    if not _lock_rebuild(kind):
+        return None
+    if not get_rebuild_workers():
+        return _rebuild(kind)
+    get_rebuild_pool().submit(_rebuild_in_background, kind)
+    return None
+
+
+def accepts_gzip(request: HttpRequest) -> bool:
+    """
+    Разрешён ли gzip по ``Accept-Encoding``: ``gzip;q=0`` его запрещает.
+    """
+    weights = {}
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.lower()] = weight
+    return weights.get('gzip', weights.get('x-gzip', weights.get('*', 0.0))) > 0
+
+
+def _iter_snapshot(job: ExportJob, decompress: bool) -> Iterator[bytes]:
+    with job.file.open('rb') as snapshot:
+        content = gzip.GzipFile(fileobj=snapshot, mode='rb') if decompress else snapshot
+        while True:
+            block = content.read(SNAPSHOT_BLOCK_SIZE)
+            if not block:
+                return
+            yield block
+
+
+def snapshot_response(request: HttpRequest, kind: str) -> HttpResponse:
+    """
+    Ответ с последним готовым снимком ``kind``: 304 по ``ETag``/``Last-Modified``
+    или файл с диска. Если данные изменились, снимок пересобирается в фоне,
+    а до тех пор отдаётся прежний.
+    """
+    table, _ = SNAPSHOT_SOURCES[kind]
+    version = get_version(table)
+    job = latest_snapshot(kind)
+    if job is None:
+        # отдать нечего: первый снимок собирается прямо в запросе
+        if not _lock_rebuild(kind):
+            response = HttpResponse(status=503)
+            response['Retry-After'] = 5
+            return response
+        job = _rebuild(kind)
+    elif job.source_version != version:
+        job = schedule_rebuild(kind) or job
+
+    gzip_accepted = accepts_gzip(request)
+    # у сжатого и несжатого ответа разные байты, значит и разные ETag
+    etag = f'"{kind}-v{job.source_version}-gzip"' if gzip_accepted else f'"{kind}-v{job.source_version}"'
+    last_modified = int((job.finished_at or job.created_at).timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = StreamingHttpResponse(
+            _iter_snapshot(job, decompress=not gzip_accepted),
+            content_type='application/json',
+        )
+        if gzip_accepted:
+            response['Content-Encoding'] = 'gzip'
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
@@ -0,0 +1,90 @@
+"""
+Разреженные наборы полей: ``?fields=pk,name,price`` и ``?exclude=description``.
+
+Сериализатор отдаёт только выбранные поля, а вьюсет откладывает
+(``defer``) ненужные колонки, чтобы они вообще не читались из базы.
+"""
+
+from typing import List, Optional, Sequence, Set
+
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework.filters import OrderingFilter
+
+FIELDS_PARAM = 'fields'
+EXCLUDE_PARAM = 'exclude'
+
+SPARSE_FIELDS_PARAMETERS = [
+    OpenApiParameter(
+        FIELDS_PARAM,
+        OpenApiTypes.STR,
+        description='Comma-separated list of fields to return, e.g. `pk,name,price`',
+    ),
+    OpenApiParameter(
+        EXCLUDE_PARAM,
+        OpenApiTypes.STR,
+        description='Comma-separated list of fields to omit, e.g. `description`',
+    ),
+]
+
+
+def _split(value: Optional[str]) -> List[str]:
+    if not value:
+        return []
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def get_sparse_fields(request, field_names: Sequence[str]) -> List[str]:
+    """
+    Поля из ``field_names``, оставшиеся после ``?fields=`` и ``?exclude=``.
+
+    Запись (не GET) всегда работает со всеми полями.
+    """
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return list(field_names)
+    query_params = getattr(request, 'query_params', request.GET)
+    only = set(_split(query_params.get(FIELDS_PARAM)))
+    exclude = set(_split(query_params.get(EXCLUDE_PARAM)))
+    return [
+        name for name in field_names
+        if (not only or name in only) and name not in exclude
+    ]
+
+
+class SparseFieldsetSerializerMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        kept = set(get_sparse_fields(self.context.get('request'), list(self.fields)))
+        for name in list(self.fields):
+            if name not in kept:
+                self.fields.pop(name)
+
+
+class SparseFieldsetViewMixin:
+    """
+    Откладывает колонки модели, которые не попадут в ответ.
+
+    Колонки сортировки не откладываются: по ним строится курсор страницы.
+    """
+    def get_deferred_fields(self) -> Set[str]:
+        request = self.request
+        field_names = list(self.get_serializer_class().Meta.fields)
+        dropped = set(field_names) - set(get_sparse_fields(request, field_names))
+        if not dropped:
+            return set()
+
+        model = self.get_serializer_class().Meta.model
+        ordering = OrderingFilter().get_ordering(request, model.objects.none(), self) or []
+        keep = {name.lstrip('-') for name in list(ordering) + list(model._meta.ordering)}
+        concrete = {
+            field.name for field in model._meta.concrete_fields
+            if not field.primary_key
+        }
+        return {name for name in dropped if name in concrete and name not in keep}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        deferred = self.get_deferred_fields()
+        if deferred:
+            queryset = queryset.defer(*deferred)
+        return queryset
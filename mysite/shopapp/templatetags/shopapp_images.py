@@ -0,0 +1,39 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.db.models.fields.files import FieldFile
+
+from shopapp.thumbnails import MIME_TYPES, build_srcset, get_variants
+
+register = template.Library()
+
+# формат для <img>, остальные идут в <source>
+FALLBACK_FORMAT = 'jpeg'
+
+
+@register.filter
+def srcset(image: FieldFile, fmt: str = FALLBACK_FORMAT) -> str:
+    """
+    ``srcset`` из готовых копий картинки или пустая строка, пока их нет.
+    """
+    return build_srcset(get_variants(image.name).get(fmt, []))
+
+
+@register.inclusion_tag('shopapp/includes/responsive-image.html')
+def responsive_image(image: FieldFile, sizes: str = '100vw', alt: str = '') -> dict:
+    """
+    ``<picture>`` с WebP/JPEG копиями; без копий - исходная картинка.
+    """
+    variants = get_variants(image.name)
+    fallback = variants.get(FALLBACK_FORMAT, [])
+    return {
+        # самая широкая копия для браузеров без srcset
+        'src': default_storage.url(fallback[-1][1]) if fallback else image.url,
+        'srcset': build_srcset(fallback),
+        'sources': [
+            (MIME_TYPES[fmt], build_srcset(items))
+            for fmt, items in variants.items()
+            if fmt != FALLBACK_FORMAT
+        ],
+        'sizes': sizes,
+        'alt': alt or image.name,
+    }
@@ -1,13 +1,43 @@
+import csv
+import hashlib
+import io
+import json
+import tempfile
 from string import ascii_letters
 from random import choices
 
+from asgiref.sync import sync_to_async
+
+from django.contrib import admin
 from django.contrib.auth.models import User, Permission
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone, translation
+from PIL import Image
+from rest_framework.permissions import BasePermission
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
 
 from mysite import settings
-from shopapp.models import Product, Order
+from mysite.storage import ContentAddressedStorage, atomic_refs
+from shopapp.admin import OrderAdmin
+from shopapp.caching import get_api_cache_stats
+from shopapp.exports import iter_orders_rows
+from shopapp.fastpath import FastRowSerializer
+from shopapp.models import Product, Order, ExportJob, ProductImage
+from shopapp.serializers import ProductSerializer, OrderSerializer
+from shopapp.snapshots import prune_snapshots
+from shopapp.thumbnails import get_variants, manifest_name
 from shopapp.utils import add_two_numbers
+from shopapp.views import OrderViewSet, ProductsListView
 
 
 class AddTwoNumbersTestCase(TestCase):
@@ -106,6 +136,140 @@ class ProductsListViewTestCase(TestCase):
         self.assertTemplateUsed(response, 'shopapp/products-list.html')
 
 
+class ProductsListPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='catalog')
+        Product.objects.bulk_create([
+            Product(name=f'Product {index:02}', price=index, created_by=cls.user)
+            for index in range(45)
+        ])
+
+    def setUp(self) -> None:
+        translation.activate('en')
+        cache.clear()
+
+    def test_pages_follow_keyset_cursor(self):
+        response = self.client.get(reverse('shopapp:products_list'))
+        names = [product.name for product in response.context['products']]
+        self.assertEqual(len(names), ProductsListView.paginate_by)
+        self.assertContains(response, 'There are 45 products.')
+        while response.context['paginator'].has_next:
+            response = self.client.get(response.context['paginator'].get_next_link())
+            names += [product.name for product in response.context['products']]
+        self.assertEqual(names, [f'Product {index:02}' for index in range(45)])
+
+    def test_page_with_cached_cards_takes_five_queries(self):
+        # вошедшим страница собирается заново, без кэша страниц
+        self.client.force_login(self.user)
+        url = reverse('shopapp:products_list')
+        self.client.get(url)
+        # версия и число товаров в кэше, карточки тоже: остаются сессия,
+        # пользователь, два запроса прав и выборка страницы
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertContains(response, 'Created by: catalog', count=ProductsListView.paginate_by)
+
+    def test_card_cache_follows_product_version(self):
+        url = reverse('shopapp:products_list')
+        self.client.get(url)
+        product = Product.objects.get(name='Product 00')
+        product.name = 'Product 00 renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertContains(self.client.get(url), 'Product 00 renamed')
+
+    def test_card_cache_is_per_product(self):
+        # вошедшим страница собирается заново, из кэша берутся только карточки
+        self.client.force_login(self.user)
+        url = reverse('shopapp:products_list')
+        self.client.get(url)
+        other = Product.objects.get(name='Product 01')
+        # updated_at прежний, значит карточка из кэша ещё старая
+        Product.objects.filter(pk=other.pk).update(name='Product 01 stale', updated_at=other.updated_at)
+        product = Product.objects.get(name='Product 00')
+        product.name = 'Product 00 renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'Product 00 renamed')
+        self.assertContains(response, 'Product 01</a>')
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('shopapp:products_list'), {'cursor': 'broken'})
+        self.assertEqual(response.status_code, 404)
+
+
+class AnonymousPageCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='anonymous-cache')
+        cls.product = Product.objects.create(name='Cached page', price=10, created_by=cls.user)
+
+    def setUp(self) -> None:
+        translation.activate('en')
+        cache.clear()
+
+    def assertCachedWithoutQueries(self, url):
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        return response
+
+    def test_catalog_pages(self):
+        for url in (
+            reverse('shopapp:products_list'),
+            reverse('shopapp:product_details', kwargs={'pk': self.product.pk}),
+        ):
+            with self.subTest(url=url):
+                self.assertCachedWithoutQueries(url)
+
+    def test_clock_is_not_cached(self):
+        # время и день недели выводит браузер, в кэше их нет
+        response = self.assertCachedWithoutQueries(reverse('shopapp:products_list'))
+        self.assertNotContains(response, timezone.now().strftime('%A'))
+        self.assertContains(response, 'data-clock="time"')
+        self.assertContains(response, 'data-clock="weekday"')
+
+    def test_index_is_rendered_per_request(self):
+        # на главной нет данных из базы, зато есть время работы процесса
+        response = self.client.get(reverse('shopapp:index'))
+        self.assertFalse(response.has_header('X-Cache'))
+        self.assertNotEqual(self.client.get(reverse('shopapp:index')).content, response.content)
+
+    def test_key_includes_language_and_query(self):
+        url = reverse('shopapp:products_list')
+        self.assertCachedWithoutQueries(url)
+        self.assertEqual(self.client.get(url, {'ordering': 'price'})['X-Cache'], 'MISS')
+        with translation.override('ru'):
+            response = self.client.get(reverse('shopapp:products_list'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_not_modified_from_cache(self):
+        url = reverse('shopapp:product_details', kwargs={'pk': self.product.pk})
+        response = self.assertCachedWithoutQueries(url)
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_authenticated_user_bypasses_cache(self):
+        self.client.force_login(self.user)
+        url = reverse('shopapp:products_list')
+        self.client.get(url)
+        self.assertFalse(self.client.get(url).has_header('X-Cache'))
+
+    def test_product_image_write_invalidates(self):
+        url = reverse('shopapp:product_details', kwargs={'pk': self.product.pk})
+        self.assertCachedWithoutQueries(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.product, image='products/cached.png')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'products/cached.png')
+
+
 class OrdersListViewTestCase(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -224,9 +388,19 @@ class ProductsExportViewTestCase(TestCase):
             }
             for product in products
         ]
-        product_data = response.json()
+        product_data = json.loads(b''.join(response.streaming_content))
         self.assertEqual(product_data['products'], expected_data)
 
+    def test_get_products_view_ndjson(self):
+        response = self.client.get(reverse('shopapp:products-export'), {'format': 'ndjson'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)['pk'] for line in lines],
+            list(Product.objects.order_by('pk').values_list('pk', flat=True)),
+        )
+
 
 class OrdersExportViewTestCase(TestCase):
     fixtures = [
@@ -267,5 +441,926 @@ class OrdersExportViewTestCase(TestCase):
             }
             for order in orders
         ]
-        order_data = response.json()
+        order_data = json.loads(b''.join(response.streaming_content))
         self.assertEqual(order_data['orders'], expected_data)
+
+    def test_orders_rows_query_count(self):
+        orders_count = Order.objects.count()
+        # два запроса на каждую полную пачку и один завершающий пустой
+        with self.assertNumQueries(2 * orders_count + 1):
+            rows = list(iter_orders_rows(batch_size=1))
+        self.assertEqual(len(rows), orders_count)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), SHOPAPP_EXPORT_REBUILD_WORKERS=0)
+class ProductsSnapshotViewTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+        'products-fixture.json',
+        'auth-group-fixture.json',
+        'auth-permission-fixture',
+    ]
+
+    def setUp(self) -> None:
+        cache.clear()
+        translation.activate('en')
+
+    def test_snapshot_and_not_modified(self):
+        response = self.client.get(reverse('shopapp:products-export-snapshot'))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(data['products']), Product.objects.count())
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+        response = self.client.get(
+            reverse('shopapp:products-export-snapshot'),
+            HTTP_IF_NONE_MATCH=response['ETag'],
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+    def test_snapshot_rebuilt_after_change(self):
+        response = self.client.get(reverse('shopapp:products-export-snapshot'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        etag = response['ETag']
+        b''.join(response.streaming_content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=1).first().save()
+
+        response = self.client.get(reverse('shopapp:products-export-snapshot'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        b''.join(response.streaming_content)
+        self.assertEqual(ExportJob.objects.filter(status=ExportJob.STATUS_DONE).count(), 2)
+
+    def test_stale_snapshot_served_while_rebuilding(self):
+        response = self.client.get(reverse('shopapp:products-export-snapshot'))
+        etag = response['ETag']
+        b''.join(response.streaming_content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=1).first().save()
+        # пересборку уже начал другой запрос
+        cache.add(f'shopapp:snapshot-rebuild:{ExportJob.KIND_PRODUCTS}', 1)
+
+        response = self.client.get(reverse('shopapp:products-export-snapshot'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+    def test_gzip_refused_with_zero_quality(self):
+        response = self.client.get(reverse('shopapp:products-export-snapshot'), HTTP_ACCEPT_ENCODING='gzip')
+        gzip_etag = response['ETag']
+        b''.join(response.streaming_content)
+
+        response = self.client.get(
+            reverse('shopapp:products-export-snapshot'),
+            HTTP_ACCEPT_ENCODING='gzip;q=0, identity',
+            HTTP_IF_NONE_MATCH=gzip_etag,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertNotEqual(response['ETag'], gzip_etag)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(data['products']), Product.objects.count())
+
+    def test_prune_keeps_running_jobs(self):
+        running = ExportJob.objects.create(kind=ExportJob.KIND_PRODUCTS, status=ExportJob.STATUS_RUNNING)
+        done = ExportJob.objects.create(kind=ExportJob.KIND_PRODUCTS, status=ExportJob.STATUS_DONE)
+        prune_snapshots(ExportJob.KIND_PRODUCTS, keep=0)
+        self.assertTrue(ExportJob.objects.filter(pk=running.pk).exists())
+        self.assertFalse(ExportJob.objects.filter(pk=done.pk).exists())
+
+
+class OrderAdminExportCSVTestCase(TestCase):
+    fixtures = [
+        'users-fixture.json',
+        'products-fixture.json',
+        'orders-fixture.json',
+        'auth-group-fixture.json',
+        'auth-permission-fixture',
+        'auth-user-fixture',
+    ]
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_superuser(username='admin-export', password='admin-export')
+        self.client.force_login(self.user)
+
+    def test_export_csv(self):
+        orders = Order.objects.order_by('pk')
+        with self.assertNumQueries(2):
+            rows = list(OrderAdmin(Order, admin.site).iter_csv(orders))
+        self.assertEqual(len(rows), 2)
+
+        response = self.client.post(
+            reverse('admin:shopapp_order_changelist'),
+            {
+                'action': 'export_csv',
+                '_selected_action': [order.pk for order in orders],
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode()
+        header, *lines = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(header[-2:], ['receipt', 'products'])
+        self.assertEqual(len(lines), orders.count())
+        for line, order in zip(lines, orders):
+            self.assertEqual(line[0], str(order.pk))
+            self.assertEqual(line[4], order.user.username)
+            self.assertEqual(
+                sorted(map(int, filter(None, line[-1].split(',')))),
+                sorted(order.products.values_list('pk', flat=True)),
+            )
+
+
+class ProductViewSetKeysetPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='keyset', password='keyset')
+        Product.objects.bulk_create([
+            Product(name=f'product {index % 5}', price=index % 3, discount=index, created_by=cls.user)
+            for index in range(23)
+        ])
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def walk(self, params: dict) -> list:
+        pks = []
+        url = reverse('shopapp:product-list')
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+            data = response.json()
+            pks.extend(product['pk'] for product in data['results'])
+            url, params = data['next'], {}
+        return pks
+
+    def test_pages_follow_ordering(self):
+        for ordering in ('-price', 'name,-discount', 'created_at'):
+            expected = list(
+                Product.objects.order_by(*ordering.split(','), 'pk').values_list('pk', flat=True)
+            )
+            self.assertEqual(self.walk({'ordering': ordering, 'page_size': 4}), expected)
+
+    def test_previous_link(self):
+        response = self.client.get(reverse('shopapp:product-list'), {'page_size': 5})
+        first_page = response.json()
+        self.assertIsNone(first_page['previous'])
+        second_page = self.client.get(first_page['next']).json()
+        previous_page = self.client.get(second_page['previous']).json()
+        self.assertEqual(previous_page['results'], first_page['results'])
+        self.assertIsNone(previous_page['previous'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('shopapp:product-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductFullTextSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='search', password='search')
+        cls.laptop = Product.objects.create(
+            name='Laptop', description='A light laptop, the best laptop for travel', created_by=cls.user,
+        )
+        cls.bag = Product.objects.create(
+            name='Bag', description='Fits any laptop', created_by=cls.user,
+        )
+        cls.phone = Product.objects.create(name='Phone', description='Pocket size or', created_by=cls.user)
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def search(self, query: str) -> list:
+        response = self.client.get(reverse('shopapp:product-list'), {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [product['pk'] for product in response.json()['results']]
+
+    def test_results_ranked_by_relevance(self):
+        self.assertEqual(self.search('laptop'), [self.laptop.pk, self.bag.pk])
+
+    def test_prefix_and_quotes(self):
+        self.assertEqual(self.search('lapt'), [self.laptop.pk, self.bag.pk])
+        self.assertEqual(self.search('"pocket OR'), [self.phone.pk])
+
+    def test_index_follows_queryset_update(self):
+        Product.objects.filter(pk=self.bag.pk).update(name='Backpack', description='Waterproof')
+        self.assertEqual(self.search('laptop'), [self.laptop.pk])
+        self.assertEqual(self.search('waterproof'), [self.bag.pk])
+
+
+class ProductViewSetResponseCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(username='cache', password='cache')
+        cls.product = Product.objects.create(name='Cached', price=10, created_by=cls.user)
+
+    def setUp(self) -> None:
+        cache.clear()
+        # LANGUAGE_CODE='en-us' нет в LANGUAGES, префикс i18n_patterns должен быть /en/
+        translation.activate('en')
+
+    def test_list_is_cached_until_product_changes(self):
+        url = reverse('shopapp:product-list')
+        self.assertEqual(self.client.get(url, {'ordering': 'price', 'page_size': 5})['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'page_size': 5, 'ordering': 'price'})
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Renamed'
+            self.product.save()
+        response = self.client.get(url, {'ordering': 'price', 'page_size': 5})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['results'][0]['name'], 'Renamed')
+        self.assertEqual(get_api_cache_stats(), {'hits': 1, 'misses': 2, 'hit_ratio': 0.3333})
+
+    def test_retrieve_invalidated_by_admin_action(self):
+        url = reverse('shopapp:product-detail', kwargs={'pk': self.product.pk})
+        self.assertFalse(self.client.get(url).json()['archived'])
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('admin:shopapp_product_changelist'),
+                {'action': 'mark_archived', '_selected_action': [self.product.pk]},
+            )
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(response.json()['archived'])
+
+
+class SparseFieldsetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='sparse', password='sparse')
+        cls.product = Product.objects.create(
+            name='Sparse', description='long text ' * 100, price=10, created_by=cls.user,
+        )
+        cls.order = Order.objects.create(delivery_address='Street', promocode='SALE', user=cls.user)
+        cls.order.products.add(cls.product)
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    def test_product_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('shopapp:product-list'), {'fields': 'pk,name,price'})
+        self.assertEqual(list(response.json()['results'][0]), ['pk', 'name', 'price'])
+        product_query = next(query['sql'] for query in queries if 'FROM "shopapp_product"' in query['sql'])
+        self.assertNotIn('"description"', product_query.split('FROM')[0])
+
+    def test_product_exclude_retrieve(self):
+        response = self.client.get(
+            reverse('shopapp:product-detail', kwargs={'pk': self.product.pk}),
+            {'exclude': 'description,preview'},
+        )
+        data = response.json()
+        self.assertNotIn('description', data)
+        self.assertNotIn('preview', data)
+        self.assertEqual(data['name'], 'Sparse')
+
+    def test_order_fields(self):
+        response = self.client.get(reverse('shopapp:order-list'), {'fields': 'promocode,products'})
+        self.assertEqual(response.json()['results'], [{'promocode': 'SALE', 'products': [self.product.pk]}])
+
+
+class FastRowSerializerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='fast', password='fast')
+        cls.products = [
+            Product.objects.create(
+                name='Fast', description='text', price='1999.99', discount=5,
+                created_by=cls.user, preview='products/preview/fast.png',
+            ),
+            Product.objects.create(name='Plain', price=0, created_by=cls.user, archived=True),
+            Product.objects.create(
+                name='Quoted', price='0.5', created_by=cls.user, preview='products/preview/my photo ü.png',
+            ),
+        ]
+        cls.order = Order.objects.create(
+            delivery_address=None, promocode='CODE', user=cls.user, receipt='orders/receipts/r.pdf',
+        )
+        cls.order.products.add(*cls.products)
+        Order.objects.create(promocode='', user=cls.user)
+
+    def render_both(self, serializer_class, queryset, query: dict = None):
+        request = Request(APIRequestFactory().get('/shop/api/', query or {}))
+        context = {'request': request}
+        expected = JSONRenderer().render(serializer_class(queryset, many=True, context=context).data)
+        fast = FastRowSerializer(serializer_class, context)
+        actual = JSONRenderer().render(fast.serialize(fast.prepare(queryset, ['pk'])))
+        return expected, actual
+
+    def test_products_identical(self):
+        expected, actual = self.render_both(ProductSerializer, Product.objects.order_by('pk'))
+        self.assertEqual(actual, expected)
+
+    def test_orders_identical(self):
+        expected, actual = self.render_both(OrderSerializer, Order.objects.order_by('pk'))
+        self.assertEqual(actual, expected)
+
+    def test_sparse_fields_identical(self):
+        expected, actual = self.render_both(
+            ProductSerializer, Product.objects.order_by('pk'), {'fields': 'name,price,preview'},
+        )
+        self.assertEqual(actual, expected)
+
+    def test_retrieve_checks_object_permissions_on_instance(self):
+        class IsOrderOwner(BasePermission):
+            def has_object_permission(self, request, view, obj):
+                return obj.user == request.user
+
+        view = OrderViewSet.as_view({'get': 'retrieve'}, permission_classes=[IsOrderOwner])
+        other = User.objects.create_user(username='fast-other')
+        for user, status_code in ((self.user, 200), (other, 403)):
+            request = APIRequestFactory().get('/shop/api/orders/')
+            force_authenticate(request, user=user)
+            with self.subTest(user=user.username):
+                self.assertEqual(view(request, pk=self.order.pk).status_code, status_code)
+
+    def test_api_list_query_count(self):
+        cache.clear()
+        translation.activate('en')
+        # заказы, товары и ключи страницы для ETag
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('shopapp:order-list'))
+        self.assertEqual(response.status_code, 200)
+
+
+class BulkWriteTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='bulk', password='bulk')
+        cls.products = [
+            Product.objects.create(name=f'Bulk {index}', price=10, created_by=cls.user)
+            for index in range(3)
+        ]
+
+    def setUp(self) -> None:
+        cache.clear()
+        translation.activate('en')
+
+    def test_bulk_create_products_partial_success(self):
+        payload = [
+            {'name': 'New 1', 'price': '5.00', 'created_by': self.user.pk},
+            {'name': 'New 2', 'price': 'not a number', 'created_by': self.user.pk},
+            {'name': 'New 3', 'price': '7.50', 'created_by': self.user.pk},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('shopapp:product-bulk'), payload, content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 207)
+        data = response.json()
+        self.assertEqual(len(data['created']), 2)
+        self.assertEqual([error['index'] for error in data['errors']], [1])
+        self.assertQuerysetEqual(
+            Product.objects.filter(pk__in=data['created']).order_by('pk').values_list('name', flat=True),
+            ['New 1', 'New 3'],
+        )
+
+    def test_bulk_update_products(self):
+        payload = [{'pk': product.pk, 'price': '99.00'} for product in self.products]
+        payload.append({'pk': 0, 'price': '1.00'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                reverse('shopapp:product-bulk'), payload, content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()['errors'], [{'index': 3, 'errors': {'pk': ['Object not found.']}}])
+        updates = [query for query in queries if query['sql'].startswith('UPDATE "shopapp_product"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(set(Product.objects.values_list('price', flat=True)), {99})
+
+    def test_bulk_update_rejects_duplicate_pks(self):
+        pk = self.products[0].pk
+        payload = [{'pk': pk, 'price': '1.00'}, {'pk': pk, 'price': '2.00'}]
+        with self.assertNumQueries(0):
+            response = self.client.patch(
+                reverse('shopapp:product-bulk'), payload, content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'non_field_errors': [f'Duplicate pk values: [{pk}].']})
+        self.assertNotEqual(Product.objects.get(pk=pk).price, 2)
+
+    def test_bulk_create_orders_with_products(self):
+        payload = [
+            {'delivery_address': f'Street {index}', 'promocode': '', 'user': self.user.pk,
+             'products': [product.pk for product in self.products[:index + 1]]}
+            for index in range(2)
+        ]
+        response = self.client.post(reverse('shopapp:order-bulk'), payload, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        orders = Order.objects.filter(pk__in=response.json()['created']).order_by('pk')
+        self.assertEqual([order.products.count() for order in orders], [1, 2])
+
+    def test_bulk_archive_invalidates_cache(self):
+        url = reverse('shopapp:product-detail', kwargs={'pk': self.products[0].pk})
+        self.assertFalse(self.client.get(url).json()['archived'])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('shopapp:product-bulk-archive'),
+                {'pks': [self.products[0].pk, self.products[1].pk]},
+                content_type='application/json',
+            )
+        self.assertEqual(response.json(), {'archived': 2})
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(response.json()['archived'])
+
+
+class OrderViewSetQueryBudgetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='budget', password='budget')
+        cls.products = [
+            Product.objects.create(name=f'Budget {index}', price=index, created_by=cls.user)
+            for index in range(4)
+        ]
+
+    def setUp(self) -> None:
+        cache.clear()
+        translation.activate('en')
+
+    def create_orders(self, count: int) -> None:
+        for index in range(count):
+            order = Order.objects.create(delivery_address=f'Street {index}', user=self.user)
+            order.products.add(*self.products)
+
+    def count_list_queries(self, query: dict) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('shopapp:order-list'), query)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_list_query_count_does_not_grow(self):
+        self.create_orders(2)
+        small = self.count_list_queries({'page_size': 50})
+        self.create_orders(20)
+        self.assertEqual(self.count_list_queries({'page_size': 50}), small)
+        # плюс запрос ключей страницы для ETag
+        self.assertLessEqual(small, 3)
+
+    def test_products_filter_uses_exists(self):
+        self.create_orders(3)
+        other = Order.objects.create(user=self.user)
+        other.products.add(self.products[0])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('shopapp:order-list'),
+                {'products': [self.products[1].pk, self.products[2].pk], 'page_size': 50},
+            )
+        self.assertEqual(len(response.json()['results']), 3)
+        order_query = next(query['sql'] for query in queries if 'FROM "shopapp_order"' in query['sql'])
+        self.assertIn('EXISTS', order_query)
+        self.assertNotIn('DISTINCT', order_query)
+
+    def test_serializer_queryset_query_count(self):
+        self.create_orders(5)
+        with self.assertNumQueries(2):
+            OrderSerializer(OrderViewSet.queryset.all(), many=True).data
+
+
+class IndexAdvisorTestCase(TestCase):
+    def test_active_products_use_partial_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('plan text is SQLite-specific')
+        plan = ProductsListView.queryset.all().explain()
+        self.assertIn('shopapp_product_active', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_orders_by_user_use_composite_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('plan text is SQLite-specific')
+        plan = Order.objects.filter(user=1).order_by('created_at', 'pk').explain()
+        self.assertIn('shopapp_order_user_created', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_command_reports_summary(self):
+        out = io.StringIO()
+        call_command('index_advisor', '-v2', stdout=out)
+        self.assertIn('ProductsListView: ok', out.getvalue())
+        self.assertIn('query shapes are not covered by an index', out.getvalue())
+
+
+class AsyncViewsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='async', password='async')
+        cls.staff = User.objects.create_user(username='async-staff', password='async', is_staff=True)
+        cls.products = [
+            Product.objects.create(name=f'Async {index}', price=index, created_by=cls.user)
+            for index in range(5)
+        ]
+        cls.order = Order.objects.create(delivery_address='Street', user=cls.user)
+        cls.order.products.add(*cls.products[:2])
+
+    def setUp(self) -> None:
+        cache.clear()
+        translation.activate('en')
+
+    async def test_product_list_matches_api(self):
+        query = {'page_size': 2, 'ordering': '-price'}
+        expected = await sync_to_async(self.client.get)(reverse('shopapp:product-list'), query)
+        response = await self.async_client.get(reverse('shopapp:async-product-list'), query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], expected.json()['results'])
+        # у async свой ключ кэша: иначе ссылки пагинации вели бы в синхронный API
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('/shop/async/products/', response.json()['next'])
+        self.assertIn('/shop/api/products/', expected.json()['next'])
+
+        response = await self.async_client.get(response.json()['next'])
+        self.assertEqual([item['price'] for item in response.json()['results']], ['2.00', '1.00'])
+
+    async def test_product_detail(self):
+        pk = self.products[0].pk
+        expected = await sync_to_async(self.client.get)(reverse('shopapp:product-detail', kwargs={'pk': pk}))
+        response = await self.async_client.get(reverse('shopapp:async-product-detail', kwargs={'pk': pk}))
+        self.assertEqual(response.content, expected.content)
+
+        response = await self.async_client.get(reverse('shopapp:async-product-detail', kwargs={'pk': 0}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_product_detail_applies_filters(self):
+        url = reverse('shopapp:async-product-detail', kwargs={'pk': self.products[0].pk})
+        expected = await sync_to_async(self.client.get)(
+            reverse('shopapp:product-detail', kwargs={'pk': self.products[0].pk}), {'archived': 'true'},
+        )
+        response = await self.async_client.get(url, {'archived': 'true'})
+        self.assertEqual(expected.status_code, 404)
+        self.assertEqual(response.status_code, 404)
+
+        response = await self.async_client.get(url, {'archived': 'false'})
+        self.assertEqual(response.status_code, 200)
+
+    async def test_order_list_with_filter(self):
+        response = await self.async_client.get(
+            reverse('shopapp:async-order-list'), {'products': self.products[1].pk},
+        )
+        self.assertEqual(
+            [item['products'] for item in response.json()['results']],
+            [[self.products[0].pk, self.products[1].pk]],
+        )
+
+    async def test_invalid_cursor(self):
+        response = await self.async_client.get(reverse('shopapp:async-product-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_exports_stream(self):
+        response = await self.async_client.get(reverse('shopapp:async-products-export'))
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(json.loads(content)['products']), 5)
+
+        response = await self.async_client.get(reverse('shopapp:async-orders-export'))
+        self.assertEqual(response.status_code, 302)
+        await sync_to_async(self.async_client.force_login)(self.staff)
+        response = await self.async_client.get(reverse('shopapp:async-orders-export'), {'format': 'ndjson'})
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(rows[0]['products_id'], [self.products[0].pk, self.products[1].pk])
+
+
+class ConditionalGetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='conditional', is_staff=True)
+        cls.user.user_permissions.add(Permission.objects.get(codename='view_order'))
+        cls.products = [
+            Product.objects.create(name=f'Conditional {index}', price=10, created_by=cls.user)
+            for index in range(3)
+        ]
+        cls.order = Order.objects.create(user=cls.user)
+        cls.order.products.set(cls.products[:2])
+
+    def setUp(self) -> None:
+        cache.clear()
+        translation.activate('en')
+
+    def assertNotModified(self, url, response, queries=1):
+        with self.assertNumQueries(queries):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+    def test_api_retrieve(self):
+        url = reverse('shopapp:product-detail', kwargs={'pk': self.products[0].pk})
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        # валидаторы лежат в кэше рядом с ответом
+        self.assertNotModified(url, response, queries=0)
+        self.products[0].price = 20
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_api_list(self):
+        url = reverse('shopapp:product-list')
+        response = self.client.get(url, {'ordering': 'price'})
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertNotModified(f'{url}?ordering=price', response, queries=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[2].delete()
+        modified = self.client.get(f'{url}?ordering=price', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(modified.status_code, 200)
+        self.assertNotEqual(modified['ETag'], response['ETag'])
+
+    def test_update_based_writes_touch_updated_at(self):
+        before = Product.objects.get(pk=self.products[0].pk).updated_at
+        Product.objects.filter(pk=self.products[0].pk).update(archived=True)
+        archived = Product.objects.get(pk=self.products[0].pk).updated_at
+        self.assertGreater(archived, before)
+        self.client.patch(
+            reverse('shopapp:product-bulk'), [{'pk': self.products[0].pk, 'price': '1.00'}],
+            content_type='application/json',
+        )
+        self.assertGreater(Product.objects.get(pk=self.products[0].pk).updated_at, archived)
+
+    def test_bulk_m2m_patch_changes_etag(self):
+        url = reverse('shopapp:order-detail', kwargs={'pk': self.order.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.json()['products'], [self.products[0].pk, self.products[1].pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                reverse('shopapp:order-bulk'), [{'pk': self.order.pk, 'products': [self.products[2].pk]}],
+                content_type='application/json',
+            )
+        modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(modified.status_code, 200)
+        self.assertNotEqual(modified['ETag'], response['ETag'])
+        self.assertEqual(modified.json()['products'], [self.products[2].pk])
+
+    def test_product_details_page(self):
+        # анонимам страница отдаётся из кэша страниц, валидаторы считаются для вошедших
+        self.client.force_login(self.user)
+        url = reverse('shopapp:product_details', kwargs={'pk': self.products[0].pk})
+        response = self.client.get(url)
+        # сессия, пользователь и валидаторы
+        self.assertNotModified(url, response, queries=3)
+        ProductImage.objects.create(product=self.products[0], image='products/image.png')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_order_details_page(self):
+        self.client.force_login(self.user)
+        url = reverse('shopapp:order_details', kwargs={'pk': self.order.pk})
+        response = self.client.get(url)
+        etags = {response['ETag']}
+        # сессия, пользователь, два запроса прав и валидаторы
+        self.assertNotModified(url, response, queries=5)
+        self.order.products.add(self.products[2])
+        etags.add(self.client.get(url)['ETag'])
+        self.products[0].name = 'Renamed'
+        self.products[0].save()
+        etags.add(self.client.get(url)['ETag'])
+        self.assertEqual(len(etags), 3)
+
+    def test_orders_api_list(self):
+        self.client.force_login(self.user)
+        url = reverse('shopapp:order-list')
+        response = self.client.get(url)
+        # сессия, пользователь и ключи строк страницы
+        self.assertNotModified(url, response, queries=3)
+        self.order.products.remove(self.products[0])
+        self.assertNotEqual(self.client.get(url)['ETag'], response['ETag'])
+
+
+def make_image_file(name: str, size=(64, 48), mode='RGB') -> SimpleUploadedFile:
+    buffer = io.BytesIO()
+    Image.new(mode, size, 'red').save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    SHOPAPP_THUMBNAIL_SIZES=(16, 32, 128),
+    SHOPAPP_THUMBNAIL_WORKERS=0,
+)
+class ThumbnailsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='thumbnails')
+        cls.product = Product.objects.create(name='Thumbnails', price=10, created_by=cls.user)
+
+    def setUp(self) -> None:
+        cache.clear()
+        translation.activate('en')
+
+    def upload(self, name='photo.png', **kwargs) -> ProductImage:
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductImage.objects.create(product=self.product, image=make_image_file(name, **kwargs))
+
+    def test_upload_generates_variants_without_upscaling(self):
+        image = self.upload(mode='RGBA')
+        variants = get_variants(image.image.name)
+        # 128 шире исходной картинки, вместо неё - исходная ширина
+        self.assertEqual(
+            {fmt: [width for width, _ in items] for fmt, items in variants.items()},
+            {'webp': [16, 32, 64], 'jpeg': [16, 32, 64]},
+        )
+        for items in variants.values():
+            for width, name in items:
+                with default_storage.open(name) as file, Image.open(file) as thumbnail:
+                    self.assertEqual(thumbnail.width, width)
+        cache.clear()
+        self.assertEqual(get_variants(image.image.name), variants)
+
+    def test_page_and_api_get_srcset(self):
+        self.upload()
+        response = self.client.get(reverse('shopapp:product_details', kwargs={'pk': self.product.pk}))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, '32w.jpg 32w')
+
+        queryset = Product.objects.filter(pk=self.product.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.preview = make_image_file('preview.png')
+            self.product.save()
+        # копии берутся из строки товара, без кэша и манифеста
+        cache.clear()
+        default_storage.delete(manifest_name(self.product.preview.name))
+        request = Request(APIRequestFactory().get('/shop/api/'))
+        data = ProductSerializer(queryset, many=True, context={'request': request}).data
+        self.assertIn('http://testserver/media/thumbnails/', data[0]['preview_srcset']['webp'])
+        fast = FastRowSerializer(ProductSerializer, {'request': request})
+        self.assertEqual(
+            JSONRenderer().render(fast.serialize(fast.prepare(queryset, ['pk']))),
+            JSONRenderer().render(data),
+        )
+
+    def test_backfill_command(self):
+        # файл уже в хранилище: загрузки нет, копии не считаются
+        name = default_storage.save('products/old.png', make_image_file('old.png'))
+        image = ProductImage.objects.create(product=self.product, image=name)
+        self.assertEqual(get_variants(image.image.name), {})
+        cache.clear()
+        out = io.StringIO()
+        call_command('generate_thumbnails', workers=1, stdout=out, stderr=io.StringIO())
+        self.assertIn('Thumbnails generated for 1 images, 0 failed', out.getvalue())
+        self.assertEqual([width for width, _ in get_variants(image.image.name)['jpeg']], [16, 32, 64])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), SHOPAPP_THUMBNAIL_WORKERS=0, SHOPAPP_THUMBNAIL_SIZES=(16,))
+class ProductImagesUploadTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='uploader')
+        cls.user.user_permissions.add(*Permission.objects.filter(codename__in=['add_product', 'change_product']))
+        cls.product = Product.objects.create(name='Uploads', price=10, created_by=cls.user)
+
+    def setUp(self) -> None:
+        cache.clear()
+        translation.activate('en')
+        self.client.force_login(self.user)
+
+    def post_images(self, images):
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('shopapp:product_update', kwargs={'pk': self.product.pk}),
+                {'name': 'Uploads', 'price': 10, 'discount': 0, 'images': images},
+            )
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "shopapp_productimage"')]
+        return response, len(inserts)
+
+    def test_batch_skips_duplicates_with_one_insert(self):
+        photo = make_image_file('photo.png')
+        other = make_image_file('other.png', size=(10, 10))
+        response, inserts = self.post_images([photo, make_image_file('copy.png'), other])
+        self.assertRedirects(response, reverse('shopapp:product_details', kwargs={'pk': self.product.pk}))
+        self.assertEqual(inserts, 1)
+        photo.seek(0)
+        other.seek(0)
+        self.assertEqual(
+            sorted(self.product.images.values_list('sha256', flat=True)),
+            sorted(hashlib.sha256(file.read()).hexdigest() for file in (photo, other)),
+        )
+        self.assertTrue(all(get_variants(image.image.name) for image in self.product.images.all()))
+
+        response, inserts = self.post_images([make_image_file('again.png')])
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(inserts, 0)
+        self.assertEqual(self.product.images.count(), 2)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=0)
+    def test_temporary_files_are_hashed_while_streaming(self):
+        photo = make_image_file('large.png')
+        self.post_images([photo])
+        photo.seek(0)
+        self.assertEqual(self.product.images.get().sha256, hashlib.sha256(photo.read()).hexdigest())
+
+    def test_invalid_images_rejected(self):
+        response, inserts = self.post_images([
+            make_image_file('good.png'), SimpleUploadedFile('bad.png', b'not an image'),
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(inserts, 0)
+        self.assertIn('bad.png', str(response.context['form'].errors['images']))
+
+    def test_create_view_saves_images(self):
+        response = self.client.post(reverse('shopapp:product_create'), {
+            'name': 'Created with images', 'price': 1, 'discount': 0,
+            'images': [make_image_file('first.png'), make_image_file('second.png', size=(8, 8))],
+        })
+        self.assertRedirects(response, reverse('shopapp:products_list'))
+        self.assertEqual(Product.objects.get(name='Created with images').images.count(), 2)
+
+
+class ContentAddressedStorageTestCase(TestCase):
+    def setUp(self) -> None:
+        self.storage = ContentAddressedStorage(location=tempfile.mkdtemp())
+
+    def refs(self, name) -> int:
+        with self.storage.open(name + '.refs') as file:
+            return int(file.read())
+
+    def test_identical_files_share_one_blob(self):
+        digest = hashlib.sha256(b'same bytes').hexdigest()
+        first = self.storage.save('products/product_None/preview/a.PNG', ContentFile(b'same bytes'))
+        second = self.storage.save('users/user_1/avatar/b.png', ContentFile(b'same bytes'))
+        self.assertEqual(first, f'cas/{digest[:2]}/{digest[2:4]}/{digest}.png')
+        self.assertEqual(second, first)
+        self.assertEqual(self.refs(first), 2)
+        self.assertEqual(self.storage.listdir(f'cas/{digest[:2]}/{digest[2:4]}'), ([], [f'{digest}.png']))
+
+        self.storage.delete(first)
+        self.assertTrue(self.storage.exists(first))
+        self.assertEqual(self.refs(first), 1)
+        self.storage.delete(first)
+        self.assertFalse(self.storage.exists(first))
+        self.assertFalse(self.storage.exists(first + '.refs'))
+
+    def test_upload_hash_is_reused(self):
+        upload = SimpleUploadedFile('a.txt', b'content')
+        upload.sha256 = hashlib.sha256(b'content').hexdigest()
+        name = self.storage.save('a.txt', upload)
+        self.assertTrue(name.endswith(f'{upload.sha256}.txt'))
+        with self.storage.open(name) as file:
+            self.assertEqual(file.read(), b'content')
+
+    def test_legacy_files_are_deleted_directly(self):
+        with open(self.storage.path('legacy.png'), 'wb') as file:
+            file.write(b'legacy')
+        self.storage.delete('legacy.png')
+        self.assertFalse(self.storage.exists('legacy.png'))
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_deleted_rows_release_references(self):
+        user = User.objects.create_user(username='storage')
+        product = Product.objects.create(name='Storage', created_by=user)
+        images = [
+            ProductImage.objects.create(product=product, image=make_image_file(name))
+            for name in ('one.png', 'two.png')
+        ]
+        name = images[0].image.name
+        self.assertEqual(images[1].image.name, name)
+        storage = images[0].image.storage
+        with self.captureOnCommitCallbacks(execute=True):
+            images[0].delete()
+        self.assertTrue(storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            images[1].delete()
+        self.assertFalse(storage.exists(name))
+
+    def test_rollback_releases_references(self):
+        with atomic_refs():
+            kept = self.storage.save('kept.txt', ContentFile(b'kept'))
+        with self.assertRaises(RuntimeError):
+            with atomic_refs():
+                self.storage.save('a.txt', ContentFile(b'kept'))
+                with atomic_refs():
+                    name = self.storage.save('b.txt', ContentFile(b'rolled back'))
+                raise RuntimeError
+        self.assertEqual(self.refs(kept), 1)
+        self.assertFalse(self.storage.exists(name))
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_replaced_and_cleared_files_release_references(self):
+        user = User.objects.create_user(username='storage')
+        order = Order.objects.create(user=user, receipt=ContentFile(b'first', name='first.txt'))
+        first = order.receipt.name
+        storage = order.receipt.storage
+
+        order = Order.objects.get(pk=order.pk)
+        order.receipt = ContentFile(b'second', name='second.txt')
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        second = order.receipt.name
+        self.assertFalse(storage.exists(first))
+        self.assertTrue(storage.exists(second))
+
+        # тот же файл ещё раз: ссылка одна, как и строка
+        order.receipt = ContentFile(b'second', name='again.txt')
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        with storage.open(second + '.refs') as file:
+            self.assertEqual(int(file.read()), 1)
+
+        order.receipt = None
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+        self.assertFalse(storage.exists(second))
@@ -0,0 +1,218 @@
+"""
+Уменьшенные копии ``Product.preview`` и ``ProductImage.image``.
+
+После загрузки картинки и коммита транзакции её байты уходят в пул
+процессов (см. ``imaging``). Готовые копии нескольких ширин в WebP/JPEG
+отдельный поток пишет в ``default_storage`` под ``thumbnails/`` вместе
+с манифестом и в ``Product.preview_variants``: API читает их вместе
+со строкой товара, без обращения к кэшу на каждую строку. Товар при
+этом считается изменённым (``updated_at`` и версия товаров), так что
+кэши страниц и API подхватывают ``srcset``. Пока манифеста нет,
+шаблоны и API отдают исходную картинку.
+
+Настройки: ``SHOPAPP_THUMBNAIL_SIZES``, ``SHOPAPP_THUMBNAIL_FORMATS``,
+``SHOPAPP_THUMBNAIL_QUALITY`` и ``SHOPAPP_THUMBNAIL_WORKERS``
+(0 - считать копии прямо в процессе, без пула).
+"""
+
+import json
+import logging
+import multiprocessing
+import posixpath
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from hashlib import md5
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage, default_storage
+from django.db import connections, transaction
+
+from .imaging import FORMATS, Variant, render_variants
+from .models import Product
+from .versions import PRODUCTS, bump_version
+
+logger = logging.getLogger(__name__)
+
+THUMBNAILS_DIR = 'thumbnails'
+MANIFEST_NAME = 'manifest.json'
+MIME_TYPES = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+# пока копий нет, манифест перечитывается не чаще раза в минуту
+MISSING_TIMEOUT = 60
+
+# формат -> [(ширина, имя файла), ...] по возрастанию ширины
+Variants = Dict[str, List[Tuple[int, str]]]
+
+_pool: Optional[ProcessPoolExecutor] = None
+# сохраняет готовые копии, чтобы служебный поток пула не ждал хранилище и базу
+_finisher: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_thumbnail_settings() -> dict:
+    return {
+        'SIZES': tuple(getattr(settings, 'SHOPAPP_THUMBNAIL_SIZES', (160, 320, 640, 1280))),
+        'FORMATS': tuple(getattr(settings, 'SHOPAPP_THUMBNAIL_FORMATS', ('webp', 'jpeg'))),
+        'QUALITY': getattr(settings, 'SHOPAPP_THUMBNAIL_QUALITY', 80),
+        'WORKERS': getattr(settings, 'SHOPAPP_THUMBNAIL_WORKERS', 2),
+    }
+
+
+def make_pool(workers: Optional[int]) -> ProcessPoolExecutor:
+    # spawn: дочерним процессам не достаются потоки и соединения с базой родителя
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = make_pool(get_thumbnail_settings()['WORKERS'])
+        return _pool
+
+
+def get_finisher() -> ThreadPoolExecutor:
+    global _finisher
+    with _pool_lock:
+        if _finisher is None:
+            _finisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='thumbnails')
+        return _finisher
+
+
+def variants_dir(source: str) -> str:
+    stem, _ = posixpath.splitext(source)
+    return posixpath.join(THUMBNAILS_DIR, stem)
+
+
+def variant_name(source: str, width: int, fmt: str) -> str:
+    extension, _ = FORMATS[fmt]
+    return posixpath.join(variants_dir(source), f'{width}w.{extension}')
+
+
+def manifest_name(source: str) -> str:
+    return posixpath.join(variants_dir(source), MANIFEST_NAME)
+
+
+def _cache_key(source: str) -> str:
+    return f'shopapp:thumbnails:{md5(source.encode()).hexdigest()}'
+
+
+def read_manifest(source: str) -> Optional[Variants]:
+    """
+    Копии из манифеста в хранилище; ``None``, если манифеста нет.
+    """
+    name = manifest_name(source)
+    if not default_storage.exists(name):
+        return None
+    with default_storage.open(name) as manifest:
+        return {
+            fmt: [(width, variant) for width, variant in items]
+            for fmt, items in json.load(manifest)['variants'].items()
+        }
+
+
+def get_variants(source: Optional[str]) -> Variants:
+    """
+    Готовые копии картинки ``source``; пустой словарь, пока их нет.
+    """
+    if not source:
+        return {}
+    key = _cache_key(source)
+    variants = cache.get(key)
+    if variants is not None:
+        return variants
+    variants = read_manifest(source)
+    if variants is None:
+        cache.set(key, {}, MISSING_TIMEOUT)
+        return {}
+    cache.set(key, variants, None)
+    return variants
+
+
+def build_srcset(items: List[Tuple[int, str]], build_url: Optional[Callable[[str], str]] = None) -> str:
+    build_url = build_url or default_storage.url
+    return ', '.join(f'{build_url(name)} {width}w' for width, name in items)
+
+
+def _replace(name: str, content: ContentFile) -> str:
+    # имена копий постоянные, а Storage.save() к занятому имени добавит суффикс
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    return default_storage.save(name, content)
+
+
+def save_variants(source: str, rendered: List[Variant]) -> Variants:
+    variants: Variants = {}
+    for width, fmt, data in rendered:
+        name = _replace(variant_name(source, width, fmt), ContentFile(data))
+        variants.setdefault(fmt, []).append((width, name))
+    # манифест пишется последним: по нему видно, что все копии на месте
+    manifest = {'source': source, 'variants': variants}
+    _replace(manifest_name(source), ContentFile(json.dumps(manifest).encode()))
+    cache.set(_cache_key(source), variants, None)
+    return variants
+
+
+def read_source(source: str, storage: Storage = default_storage) -> bytes:
+    with storage.open(source, 'rb') as file:
+        return file.read()
+
+
+def render_source(source: str, storage: Storage = default_storage, config: Optional[dict] = None) -> List[Variant]:
+    config = config or get_thumbnail_settings()
+    return render_variants(read_source(source, storage), config['SIZES'], config['FORMATS'], config['QUALITY'])
+
+
+def store_preview_variants(source: str, product_pk, variants: Variants) -> None:
+    # копии картинки из галереи в строку товара не попадают
+    Product.objects.filter(pk=product_pk, preview=source).update(preview_variants=variants)
+
+
+def touch_products(*pks) -> None:
+    # копии меняют страницу товара и ответ API
+    Product.objects.filter(pk__in=pks).update()
+    bump_version(PRODUCTS)
+
+
+def generate_thumbnails(source: str, product_pk, storage: Storage = default_storage) -> Variants:
+    """
+    Считает и сохраняет копии прямо в текущем процессе.
+    """
+    variants = save_variants(source, render_source(source, storage))
+    store_preview_variants(source, product_pk, variants)
+    touch_products(product_pk)
+    return variants
+
+
+def schedule_thumbnails(source: str, product_pk, storage: Storage = default_storage) -> None:
+    """
+    После коммита отправляет картинку в пул; запрос Pillow не ждёт.
+    """
+    transaction.on_commit(lambda: _submit(source, product_pk, storage))
+
+
+def _submit(source: str, product_pk, storage: Storage) -> None:
+    config = get_thumbnail_settings()
+    if not config['WORKERS']:
+        generate_thumbnails(source, product_pk, storage)
+        return
+    future = get_pool().submit(
+        render_variants, read_source(source, storage), config['SIZES'], config['FORMATS'], config['QUALITY'],
+    )
+    future.add_done_callback(lambda done: get_finisher().submit(_finish, source, product_pk, done))
+
+
+def _finish(source: str, product_pk, future: Future) -> None:
+    # поток get_finisher(): соединение с базой у него своё
+    try:
+        store_preview_variants(source, product_pk, save_variants(source, future.result()))
+        touch_products(product_pk)
+    except Exception:
+        logger.exception('Failed to generate thumbnails for %s', source)
+    finally:
+        connections.close_all()
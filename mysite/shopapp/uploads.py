@@ -0,0 +1,125 @@
+"""
+Пакетная загрузка картинок товара.
+
+Обработчики загрузки (``FILE_UPLOAD_HANDLERS``) считают SHA-256 файла
+по кускам, пока Django пишет его в память или во временный файл, так что
+повторно файл не читается. Картинки проверяются Pillow параллельно,
+побайтные дубли (в пачке и среди уже загруженных к товару) пропускаются,
+а строки ``ProductImage`` вставляются одним ``bulk_create``.
+"""
+
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from PIL import Image
+
+from .models import Product, ProductImage
+from .thumbnails import schedule_thumbnails, touch_products
+
+VERIFY_WORKERS = getattr(settings, 'SHOPAPP_UPLOAD_VERIFY_WORKERS', 4)
+
+
+class HashingMemoryFileUploadHandler(MemoryFileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        # активный обработчик прерывает new_file() через StopFutureHandlers
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # неактивный обработчик отдаёт данные следующему, тот и посчитает
+        if self.activated:
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+def file_sha256(file: UploadedFile) -> str:
+    """
+    SHA-256 из обработчика загрузки, а для файлов из других мест - по кускам.
+    """
+    digest = getattr(file, 'sha256', None)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        for chunk in file.chunks():
+            sha256.update(chunk)
+        digest = file.sha256 = sha256.hexdigest()
+    return digest
+
+
+def _verify(file: UploadedFile) -> bool:
+    # как в forms.ImageField: verify() читает файл целиком, но не декодирует пиксели
+    try:
+        file.seek(0)
+        with Image.open(file) as image:
+            image.verify()
+            file.content_type = Image.MIME.get(image.format)
+        return True
+    except Exception:
+        return False
+    finally:
+        file.seek(0)
+
+
+def find_invalid_images(files: List[UploadedFile], workers: Optional[int] = None) -> List[UploadedFile]:
+    """
+    Файлы, которые Pillow не признал картинками; проверка идёт в потоках.
+    """
+    if len(files) < 2:
+        return [file for file in files if not _verify(file)]
+    with ThreadPoolExecutor(max_workers=min(workers or VERIFY_WORKERS, len(files))) as pool:
+        return [file for file, valid in zip(files, pool.map(_verify, files)) if not valid]
+
+
+def save_product_images(product: Product, files: List[UploadedFile]) -> List[ProductImage]:
+    """
+    Сохраняет новые картинки товара и возвращает созданные строки.
+
+    Вызывать в ``atomic_refs()``: при ошибке вставки файлы уже лежат в хранилище.
+    """
+    known = set(
+        ProductImage.objects
+        .filter(product=product, sha256__in=[file_sha256(file) for file in files])
+        .values_list('sha256', flat=True)
+    )
+    images = []
+    for file in files:
+        digest = file_sha256(file)
+        if digest in known:
+            continue
+        known.add(digest)
+        image = ProductImage(product=product, sha256=digest)
+        image.image.save(file.name, file, save=False)
+        images.append(image)
+    if not images:
+        return []
+
+    # bulk_create не шлёт сигналов: копии и версия товаров - вручную
+    ProductImage.objects.bulk_create(images)
+    touch_products(product.pk)
+    for image in images:
+        schedule_thumbnails(image.image.name, product.pk, image.image.storage)
+    return images
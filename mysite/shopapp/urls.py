@@ -17,6 +17,13 @@ Including another URLconf
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
+from .async_views import (
+    AsyncProductsListView,
+    AsyncProductDetailsView,
+    AsyncOrdersListView,
+    AsyncProductsDataExportView,
+    AsyncOrdersDataExportView,
+)
 from .views import (
     ShopIndexView,
     GroupsListView,
@@ -32,8 +39,11 @@ from .views import (
     OrderUpdateView,
     OrderDeleteView,
     OrdersDataExportView,
+    ProductsSnapshotView,
+    OrdersSnapshotView,
     ProductViewSet,
     OrderViewSet,
+    ApiCacheStatsView,
 )
 
 app_name = 'shopapp'
@@ -45,6 +55,7 @@ routers.register('orders', OrderViewSet)
 
 urlpatterns = [
     path('api/', include(routers.urls), name='api'),
+    path('api-cache/stats/', ApiCacheStatsView.as_view(), name='api_cache_stats'),
 
     path('', ShopIndexView.as_view(), name='index'),
 
@@ -53,6 +64,7 @@ urlpatterns = [
     path('products/', ProductsListView.as_view(), name='products_list'),
     path('products/create/', ProductCreateView.as_view(), name='product_create'),
     path('products/export/', ProductsDataExportView.as_view(), name='products-export'),
+    path('products/export/snapshot/', ProductsSnapshotView.as_view(), name='products-export-snapshot'),
     path("products/<int:pk>/", ProductDetailsView.as_view(), name='product_details'),
     path('products/<int:pk>/update/', ProductUpdateView.as_view(), name='product_update'),
     path('products/<int:pk>/archive/', ProductDeleteView.as_view(), name='product_delete'),
@@ -60,7 +72,14 @@ urlpatterns = [
     path('orders/', OrdersListView.as_view(), name='orders_list'),
     path('orders/create/', OrderCreateView.as_view(), name='order_create'),
     path('orders/export/', OrdersDataExportView.as_view(), name='orders-export'),
+    path('orders/export/snapshot/', OrdersSnapshotView.as_view(), name='orders-export-snapshot'),
     path('orders/<int:pk>/', OrdersDetailView.as_view(), name='order_details'),
     path('orders/<int:pk>/update/', OrderUpdateView.as_view(), name='order_update'),
     path('orders/<int:pk>/delete/', OrderDeleteView.as_view(), name='order_delete'),
+
+    path('async/products/', AsyncProductsListView.as_view(), name='async-product-list'),
+    path('async/products/export/', AsyncProductsDataExportView.as_view(), name='async-products-export'),
+    path('async/products/<int:pk>/', AsyncProductDetailsView.as_view(), name='async-product-detail'),
+    path('async/orders/', AsyncOrdersListView.as_view(), name='async-order-list'),
+    path('async/orders/export/', AsyncOrdersDataExportView.as_view(), name='async-orders-export'),
 ]
@@ -0,0 +1,100 @@
+"""
+Версии таблиц магазина.
+
+Каждая запись в ``Product``/``Order`` увеличивает счётчик в ``TableVersion``.
+Источник истины - база, а в кэше лежит копия, чтобы чтение версии
+на горячем пути не стоило запроса. При кэше, общем для всех процессов
+(Redis, Memcached), версия точная и живёт в кэше без срока. При
+``LocMemCache`` у каждого процесса своя копия, и сброс после коммита
+видит только процесс, который писал, поэтому по умолчанию копия живёт
+``LOCAL_VERSION_CACHE_TIMEOUT`` секунд: столько другие воркеры могут
+отдавать устаревшие данные.
+"""
+
+from datetime import datetime
+from typing import Tuple
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import TableVersion
+
+PRODUCTS = 'product'
+ORDERS = 'order'
+
+LOCAL_VERSION_CACHE_TIMEOUT = 5
+
+VERSION_CACHE_TIMEOUT = getattr(
+    settings,
+    'SHOPAPP_VERSION_CACHE_TIMEOUT',
+    LOCAL_VERSION_CACHE_TIMEOUT if isinstance(caches['default'], LocMemCache) else None,
+)
+
+
+def _cache_key(name: str) -> str:
+    return f'shopapp:version:{name}'
+
+
+def get_version_info(name: str, use_cache: bool = True) -> Tuple[int, datetime]:
+    """
+    Текущая версия таблицы и время её последнего изменения.
+
+    ``use_cache=False`` читает версию прямо из базы, например
+    в долгоживущем воркере, чей кэш не видит чужих сбросов.
+    """
+    info = cache.get(_cache_key(name)) if use_cache else None
+    if info is None:
+        row = TableVersion.objects.filter(name=name).values_list('version', 'changed_at').first()
+        if row is None:
+            row = (0, timezone.now())
+        info = tuple(row)
+        cache.set(_cache_key(name), info, VERSION_CACHE_TIMEOUT)
+    return info
+
+
+def get_version(name: str, use_cache: bool = True) -> int:
+    return get_version_info(name, use_cache)[0]
+
+
+async def aget_version_info(name: str, use_cache: bool = True) -> Tuple[int, datetime]:
+    info = await cache.aget(_cache_key(name)) if use_cache else None
+    if info is None:
+        row = await TableVersion.objects.filter(name=name).values_list('version', 'changed_at').afirst()
+        if row is None:
+            row = (0, timezone.now())
+        info = tuple(row)
+        await cache.aset(_cache_key(name), info, VERSION_CACHE_TIMEOUT)
+    return info
+
+
+async def aget_version(name: str, use_cache: bool = True) -> int:
+    return (await aget_version_info(name, use_cache))[0]
+
+
+def bump_version(*names: str) -> None:
+    """
+    Отмечает, что таблицы ``names`` изменились.
+
+    Счётчик увеличивается в текущей транзакции, а копия в кэше
+    сбрасывается только после коммита, чтобы никто не успел
+    закэшировать старые данные под новой версией.
+    """
+    for name in names:
+        updated = TableVersion.objects.filter(name=name).update(
+            version=F('version') + 1,
+            changed_at=timezone.now(),
+        )
+        if not updated:
+            try:
+                with transaction.atomic():
+                    TableVersion.objects.create(name=name, version=1)
+            except IntegrityError:
+                TableVersion.objects.filter(name=name).update(
+                    version=F('version') + 1,
+                    changed_at=timezone.now(),
+                )
+        transaction.on_commit(lambda name=name: cache.delete(_cache_key(name)))
@@ -8,32 +8,68 @@ from timeit import default_timer
 
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import Group
-from django.http import HttpResponse, HttpRequest, HttpResponseRedirect, JsonResponse
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, HttpRequest, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, reverse, get_object_or_404
+from django.db.models import Max, Prefetch
 from django.urls import reverse_lazy
+from django.utils.translation import get_language
 from django.views import View
 from django.views.generic import TemplateView, ListView, DetailView, CreateView, UpdateView, DeleteView
 from docutils.nodes import description
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Product, Order, ProductImage
+from mysite.storage import atomic_refs
+
+from .bulk import BulkWriteMixin, BulkArchiveMixin
+from .caching import CachedReadMixin, get_api_cache_stats
+from .conditional import ConditionalDetailMixin, ConditionalReadMixin, make_etag
+from .fastpath import FastReadMixin
+from .filters import OrderFilter
+from .exports import get_export_format, iter_products_rows, iter_orders_rows, streaming_export_response
+from .pagination import KeysetPagination
+from .pagecache import AnonymousPageCacheMixin
+from .search import FullTextSearchFilter
+from .models import Product, Order, ExportJob
 from .forms import ProductForm, OrderForm, GroupForm
 from .serializers import ProductSerializer, OrderSerializer
-from drf_spectacular.utils import extend_schema, OpenApiResponse
+from .snapshots import snapshot_response
+from .uploads import save_product_images
+from .sparse import SparseFieldsetViewMixin, SPARSE_FIELDS_PARAMETERS
+from .versions import PRODUCTS, ORDERS, get_version
+from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiResponse
 
 
 @extend_schema(description='Product views CRUD')
-class ProductViewSet(ModelViewSet):
+@extend_schema_view(
+    list=extend_schema(parameters=SPARSE_FIELDS_PARAMETERS),
+)
+class ProductViewSet(
+    ConditionalReadMixin,
+    CachedReadMixin,
+    FastReadMixin,
+    SparseFieldsetViewMixin,
+    BulkWriteMixin,
+    BulkArchiveMixin,
+    ModelViewSet,
+):
     """
     Набор представлений для действий над Product
     Полный CRUD для сущностей товара
+    Ответы list/retrieve кэшируются до следующего изменения товаров
+    и поддерживают условные запросы (ETag/Last-Modified)
     """
+    cache_version_table = PRODUCTS
+    bulk_version_table = PRODUCTS
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
     filter_backends = [
-        SearchFilter,
+        FullTextSearchFilter,
         DjangoFilterBackend,
         OrderingFilter,
     ]
@@ -45,6 +81,7 @@ class ProductViewSet(ModelViewSet):
         'name',
         'price',
         'discount',
+        'created_at',
     ]
 
     filterset_fields = [
@@ -58,6 +95,7 @@ class ProductViewSet(ModelViewSet):
     @extend_schema(
         summary='Get one product by ID',
         description='Retrieves **product**, returns 404 if not found',
+        parameters=SPARSE_FIELDS_PARAMETERS,
         responses={
             200: ProductSerializer,
             400: OpenApiResponse(description='Empty response, product by id not found'),
@@ -67,9 +105,24 @@ class ProductViewSet(ModelViewSet):
         return super().retrieve(*args, **kwargs)
 
 
-class OrderViewSet(ModelViewSet):
-    queryset = Order.objects.all()
+@extend_schema_view(
+    list=extend_schema(parameters=SPARSE_FIELDS_PARAMETERS),
+    retrieve=extend_schema(parameters=SPARSE_FIELDS_PARAMETERS),
+)
+class OrderViewSet(ConditionalReadMixin, FastReadMixin, SparseFieldsetViewMixin, BulkWriteMixin, ModelViewSet):
+    """
+    Набор представлений для действий над Order
+    Страница заказов стоит постоянное число запросов: пользователь
+    подтягивается JOIN-ом, товары - одним запросом на страницу
+    """
+    bulk_version_table = ORDERS
+    queryset = (
+        Order.objects
+        .select_related('user')
+        .prefetch_related(Prefetch('products', queryset=Product.objects.only('pk')))
+    )
     serializer_class = OrderSerializer
+    pagination_class = KeysetPagination
     filter_backends = [
         SearchFilter,
         DjangoFilterBackend,
@@ -85,16 +138,8 @@ class OrderViewSet(ModelViewSet):
         'promocode',
         'created_at',
         'user',
-        'products',
-    ]
-
-    filterset_fields = [
-        'delivery_address',
-        'promocode',
-        'created_at',
-        'user',
-        'products',
     ]
+    filterset_class = OrderFilter
 
 
 class ShopIndexView(View):
@@ -128,11 +173,18 @@ class GroupsListView(View):
         return redirect(request.path)
 
 
-class ProductDetailsView(DetailView):
+class ProductDetailsView(AnonymousPageCacheMixin, ConditionalDetailMixin, DetailView):
     template_name = 'shopapp/product-details.html'
     # model = Product
     context_object_name = 'product'
     queryset = Product.objects.prefetch_related('images')
+
+    def get_validators(self):
+        # картинки сдвигают updated_at товара (см. signals)
+        updated_at = Product.objects.filter(pk=self.kwargs['pk']).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return None
+        return make_etag(['product', self.kwargs['pk'], updated_at.isoformat(), get_language()]), updated_at
     # Product.objects.filter(archived=False),
 
     # def get(self, request: HttpRequest, pk: int) -> HttpResponse:
@@ -144,21 +196,68 @@ class ProductDetailsView(DetailView):
     #     return render(request, 'shopapp/product-details.html', context=context)
 
 
-class ProductsListView(ListView):
+class ProductsListView(AnonymousPageCacheMixin, ListView):
+    """
+    Витрина активных товаров.
+
+    Страницы по курсору (``KeysetPagination``), автор товара приходит
+    тем же запросом, а из таблицы читаются только показанные поля.
+    Число товаров кэшируется до следующего изменения таблицы товаров,
+    карточка - до изменения своего товара (``updated_at``), а анонимам
+    вся страница отдаётся из кэша (см. ``pagecache``).
+    """
     template_name = 'shopapp/products-list.html'
     # model = Product
     context_object_name = 'products'
+    paginate_by = 20
+    ordering_fields = ['name', 'price']
+    card_cache_timeout = 60 * 60
     queryset = (
-        Product.objects.filter(archived=False)
+        Product.objects
+        .filter(archived=False)
+        .select_related('created_by')
+        .only('name', 'price', 'discount', 'preview', 'updated_at', 'created_by__username')
     )
 
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPagination()
+        paginator.page_size = page_size
+        try:
+            products = paginator.paginate_queryset(queryset, Request(self.request), view=self)
+        except NotFound:
+            raise Http404(KeysetPagination.invalid_cursor_message)
+        return paginator, None, products, paginator.has_next or paginator.has_previous
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['products_count'] = cache.get_or_set(
+            f'shopapp:products_list:count:{get_version(PRODUCTS)}',
+            self.get_queryset().count,
+            self.card_cache_timeout,
+        )
+        context['card_cache_timeout'] = self.card_cache_timeout
+        return context
+
     # def get_context_data(self, **kwargs):
     #     context = super().get_context_data(**kwargs)
     #     context['products'] = Product.objects.all()
     #     return context
 
 
-class ProductCreateView(PermissionRequiredMixin, CreateView):
+class ProductImagesFormMixin:
+    """
+    Картинки из поля ``images`` сохраняются одной пачкой без дублей
+    (см. ``uploads``), в одной транзакции с товаром. При откате ссылки
+    на уже записанные файлы снимаются.
+    """
+    def form_valid(self, form):
+        with atomic_refs():
+            response = super().form_valid(form)
+            save_product_images(self.object, form.cleaned_data['images'])
+        return response
+
+
+class ProductCreateView(PermissionRequiredMixin, ProductImagesFormMixin, CreateView):
     permission_required = 'shopapp.add_product'
 
     # def test_func(self):
@@ -187,7 +286,7 @@ class ProductCreateView(PermissionRequiredMixin, CreateView):
     #     return redirect(request.path)
 
 
-class ProductUpdateView(UserPassesTestMixin, UpdateView):
+class ProductUpdateView(UserPassesTestMixin, ProductImagesFormMixin, UpdateView):
     def test_func(self):
         product = self.get_object()
         user = self.request.user
@@ -205,15 +304,6 @@ class ProductUpdateView(UserPassesTestMixin, UpdateView):
             kwargs={'pk': self.object.pk}
         )
 
-    def form_valid(self, form):
-        response = super().form_valid(form)
-        for image in form.files.getlist('images'):
-            ProductImage.objects.create(
-                product=self.object,
-                image=image,
-            )
-        return response
-
 
 class ProductDeleteView(DeleteView):
     model = Product
@@ -235,12 +325,28 @@ class OrdersListView(LoginRequiredMixin, ListView):
     )
 
 
-class OrdersDetailView(PermissionRequiredMixin, DetailView):
+class OrdersDetailView(PermissionRequiredMixin, ConditionalDetailMixin, DetailView):
     permission_required = 'shopapp.view_order'
     queryset = (
         Order.objects.select_related('user').prefetch_related('products')
     )
 
+    def get_validators(self):
+        # на странице названия и цены товаров, поэтому учитываются и их изменения
+        row = (
+            Order.objects
+            .filter(pk=self.kwargs['pk'])
+            .values('pk')
+            .annotate(products_updated_at=Max('products__updated_at'))
+            .values_list('updated_at', 'products_updated_at')
+            .first()
+        )
+        if row is None:
+            return None
+        last_modified = max(value for value in row if value is not None)
+        etag = make_etag(['order', self.kwargs['pk'], *(value and value.isoformat() for value in row)])
+        return etag, last_modified
+
 
 class OrderCreateView(CreateView):
     model = Order
@@ -267,37 +373,52 @@ class OrderDeleteView(DeleteView):
 
 
 class ProductsDataExportView(View):
-    def get(self, request: HttpRequest) -> JsonResponse:
-        products = Product.objects.order_by('pk').all()
-        products_data = [
-            {
-                'pk': product.pk,
-                'name': product.name,
-                'price': product.price,
-                'archived': product.archived,
-            }
-            for product in products
-        ]
-        return JsonResponse({'products': products_data})
+    """
+    Выгрузка товаров потоком: ``?format=json`` (по умолчанию) или ``?format=ndjson``.
+    """
+    def get(self, request: HttpRequest) -> StreamingHttpResponse:
+        return streaming_export_response(
+            'products',
+            iter_products_rows(),
+            export_format=get_export_format(request),
+        )
 
 
 class OrdersDataExportView(UserPassesTestMixin, View):
     def test_func(self):
         return self.request.user.is_staff
 
+    def get(self, request: HttpRequest) -> StreamingHttpResponse:
+        return streaming_export_response(
+            'orders',
+            iter_orders_rows(),
+            export_format=get_export_format(request),
+        )
+
+
+class ProductsSnapshotView(View):
+    """
+    Последний снимок выгрузки товаров с диска, 304 если он не изменился.
+    """
+    def get(self, request: HttpRequest) -> HttpResponse:
+        return snapshot_response(request, ExportJob.KIND_PRODUCTS)
+
+
+class OrdersSnapshotView(UserPassesTestMixin, View):
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        return snapshot_response(request, ExportJob.KIND_ORDERS)
+
+
+class ApiCacheStatsView(UserPassesTestMixin, View):
+    def test_func(self):
+        return self.request.user.is_staff
+
     def get(self, request: HttpRequest) -> JsonResponse:
-        orders = Order.objects.order_by('pk').all()
-        orders_data = [
-            {
-                'pk': order.pk,
-                'delivery_address': order.delivery_address,
-                'promocode': order.promocode,
-                'user_id': order.user_id,
-                'products_id': [product.id for product in order.products.all()]
-            }
-            for order in orders
-        ]
-        return JsonResponse({"orders": orders_data})
+        return JsonResponse(get_api_cache_stats())
+
 
 # def create_order(request: HttpRequest) -> HttpResponse:
 #     if request.method == 'POST':